@@ -0,0 +1,239 @@
+"""benchmarks/pipeline.py
+
+Benchmarks the build, import, balance, place and save stages over scalable
+synthetic workloads and the example netlists, and writes the results as JSON.
+
+Usage: python benchmarks/pipeline.py [--quick] [--workloads adder,alu,...] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from cm2.circuitry.core import PARALLEL_SAVE_MIN, Module
+from cm2.circuitry.hdl import json_to_module
+from cm2.modules.stdm import Adder, Decoder, Mux, RingCounter
+
+NETLISTS = {
+    "alu": (os.path.join(ROOT, "examples/verilog/alu/build/ALU.json"), "ALU"),
+    "life": (os.path.join(ROOT, "examples/verilog/game_of_life/build/life.json"), "life"),
+}
+
+# Parameters of each synthetic workload, as (full, quick) scaling curves
+SYNTHETIC: Dict[str, Tuple[Callable[..., Module], List[Dict[str, int]], List[Dict[str, int]]]] = {
+    "adder": (
+        lambda size: Adder("adder", size),
+        [{"size": n} for n in (8, 16, 32, 64)],
+        [{"size": n} for n in (8, 16)]
+    ),
+    "decoder": (
+        lambda size: Decoder("decoder", size),
+        [{"size": n} for n in (4, 6, 8, 10, 12)],
+        [{"size": n} for n in (4, 8)]
+    ),
+    "mux": (
+        lambda data, addr: Mux("mux", data, addr),
+        [{"data": d, "addr": a} for d, a in ((8, 2), (8, 4), (16, 6), (32, 8))],
+        [{"data": d, "addr": a} for d, a in ((8, 2), (8, 4))]
+    ),
+    "ring": (
+        lambda size: RingCounter("ring", size),
+        [{"size": n} for n in (16, 64, 256, 1024)],
+        [{"size": n} for n in (16, 64)]
+    ),
+}
+
+# Preconditions some workloads don't meet, e.g. balancing a module without an output
+# port or auto placing the hierarchical ports of stdm builders. Any other failure is
+# recorded as an error and fails the run
+SKIPPED_ASSERTIONS = (
+    "Module doesn't have input port defined",
+    "Module doesn't have output port defined",
+    "port doesn't exist",
+)
+
+# Deep netlists make the recursive arrival time analysis go past the default limits
+STACK_SIZE = 512 * 1024 * 1024
+RECURSION_LIMIT = 1000000
+
+def count(module: Module) -> Tuple[int, int]:
+    return len(module.get_block_indexes()), len(module.wires)
+
+def run_stage(fn: Callable[[], Any], trace_memory: bool) -> Tuple[Any, float, Optional[int]]:
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result, seconds, peak
+
+def run_pipeline(build: Callable[[], Module], build_stage: str, trace_memory: bool, savepath: str,
+                 workers: int) -> List[Dict[str, Any]]:
+    """
+    Runs build/import -> balance -> place -> save -> incremental save -> full saves with
+    one and with workers processes on a fresh module. The parallel save reports its
+    speedup over the sequential one, and whether the module was big enough
+    (PARALLEL_SAVE_MIN fragments) for the workers to start.
+    """
+    random.seed(0) # Names from random_id
+    stages: List[Dict[str, Any]] = []
+
+    def record(stage: str, fn: Callable[[], Any], module: Optional[Module]) -> Any:
+        try:
+            result, seconds, peak = run_stage(fn, trace_memory)
+        except Exception as e:
+            expected = isinstance(e, AssertionError) and any(message in str(e) for message in SKIPPED_ASSERTIONS)
+            stages.append({"stage": stage, "skipped" if expected else "error": f"{type(e).__name__}: {e}"})
+            return None
+        target = module if module is not None else result
+        blocks, wires = count(target)
+        stages.append({
+            "stage": stage,
+            "seconds": seconds,
+            "peak_bytes": peak,
+            "blocks": blocks,
+            "wires": wires,
+            "blocks_per_second": blocks / seconds if seconds > 0 else None,
+            "wires_per_second": wires / seconds if seconds > 0 else None
+        })
+        return result
+
+    module = record(build_stage, build, None)
+    if module is None:
+        return stages
+    record("balance", module.auto_balance, module)
+    record("place", module.auto_place, module)
+    record("save", lambda: module.save(savepath), module)
+
+    def touch_and_save():
+        block = next(iter(module.blocks.values()))
+        block.set_pos((block.pos.x, block.pos.y + 1, block.pos.z))
+        return module.save(savepath)
+    record("save_incremental", touch_and_save, module)
+
+    def save_all(workers: int):
+        module.mark_dirty()
+        return module.save(savepath, workers=workers)
+    record("save_sequential", lambda: save_all(1), module)
+    record("save_parallel", lambda: save_all(workers), module)
+    sequential, parallel = stages[-2], stages[-1]
+    if "seconds" in sequential and "seconds" in parallel:
+        parallel["workers"] = workers
+        parallel["pooled"] = workers > 1 and len(module.blocks) + len(module.wires) >= PARALLEL_SAVE_MIN
+        parallel["speedup"] = sequential["seconds"] / parallel["seconds"] if parallel["seconds"] > 0 else None
+    return stages
+
+def run_in_big_stack(fn: Callable[[], Any]) -> Any:
+    result: Dict[str, Any] = {}
+
+    def target():
+        try:
+            result["value"] = fn()
+        except BaseException as e:
+            result["error"] = e
+
+    previous = threading.stack_size(STACK_SIZE)
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        threading.stack_size(previous)
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+def benchmark(name: str, params: Dict[str, Any], build: Callable[[], Module], build_stage: str,
+              memory: bool, savepath: str, workers: int) -> List[Dict[str, Any]]:
+    timed = run_in_big_stack(lambda: run_pipeline(build, build_stage, False, savepath, workers))
+    if memory:
+        traced = run_in_big_stack(lambda: run_pipeline(build, build_stage, True, savepath, workers))
+        peaks = {s["stage"]: s.get("peak_bytes") for s in traced}
+        for s in timed:
+            if "seconds" in s:
+                s["peak_bytes"] = peaks.get(s["stage"])
+    for s in timed:
+        s["workload"] = name
+        s["params"] = params
+    return timed
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--workloads", default=",".join([*SYNTHETIC, *NETLISTS]),
+                        help="comma separated workloads (default: all)")
+    parser.add_argument("--quick", action="store_true", help="run only the small sizes")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run for peak memory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes of the parallel save stage (default: one per core)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(RECURSION_LIMIT)
+    savepath = os.path.join(ROOT, "bench_output.txt")
+
+    results: List[Dict[str, Any]] = []
+    for name in args.workloads.split(","):
+        if name in SYNTHETIC:
+            builder, full, quick = SYNTHETIC[name]
+            for params in (quick if args.quick else full):
+                print(f"{name} {params}", file=sys.stderr)
+                results += benchmark(name, params, lambda: builder(**params), "build", not args.no_memory, savepath,
+                                     args.workers)
+        elif name in NETLISTS:
+            path, top = NETLISTS[name]
+            print(f"{name}", file=sys.stderr)
+            results += benchmark(
+                name, {"netlist": os.path.relpath(path, ROOT)}, lambda: json_to_module(path)[top],
+                "import", not args.no_memory, savepath, args.workers
+            )
+        else:
+            parser.error(f"unknown workload '{name}'")
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+    errors = [s for s in results if "error" in s]
+    for s in errors:
+        print(f"{s['workload']} {s['params']} {s['stage']}: {s['error']}", file=sys.stderr)
+    if errors:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
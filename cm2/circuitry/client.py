@@ -0,0 +1,109 @@
+"""cm2/circuitry/client.py
+
+Thin client of the compile daemon (cm2/circuitry/server.py), taking the same
+arguments as the compile.py of the examples. It only imports the standard
+library, starts the daemon when none is running, and compiles in process
+where Unix sockets aren't available.
+
+Usage: python -m cm2.circuitry.client <json_file> <entry_module> [output] [--socket PATH] [--stop]
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+SERVER_START_SECONDS = 30 # Longest wait for a starting daemon to listen
+
+def default_socket_path() -> str:
+    """Socket of the compile daemon, per user unless CM2_COMPILE_SOCKET is set"""
+    path = os.environ.get("CM2_COMPILE_SOCKET")
+    if path:
+        return path
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"cm2-compile-{user}.sock")
+
+def request(path: str, message: Dict[str, Any]) -> Dict[str, Any]:
+    """Send a request to the daemon and wait for its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall((json.dumps(message) + "\n").encode())
+        with client.makefile("rb") as file:
+            line = file.readline()
+    assert line, "The compile server closed the connection"
+    return json.loads(line)
+
+def start_server(path: str):
+    """Start a daemon in the background and wait until it listens"""
+    import subprocess # Only needed when no daemon runs, so left out of the usual start up
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    subprocess.Popen(
+        [sys.executable, "-m", "cm2.circuitry.server", "--socket", path],
+        env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    deadline = time.monotonic() + SERVER_START_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            request(path, {"command": "ping"})
+            return
+        except OSError:
+            time.sleep(0.02)
+    raise AssertionError(f"The compile server didn't start on '{path}'")
+
+def compile_netlist(path: str, json_file: str, top: str, output: str) -> Dict[str, Any]:
+    message = {
+        "command": "compile",
+        "json": os.path.abspath(json_file),
+        "top": top,
+        "output": os.path.abspath(output)
+    }
+    for _ in range(2): # Once more if the daemon was gone or outdated
+        try:
+            response = request(path, message)
+        except OSError:
+            start_server(path)
+            continue
+        if not response.get("stale"):
+            return response
+        while os.path.exists(path):
+            time.sleep(0.01)
+    return request(path, message)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles a Yosys JSON netlist to a savestring through the compile server")
+    parser.add_argument("json_file", nargs="?")
+    parser.add_argument("entry_module", nargs="?")
+    parser.add_argument("output", nargs="?", default="build.txt")
+    parser.add_argument("--socket", default=None, help="socket path (default: per user, in the temp directory)")
+    parser.add_argument("--stop", action="store_true", help="stop the compile server")
+    args = parser.parse_args()
+
+    path = args.socket or default_socket_path()
+    if args.stop:
+        try:
+            request(path, {"command": "stop"})
+        except OSError:
+            pass
+        return
+    if args.json_file is None or args.entry_module is None:
+        parser.error("the json file and entry module are required")
+
+    if not hasattr(socket, "AF_UNIX"):
+        from .server import CompileCache
+        response = dict(CompileCache().compile(os.path.abspath(args.json_file), args.entry_module, args.output))
+    else:
+        response = compile_netlist(path, args.json_file, args.entry_module, args.output)
+    if not response["ok"]:
+        print(response["error"], file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,11 @@ import math
 from enum import IntEnum, Enum
 from types import MappingProxyType
 from cm2.utils import flatten_recursive, random_id
+import copy
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 
 Component: TypeAlias = Union[
     "Block", "Array", "Wire", "Module", "Building", "BuildingWire",
@@ -46,8 +51,16 @@ Primitive: TypeAlias = Union[
 
 RotationOrder: TypeAlias = Literal['xyz', 'xzy', 'yxz', 'yzx', 'zxy', 'zyx']
 
+Voxel: TypeAlias = Tuple[int, int, int]
+
 BIG_INT = 2147483647
 
+TIMING_ATTRIBUTES = ("block_id", "properties", "width") # Block and array attributes that change delays
+LATENCY_MATRIX_CHUNK = 64 # Inputs timed together by Module.get_latency_matrix
+LOGIC_BLOCKS = ("node", "delay", "and", "or", "xor", "nand", "nor", "xnor", "flipflop") # Blocks Module.specialize can fold
+PARALLEL_SAVE_MIN = 16384 # Fewest fragments to encode for Module.save to start worker processes
+FINGERPRINT_ROUNDS = 32 # Most rounds of Module.fingerprint over every wire, for the wiring inside loops
+
 # Pre-defined block_id definitions
 class BlockID(IntEnum):
     NOR = 0
@@ -71,11 +84,57 @@ class BlockID(IntEnum):
     CONDUCTOR_V2 = 18
     LED_MIXER = 19
 
+# Savestring codes of each block_id, so encoding doesn't go through the enum
+BLOCK_CODES: Dict[str, str] = {block.name.lower(): str(block) for block in BlockID}
+
+def encode_block_id(block_id: str) -> str:
+    code = BLOCK_CODES.get(block_id)
+    if code is None:
+        code = str(BlockID[str.upper(block_id)])
+    return code
+
+def encode_wire_pairs(src: Union[np.ndarray, List[int]], dst: Union[np.ndarray, List[int]]) -> List[str]:
+    """Encode wires from columns of source and destination block indexes"""
+    if isinstance(src, np.ndarray):
+        src = cast(List[int], src.tolist())
+    if isinstance(dst, np.ndarray):
+        dst = cast(List[int], dst.tolist())
+    return list(map("{},{}".format, src, dst))
+
+def encode_block_fragments(blocks: Dict[str, Union["Block", "Array"]], names: List[str]) -> List[str]:
+    return [blocks[name].savestring_encode() for name in names]
+
+def encode_wire_fragments(wires: List["Wire"], block_index: Dict[str, int]) -> List[str]:
+    src = [block_index.get(w.src, 0) for w in wires]
+    dst = [block_index.get(w.dst, 0) for w in wires]
+    if 0 in src or 0 in dst:
+        for w in wires:
+            w.savestring_encode(block_index) # Fails on the first missing block
+    return encode_wire_pairs(src, dst)
+
+# Module and components being saved, set in each forked save worker by _init_save_worker
+_save_job: Optional[Tuple["Module", List[str], List["Wire"]]] = None
+
+def _init_save_worker(job: Tuple["Module", List[str], List["Wire"]]):
+    global _save_job
+    _save_job = job
+
+def _encode_save_shard(shard: Tuple[str, int, int]) -> List[str]:
+    module, names, wires = cast(Tuple["Module", List[str], List["Wire"]], _save_job)
+    kind, start, stop = shard
+    if kind == "blocks":
+        return encode_block_fragments(module.blocks, names[start:stop])
+    return encode_wire_fragments(wires[start:stop], module._block_index)
+
 class BuildingData(Enum):
     HUGE_MEMORY = MappingProxyType({
         "name": "HugeMemory", 
         "nwires": 49, 
         "pos_offset": (17, 0, -3),
+        # Footprint before rotation, centered on the cframe. An estimate, not measured in game
+        # nor taken from the game files: collisions with HugeMemory may be off by a few blocks
+        "size": (7, 1, 35),
+        "data_words": 65536,
         "indexes": {
             "address": 0,
             "output": 16,
@@ -84,6 +143,12 @@ class BuildingData(Enum):
         }
     })
 
+def to_voxel(pos: Union[Tuple[float, float, float], "Vector3"]) -> Voxel:
+    """Grid position of a position, rounding halves up"""
+    if isinstance(pos, Vector3):
+        pos = (pos.x, pos.y, pos.z)
+    return (math.floor(pos[0] + 0.5), math.floor(pos[1] + 0.5), math.floor(pos[2] + 0.5))
+
 class Port(IntEnum):
     OUT = 0
     IN = 1
@@ -225,6 +290,8 @@ class CFrame:
         return f"CFrame(pos={self.pos}, rot={self.rot})"
 
 class Block:
+    _owner: Optional["Module"] = None
+
     def __init__(
             self, 
             name: str, 
@@ -233,22 +300,33 @@ class Block:
             state: bool = False, 
             properties: Optional[List[str]] = None
     ):
-        self.name = name
-        self.block_id = block_id
-        self.state = state
-        self.pos = Vector3(*pos) if pos else Vector3(0, 0, 0)
-        self.properties = properties
+        # A new block has no owner to notify, so skip __setattr__
+        attributes = self.__dict__
+        attributes["name"] = name
+        attributes["block_id"] = block_id
+        attributes["state"] = state
+        attributes["pos"] = Vector3(*pos) if pos else Vector3(0, 0, 0)
+        attributes["properties"] = properties
+
+    def __setattr__(self, key: str, value: Any):
+        object.__setattr__(self, key, value)
+        if self._owner is not None:
+            self._owner._mark_block_dirty(self.name)
+            if key in TIMING_ATTRIBUTES:
+                self._owner._on_timing_change(self.name)
 
     def set_pos(self, pos: Tuple[float, float, float]):
         self.pos = Vector3(*pos)
 
     def savestring_encode(self):
+        x, y, z = self.pos.x, self.pos.y, self.pos.z
+        # round() of an int is the int itself
         savestring_table = [
-            str(BlockID[str.upper(self.block_id)]),
+            encode_block_id(self.block_id),
             ("1" if self.state else "0"),
-            str(round(self.pos.x, 3)),
-            str(round(self.pos.y, 3)),
-            str(round(self.pos.z, 3)),
+            str(x if type(x) is int else round(x, 3)),
+            str(y if type(y) is int else round(y, 3)),
+            str(z if type(z) is int else round(z, 3)),
             ("" if not self.properties else "+".join(self.properties))
         ]
         return ",".join(savestring_table)
@@ -264,6 +342,8 @@ class Block:
         )
 
 class Array:
+    _owner: Optional["Module"] = None
+
     def __init__(
         self, 
         name: str, 
@@ -326,6 +406,39 @@ class Array:
         
         return blocks
 
+    def get_positions(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the x, y and z columns of the expanded blocks' positions"""
+        info = self.info
+        assert self.width, "The size of the array must be defined"
+        i = np.arange(self.width)
+        columns: List[np.ndarray] = []
+        for axis in ("x", "y", "z"):
+            pos = i * info[f"{axis}_step"] + info[f"{axis}_cluster_space"] * (i // info[f"{axis}_cluster"])
+            cycled = (np.abs(pos) % info[f"{axis}_cycle"]) * np.sign(pos)
+            columns.append(getattr(self.pos, axis) + cycled)
+        return columns[0], columns[1], columns[2]
+
+    def savestring_encode(self) -> str:
+        """Encode all expanded blocks at once, same as encoding each of get_blocks()"""
+        if not self.width:
+            return ""
+        prefix = f"{encode_block_id(self.block_id)},{'1' if self.state else '0'}"
+        suffix = "" if not self.properties else "+".join(self.properties)
+        coordinates: List[List[Any]] = []
+        for column in self.get_positions():
+            if column.dtype.kind == "f":
+                column = np.round(column, 3)
+            coordinates.append(column.tolist())
+        xs, ys, zs = coordinates
+        return ";".join([f"{prefix},{x},{y},{z},{suffix}" for x, y, z in zip(xs, ys, zs)])
+
+    def __setattr__(self, key: str, value: Any):
+        object.__setattr__(self, key, value)
+        if self._owner is not None:
+            self._owner._mark_block_dirty(self.name)
+            if key in TIMING_ATTRIBUTES:
+                self._owner._on_timing_change(self.name)
+
     def set_pos(self, pos: Tuple[float, float, float]):
         self.pos = Vector3(*pos)
 
@@ -360,10 +473,25 @@ class Array:
         )
 
 class Wire:
+    _owner: Optional["Module"] = None
+    _name: str = "" # Key of the wire in its module
+
     def __init__(self, src: str, dst: str, inverted: bool = False):
-        self.src = src
-        self.dst = dst
-        self.inverted = inverted
+        # A new wire has no owner to notify, so skip __setattr__
+        attributes = self.__dict__
+        attributes["src"] = src
+        attributes["dst"] = dst
+        attributes["inverted"] = inverted
+
+    def __setattr__(self, key: str, value: Any):
+        owner = self._owner
+        if owner is not None and key in ("src", "dst"):
+            owner._on_wire_timing_change(self) # Summaries of the old ends
+        object.__setattr__(self, key, value)
+        if owner is not None:
+            owner._mark_wire_dirty(self._name)
+            if key in ("src", "dst"):
+                owner._on_wire_timing_change(self)
 
     def savestring_encode(self, block_indexes: Dict[str, int]) -> str:
         assert self.src in block_indexes, f"Source component '{self.src}' not found"
@@ -389,12 +517,16 @@ class ArrayInfo(TypedDict, total=False):
     z_cluster_space: float
 
 class Building():
+    _owner: Optional["Module"] = None
+    data: Optional[str] = None # Memory image file, kept with the module but not saved yet
+
     def __init__(
         self, 
         name: str, 
         building_type: str, 
         cframe: CFrame | Tuple[float, float, float],
-        nwires: int = 0
+        nwires: int = 0,
+        data: Optional[str] = None
     ):
         if isinstance(cframe, Tuple):
             cframe = CFrame(Vector3(*cframe))
@@ -413,10 +545,30 @@ class Building():
             
         self.cframe = cframe
         self.wires: List[List[BuildingWire]] = [[] for _ in range(nwires)]
+        if data is not None:
+            assert "data_words" in BuildingData[str.upper(self.building_type)].value, (
+                f"Building type '{self.building_type}' doesn't take data"
+            )
+            self.data = data
+
+    def __setattr__(self, key: str, value: Any):
+        object.__setattr__(self, key, value)
+        if self._owner is not None:
+            self._owner._mark_building_dirty(self.name)
 
     def set_pos(self, pos: Tuple[float, float, float]):
         self.pos = Vector3(*pos)
 
+    def get_voxels(self) -> List[Voxel]:
+        """Grid positions the building takes, from the size of its type and its rotation"""
+        size = cast(Tuple[int, int, int], BuildingData[str.upper(self.building_type)].value.get("size", (1, 1, 1)))
+        axes = [np.arange(s) - (s - 1) // 2 for s in size]
+        local = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        pos = self.cframe.pos
+        world = local @ np.array(self.cframe.rot, np.float64).T + (pos.x, pos.y, pos.z)
+        voxels = np.unique(np.floor(world + 0.5).astype(np.int64), axis=0)
+        return [cast(Voxel, tuple(v)) for v in voxels.tolist()]
+
     def add_wire(self, building_wire: 'BuildingWire'):
         if isinstance(building_wire.index, str):
             index = cast(int, BuildingData[str.upper(self.building_type)].value[f"{building_wire.index}_index"])
@@ -440,6 +592,9 @@ class Building():
 
             self.wires[index].append(building_wire)
 
+        if self._owner is not None:
+            self._owner._mark_building_dirty(self.name)
+
     def savestring_encode(self, block_indexes: Dict[str, int]) -> str:
         assert isinstance(self.cframe.pos, Vector3)
 
@@ -496,19 +651,481 @@ class BuildingWire():
             f")"
         )
 
+def block_delay(block: Union[Block, Array]) -> int:
+    """Ticks a block takes: nodes 0, delays their property and every other block 1"""
+    if block.block_id == "node":
+        return 0
+    if block.block_id == "delay":
+        assert block.properties
+        return int(block.properties[0])
+    return 1
+
+@dataclass
+class LatencySummary:
+    """
+    Timing of a module seen from its ports: the longest and shortest ticks from
+    each input block to each output block, counting the output block but not
+    the input one (-1 without a path), and the latest arrival at each output
+    from blocks inside the module (-1 if none), as in Module.get_arrival_times
+    """
+    inputs: List[str]
+    outputs: List[str]
+    longest: np.ndarray # inputs x outputs
+    shortest: np.ndarray
+    internal: np.ndarray
+    pins: set[str] = field(init=False, repr=False)
+
+    inputs_set: set[str] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.inputs_set = set(self.inputs)
+        self.pins = self.inputs_set | set(self.outputs)
+
+    def prefixed(self, prefix: str) -> 'LatencySummary':
+        return LatencySummary(
+            [f"{prefix}.{name}" for name in self.inputs],
+            [f"{prefix}.{name}" for name in self.outputs],
+            self.longest, self.shortest, self.internal
+        )
+
+    def is_balanced(self) -> bool:
+        """All paths to an output take the same ticks, from every input reaching it"""
+        reached = self.longest >= 0
+        slowest = self.longest.max(axis=0, initial=-1)
+        return bool(np.all(~reached | ((self.longest == slowest) & (self.shortest == slowest))))
+
+    def get_groups(self) -> List[Tuple[List[int], List[int]]]:
+        """Indexes of the inputs and outputs connected by some path, grouped"""
+        n = len(self.inputs)
+        parent = list(range(n + len(self.outputs)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        output_index = {name: o for o, name in enumerate(self.outputs)}
+        pairs = np.argwhere(self.longest >= 0).tolist()
+        pairs += [[i, output_index[name]] for i, name in enumerate(self.inputs) if name in output_index]
+        for i, o in pairs:
+            parent[find(i)] = find(n + o)
+
+        groups: Dict[int, Tuple[List[int], List[int]]] = {}
+        for k in range(len(parent)):
+            inputs, outputs = groups.setdefault(find(k), ([], []))
+            (inputs if k < n else outputs).append(k if k < n else k - n)
+        return list(groups.values())
+
+class _TimingGraph:
+    """
+    Expanded block graph of a module, where the pins of each summarized instance
+    are grouped by LatencySummary.get_groups and every group is a single node,
+    timed through the summary instead of the blocks inside the instance
+    """
+
+    def __init__(self, module: "Module", instances: Dict[str, LatencySummary]):
+        self.delays: Dict[str, int] = {}
+        self.node_of: Dict[str, Any] = {} # Block name -> graph node, itself or its group
+        self.instance_of: Dict[str, str] = {} # Pin -> instance prefix
+        self.groups: Dict[Tuple[str, int], Tuple[LatencySummary, List[int], List[int]]] = {}
+        self.driven_outputs: set[str] = set() # Instances with output pins driven from outside
+
+        summary_of = module._summary_of
+        for k, c in module.blocks.items():
+            if summary_of.get(k) in instances:
+                continue
+            delay = block_delay(c)
+            if isinstance(c, Array):
+                for i in range(c.width or 0):
+                    self.delays[f"{k}.{i}"] = delay
+                    self.node_of[f"{k}.{i}"] = f"{k}.{i}"
+            else:
+                self.delays[k] = delay
+                self.node_of[k] = k
+
+        for prefix, summary in instances.items():
+            for name in summary.pins:
+                component = module.blocks.get(name) or module.blocks[name.rpartition(".")[0]]
+                self.delays[name] = block_delay(component)
+                self.instance_of[name] = prefix
+            for g, (inputs, outputs) in enumerate(summary.get_groups()):
+                self.groups[(prefix, g)] = (summary, inputs, outputs)
+                for i in inputs:
+                    self.node_of[summary.inputs[i]] = (prefix, g)
+                for o in outputs:
+                    self.node_of[summary.outputs[o]] = (prefix, g)
+
+        # Sources of the wires into every block, without the wires inside instances
+        self.wires_into: Dict[str, List[str]] = {name: [] for name in self.delays}
+        for w in module.wires.values():
+            if w.src not in self.node_of or w.dst not in self.node_of:
+                continue
+            instance = self.instance_of.get(w.dst)
+            if instance is not None:
+                if instance == self.instance_of.get(w.src):
+                    continue
+                if w.dst not in instances[instance].inputs_set:
+                    self.driven_outputs.add(instance)
+            self.wires_into[w.dst].append(w.src)
+        for name, sources in self.wires_into.items():
+            if len(sources) > 1:
+                self.wires_into[name] = list(dict.fromkeys(sources))
+
+        self.order, self.back_edges = self._get_order()
+
+    def _node_inputs(self, node: Any) -> List[str]:
+        if node in self.groups:
+            summary, inputs, outputs = self.groups[node]
+            pins = [summary.inputs[i] for i in inputs] + [summary.outputs[o] for o in outputs]
+            return [src for pin in pins for src in self.wires_into[pin]]
+        return self.wires_into[node]
+
+    def _get_order(self) -> Tuple[List[Any], set[Tuple[str, Any]]]:
+        """Nodes with their inputs first, and the wires closing loops, as (source, node)"""
+        order: List[Any] = []
+        done: set[Any] = set()
+        visiting: set[Any] = set()
+        back_edges: set[Tuple[str, Any]] = set()
+        for root in [*dict.fromkeys(self.node_of.values())]:
+            if root in done:
+                continue
+            stack: List[Tuple[Any, List[str], int]] = [(root, self._node_inputs(root), 0)]
+            visiting.add(root)
+            while stack:
+                node, inputs, i = stack[-1]
+                if i < len(inputs):
+                    stack[-1] = (node, inputs, i + 1)
+                    src_node = self.node_of[inputs[i]]
+                    if src_node in visiting:
+                        back_edges.add((inputs[i], node))
+                    elif src_node not in done:
+                        visiting.add(src_node)
+                        stack.append((src_node, self._node_inputs(src_node), 0))
+                    continue
+                stack.pop()
+                visiting.discard(node)
+                done.add(node)
+                order.append(node)
+        return order, back_edges
+
+    def forward_sources(self, name: str) -> List[str]:
+        """Sources of the wires into a block that don't close a loop"""
+        node = self.node_of[name]
+        return [src for src in self.wires_into[name] if (src, node) not in self.back_edges]
+
+    def source_arrival(self, name: str) -> int:
+        """Arrival of a block with no forward inputs: 0 for sources, its delay after a loop"""
+        return self.delays[name] if self.wires_into[name] else 0
+
+MASK64 = (1 << 64) - 1
+FINGERPRINT_KEYS = (
+    0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9, 0xd6e8feb86659fd93, 0xff51afd7ed558ccd
+) # Keep the hashes mixed in each direction apart
+
+def hash_label(value: Any) -> int:
+    """Stable 64 bit hash of a tuple of strings and numbers"""
+    return int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), "little")
+
+def mix64(x: int) -> int:
+    """Finalizer of splitmix64"""
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & MASK64
+    return x ^ (x >> 31)
+
+def mix64_array(x: np.ndarray) -> np.ndarray:
+    """mix64 of every element of an uint64 array"""
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+def _strongly_connected(start: List[int], targets: List[int]) -> Tuple[List[int], int]:
+    """
+    Strongly connected component of every node and the number of components, by
+    Tarjan's algorithm without recursion, over the edges to targets[start[v]:start[v + 1]]
+    of each node v. Components are numbered sinks first.
+    """
+    n = len(start) - 1
+    order = [-1] * n
+    low = [0] * n
+    comp = [-1] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    counter = 0
+    ncomp = 0
+    for root in range(n):
+        if order[root] != -1:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, start[root])]
+        while work:
+            v, i = work[-1]
+            if i < start[v + 1]:
+                work[-1] = (v, i + 1)
+                w = targets[i]
+                if order[w] == -1:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, start[w]))
+                elif on_stack[w] and order[w] < low[v]:
+                    low[v] = order[w]
+                continue
+
+            work.pop()
+            if work and low[v] < low[work[-1][0]]:
+                low[work[-1][0]] = low[v]
+            if low[v] == order[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    comp[w] = ncomp
+                    if w == v:
+                        break
+                ncomp += 1
+    return comp, ncomp
+
+class ComponentDict(Dict[str, Any]):
+    """
+    Dict of module components that reports every insertion and removal
+    to its owner, so cached savestring fragments can be kept up to date.
+    """
+    def __init__(self, on_set: Any, on_del: Any, items: Optional[Dict[str, Any]] = None):
+        super().__init__(items or {})
+        self.on_set = on_set
+        self.on_del = on_del
+
+    def __setitem__(self, key: str, value: Any):
+        dict.__setitem__(self, key, value)
+        self.on_set(key, value)
+
+    def __delitem__(self, key: str):
+        value = self[key]
+        dict.__delitem__(self, key)
+        self.on_del(key, value)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self) -> Tuple[str, Any]:
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args: Any, **kwargs: Any):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def __reduce__(self):
+        return (ComponentDict, (self.on_set, self.on_del, dict(self)))
+
 class Module:
     """
     Base module class.
+
+    Encoded savestring fragments are cached per component and only the
+    components changed since the last `save` are encoded again. Changes
+    made through attribute assignment or the module's dicts are tracked
+    automatically; in-place mutations (e.g. `block.pos.x = 1`) must be
+    reported with `mark_dirty`.
     """
     def __init__(self, name: str="main"):
         self.name = name
-        self.blocks: Dict[str, Union[Block, Array]] = {}
-        self.wires: Dict[str, Wire] = {}
-        self.buildings: Dict[str, Building] = {}
+        self.blocks: Dict[str, Union[Block, Array]] = ComponentDict(self._on_block_set, self._on_block_del)
+        self.wires: Dict[str, Wire] = ComponentDict(self._on_wire_set, self._on_wire_del)
+        self.buildings: Dict[str, Building] = ComponentDict(self._on_building_set, self._on_building_del)
         self.ports: Dict[str, Any] = {}
         self.links: Dict[str, str] = {}
         self.size = None
 
+        # Savestring cache, kept in the same order as the component dicts
+        self._block_fragments: Dict[str, str] = {}
+        self._block_names: Dict[str, List[str]] = {} # Expanded block names of each component
+        self._block_index: Dict[str, int] = {}
+        self._next_index = 1
+        self._wire_fragments: Dict[str, str] = {}
+        self._building_fragments: Dict[str, str] = {}
+        self._dirty_blocks: set[str] = set()
+        self._dirty_wires: set[str] = set()
+        self._dirty_buildings: set[str] = set()
+        self._renumber = False
+
+        # Voxel index of the blocks (arrays expanded) and building footprints,
+        # brought up to date with the components changed since the last query
+        self._voxels: Dict[Voxel, List[str]] = {}
+        self._block_voxels: Dict[str, List[Tuple[Voxel, str]]] = {}
+        self._building_voxels: Dict[str, List[Tuple[Voxel, str]]] = {}
+        self._dirty_block_voxels: set[str] = set()
+        self._dirty_building_voxels: set[str] = set()
+
+        # Timing summary of this module, by the ports it was computed for, and
+        # those of the merged instances unchanged inside since, by prefix. Instance
+        # summaries are worked out on first use, from the ports and links they
+        # were merged with
+        self._latency: Optional[Tuple[Dict[str, Any], LatencySummary]] = None
+        self._summaries: Dict[str, LatencySummary] = {}
+        self._pending_summaries: Dict[str, Tuple[Dict[str, Any], Dict[str, str]]] = {}
+        self._summary_pins: Dict[str, set[str]] = {}
+        self._summary_members: Dict[str, List[str]] = {}
+        self._summary_of: Dict[str, str] = {} # Component name -> prefix of its summarized instance
+
+        # Results worked out from the whole module (specializations, fingerprints) by
+        # their arguments, with the ports they were made for, until the module changes
+        self._derived: Dict[Tuple[Any, ...], Tuple[Dict[str, Any], Any]] = {}
+
+    def _on_block_set(self, name: str, component: Union[Block, Array]):
+        component._owner = self
+        if name not in self._block_fragments:
+            self._block_fragments[name] = ""
+        self._dirty_blocks.add(name)
+        self._dirty_block_voxels.add(name)
+        self._derived.clear()
+        self._on_timing_change(name)
+
+    def _on_block_del(self, name: str, component: Union[Block, Array]):
+        if component._owner is self:
+            component._owner = None
+        self._block_fragments.pop(name, None)
+        self._block_names.pop(name, None)
+        self._dirty_blocks.discard(name)
+        self._dirty_block_voxels.add(name)
+        self._derived.clear()
+        self._on_timing_change(name)
+        self._renumber = True
+
+    def _on_wire_set(self, name: str, wire: Wire):
+        wire.__dict__.update(_owner=self, _name=name)
+        if name not in self._wire_fragments:
+            self._wire_fragments[name] = ""
+        self._dirty_wires.add(name)
+        self._derived.clear()
+        self._on_wire_timing_change(wire)
+
+    def _on_wire_del(self, name: str, wire: Wire):
+        if wire._owner is self:
+            wire.__dict__.update(_owner=None)
+        self._wire_fragments.pop(name, None)
+        self._dirty_wires.discard(name)
+        self._derived.clear()
+        self._on_wire_timing_change(wire)
+
+    def _on_building_set(self, name: str, building: Building):
+        building._owner = self
+        if name not in self._building_fragments:
+            self._building_fragments[name] = ""
+        self._dirty_buildings.add(name)
+        self._dirty_building_voxels.add(name)
+        self._derived.clear()
+
+    def _on_building_del(self, name: str, building: Building):
+        if building._owner is self:
+            building._owner = None
+        self._building_fragments.pop(name, None)
+        self._dirty_buildings.discard(name)
+        self._dirty_building_voxels.add(name)
+        self._derived.clear()
+
+    def _instance_prefix(self, name: str) -> Optional[str]:
+        """Prefix of the summarized instance a block (or array block) belongs to"""
+        prefix = self._summary_of.get(name)
+        if prefix is None:
+            head, _, tail = name.rpartition(".")
+            if tail.isdigit() and isinstance(self.blocks.get(head), Array):
+                prefix = self._summary_of.get(head)
+        return prefix
+
+    def _drop_summary(self, prefix: str):
+        self._summaries.pop(prefix, None)
+        self._pending_summaries.pop(prefix, None)
+        self._summary_pins.pop(prefix, None)
+        for name in self._summary_members.pop(prefix, []):
+            self._summary_of.pop(name, None)
+
+    def _on_timing_change(self, name: str):
+        """A block was added, removed or changed its delay"""
+        self._latency = None
+        if self._summary_of:
+            prefix = self._instance_prefix(name)
+            if prefix is not None:
+                self._drop_summary(prefix)
+
+    def _on_wire_timing_change(self, wire: Wire):
+        """
+        A wire was added or removed. Summaries stay valid for wires between
+        instances that attach to their pins.
+        """
+        self._latency = None
+        if not self._summary_of:
+            return
+        src, dst = self._instance_prefix(wire.src), self._instance_prefix(wire.dst)
+        if src is not None and src == dst:
+            self._drop_summary(src)
+            return
+        for prefix, end in ((src, wire.src), (dst, wire.dst)):
+            if prefix is not None and end not in self._summary_pins[prefix]:
+                self._drop_summary(prefix)
+
+    def _mark_block_dirty(self, name: str):
+        self._dirty_blocks.add(name)
+        self._dirty_block_voxels.add(name)
+        self._derived.clear()
+
+    def _mark_wire_dirty(self, name: str):
+        self._dirty_wires.add(name)
+        self._derived.clear()
+
+    def _mark_building_dirty(self, name: str):
+        self._dirty_buildings.add(name)
+        self._dirty_building_voxels.add(name)
+        self._derived.clear()
+
+    def mark_dirty(self, name: Optional[str] = None):
+        """
+        Invalidate the cached savestring fragments of a component, or of
+        the whole module if no name is given, with the timing summaries and
+        derived results that depend on it. Blocks, wires and buildings call
+        this on their own when their attributes are set, so it's only needed
+        after changing them in place (like the list of a block's properties).
+        """
+        if name is None:
+            self._dirty_blocks.update(self.blocks.keys())
+            self._dirty_wires.update(self.wires.keys())
+            self._dirty_buildings.update(self.buildings.keys())
+            self._dirty_block_voxels.update(self.blocks.keys())
+            self._dirty_building_voxels.update(self.buildings.keys())
+            self._renumber = True
+            self._latency = None
+            self._derived.clear()
+            for prefix in list(self._summary_members):
+                self._drop_summary(prefix)
+            return
+
+        name = self.get_reference(name)
+        if name in self.blocks:
+            self._mark_block_dirty(name)
+            self._on_timing_change(name)
+        if name in self.wires:
+            self._mark_wire_dirty(name)
+            self._on_wire_timing_change(self.wires[name])
+        if name in self.buildings:
+            self._mark_building_dirty(name)
+
     def add(
         self,
         components: Component
@@ -564,10 +1181,9 @@ class Module:
                     else:
                         dst = Block("") # Trust that it is a block from an array to be developed
                 if isinstance(src, Array):
+                    # Widths read through casts, since setting them would drop instance summaries
                     if isinstance(dst, Array):
-                        src.width = cast(int, src.width)
-                        dst.width = cast(int, dst.width)
-                        max_pairs = min(src.width, dst.width)
+                        max_pairs = min(cast(int, src.width), cast(int, dst.width))
                         if not w.inverted:
                             for i in range(max_pairs):
                                 self.wires[f"{w.src}.{i}->{w.dst}.{i}"] = Wire(f"{w.src}.{i}", f"{w.dst}.{i}")
@@ -575,13 +1191,11 @@ class Module:
                             for i in range(max_pairs):
                                 self.wires[f"{w.src}.{i}->{w.dst}.{max_pairs - i - 1}"] = Wire(f"{w.src}.{i}", f"{w.dst}.{max_pairs - i - 1}")
                     else: # Block
-                        src.width = cast(int, src.width)
-                        for i in range(src.width):
+                        for i in range(cast(int, src.width)):
                             self.wires[f"{w.src}.{i}->{w.dst}"] = Wire(f"{w.src}.{i}", f"{w.dst}")
                 else: # Block
                     if isinstance(dst, Array):
-                        dst.width = cast(int, dst.width)
-                        for i in range(dst.width):
+                        for i in range(cast(int, dst.width)):
                             self.wires[f"{w.src}->{w.dst}.{i}"] = Wire(f"{w.src}", f"{w.dst}.{i}")
                     else: # Block
                         self.wires[f"{w.src}->{w.dst}"] = w
@@ -589,6 +1203,53 @@ class Module:
                 building: Building = self.buildings[w.building]
                 building.add_wire(w)
 
+    def add_bulk(
+        self,
+        blocks: List[Union[Block, Array]],
+        wires: Optional[Dict[str, Wire]] = None
+    ):
+        """
+        Add already resolved blocks/arrays and wires (keyed by name) in one
+        go, skipping the reference resolution and array wire expansion of `add`
+        """
+        new_blocks = {c.name: c for c in blocks}
+        for c in new_blocks.values():
+            if isinstance(c, Array) and c.width is None:
+                c.width = self.size
+        self._insert_blocks(new_blocks)
+        if self._summary_of:
+            for name in new_blocks:
+                self._on_timing_change(name)
+
+        if wires:
+            self._insert_wires(wires)
+            if self._summary_of:
+                for w in wires.values():
+                    self._on_wire_timing_change(w)
+
+    def _insert_blocks(self, blocks: Dict[str, Union[Block, Array]]):
+        """Add resolved blocks/arrays in one go, leaving the instance summaries to the caller"""
+        for c in blocks.values():
+            object.__setattr__(c, "_owner", self)
+        dict.update(self.blocks, blocks)
+        block_fragments = self._block_fragments
+        block_fragments.update({name: "" for name in blocks if name not in block_fragments})
+        self._dirty_blocks.update(blocks)
+        self._dirty_block_voxels.update(blocks)
+        self._latency = None
+        self._derived.clear()
+
+    def _insert_wires(self, wires: Dict[str, Wire]):
+        """Add resolved wires in one go, leaving the instance summaries to the caller"""
+        for name, w in wires.items():
+            w.__dict__.update(_owner=self, _name=name)
+        dict.update(self.wires, wires)
+        wire_fragments = self._wire_fragments
+        wire_fragments.update({name: "" for name in wires if name not in wire_fragments})
+        self._dirty_wires.update(wires)
+        self._latency = None
+        self._derived.clear()
+
     def remove(self, name: str):
         name = self.get_reference(name)
         
@@ -620,6 +1281,7 @@ class Module:
 
     def set_link(self, link: str, to: str):
         self.links[link] = to
+        self._derived.clear()
 
     def set_size(self, size: int):
         """
@@ -656,8 +1318,18 @@ class Module:
                 c.info["y_step"] = rot_orientation[1]
                 c.info["z_step"] = rot_orientation[2]
 
-    def auto_place(self):
-        '''Auto place blocks based on ports'''
+    def auto_place(self, method: Literal["wirelength", "rows"] = "wirelength", layers: int = 1):
+        '''
+        Auto place blocks based on ports. "wirelength" keeps wired blocks close
+        together, on a grid of layers rows along y (see cm2/circuitry/placement.py),
+        "rows" fills rows in arrival time order
+        '''
+        if method == "wirelength":
+            from .placement import place
+            place(self, layers)
+            return
+        assert layers == 1, "Row placement has a single layer"
+
         arrival_times = self.get_arrival_times()
         
         not_port_arrival_times: Dict[str, int] = {}
@@ -723,22 +1395,23 @@ class Module:
                 i += 1 + j
 
     def auto_balance(self) -> int:
-        """This ensures all paths from any input to any output takes the same number of ticks"""
+        """
+        This ensures all paths from any input to any output takes the same number of ticks.
+        Merged instances that are balanced already are timed by their summaries (see
+        get_latency_matrix), delaying only the wires into them, instead of walking every gate.
+        """
         assert "input" in self.ports, "Module doesn't have input port defined"
         assert "output" in self.ports, "Module doesn't have output port defined"
-        
+
+        instances = {prefix: s for prefix, s in self._get_usable_summaries().items() if s.is_balanced()}
+        if instances:
+            return self._auto_balance_instances(instances)
+
         arrival_times: Dict[str, int] = {} # cache get_arrival_time results
         visiting: set[str] = set()
       
         graph = self.get_block_graph()
-        module_outputs: List[str] = []
-        for outputs in self.get_port("output"):
-            _outputs = flatten_recursive(outputs)
-            for p in _outputs:
-                expanded = self.get_blocks_expanded(p)
-                if expanded:
-                    for block in expanded:
-                        module_outputs.append(block.name) 
+        module_outputs = set(self._get_port_blocks("output"))
             
         def get_arrival_time(block: Block) -> int:
             if block.name in arrival_times:
@@ -783,16 +1456,7 @@ class Module:
             for input_name, time in times.items():
                 delay = slowest - time
                 if delay > 0:
-                    wire = self.get_wire(f"{input_name}->{block.name}")
-                    if wire:
-                        self.remove(f"{input_name}->{block.name}")
-                        
-                    this_id = random_id()
-                    self.add([
-                        Block(f"{input_name}.delay.{this_id}", "delay", properties=[f"{delay}"]),
-                        Wire(f"{input_name}", f"{input_name}.delay.{this_id}"),
-                        Wire(f"{input_name}.delay.{this_id}", block.name)
-                    ])
+                    self._insert_delay(input_name, block.name, delay)
             return slowest
         
         output_arrival_times: Dict[str, int] = {}
@@ -804,6 +1468,23 @@ class Module:
             if content["block"].name in module_outputs:
                 output_arrival_times[content["block"].name] = arrival_time
         
+        return self._delay_outputs(output_arrival_times)
+
+    def _insert_delay(self, src: str, dst: str, delay: int):
+        """Puts a delay block of delay ticks on the wire from src to dst"""
+        wire = self.get_wire(f"{src}->{dst}")
+        if wire:
+            self.remove(f"{src}->{dst}")
+
+        this_id = random_id()
+        self.add([
+            Block(f"{src}.delay.{this_id}", "delay", properties=[f"{delay}"]),
+            Wire(f"{src}", f"{src}.delay.{this_id}"),
+            Wire(f"{src}.delay.{this_id}", dst)
+        ])
+
+    def _delay_outputs(self, output_arrival_times: Dict[str, int]) -> int:
+        """Turns the early output blocks into delays, so all outputs arrive with the slowest"""
         slowest_output_arrival_time: int = max(output_arrival_times.values())
         for _output, time in output_arrival_times.items():
             delay = slowest_output_arrival_time - time
@@ -815,10 +1496,668 @@ class Module:
                     block.properties = [f"{delay}"]
                     
         return slowest_output_arrival_time
+
+    def _auto_balance_instances(self, instances: Dict[str, LatencySummary]) -> int:
+        """
+        auto_balance over a graph where balanced instances are nodes: the driven
+        inputs of each group of connected pins are delayed to arrive together, so
+        every path through the instance takes the same ticks. Inputs nothing drives
+        are left as they are. Loops keep their timing.
+        """
+        graph = _TimingGraph(self, instances)
+        if graph.driven_outputs: # Can't delay wires into an output pin without walking the instance
+            instances = {p: s for p, s in instances.items() if p not in graph.driven_outputs}
+            graph = _TimingGraph(self, instances)
+
+        arrival: Dict[str, int] = {}
+
+        def align(name: str, ready: int):
+            """Delays the forward inputs of a block so they all reach it at ready"""
+            for src in graph.forward_sources(name):
+                delay = ready - arrival[src]
+                if delay > 0:
+                    self._insert_delay(src, name, delay)
+
+        for node in graph.order:
+            if node in graph.groups:
+                summary, inputs, outputs = graph.groups[node]
+                pins = [summary.inputs[i] for i in inputs]
+                driven = [pin for pin in pins if graph.forward_sources(pin)]
+                target = max(
+                    (max(arrival[src] for src in graph.forward_sources(pin)) + graph.delays[pin] for pin in driven),
+                    default=0
+                )
+                for pin in pins:
+                    if pin in driven:
+                        align(pin, target - graph.delays[pin])
+                        arrival[pin] = target
+                    else:
+                        arrival[pin] = graph.source_arrival(pin)
+                for o in outputs:
+                    pin = summary.outputs[o]
+                    if pin not in arrival:
+                        arrival[pin] = self._summary_arrival(summary, o, inputs, arrival)
+            else:
+                sources = graph.forward_sources(node)
+                if sources:
+                    slowest = max(arrival[src] for src in sources)
+                    align(node, slowest)
+                    arrival[node] = slowest + graph.delays[node]
+                else:
+                    arrival[node] = graph.source_arrival(node)
+
+        return self._delay_outputs({name: arrival[name] for name in self._get_port_blocks("output")})
+
+    @staticmethod
+    def _summary_arrival(summary: LatencySummary, o: int, inputs: List[int], arrival: Dict[str, int]) -> int:
+        """Arrival at an instance output from the arrivals at its inputs"""
+        times = [int(summary.internal[o])] + [
+            arrival[summary.inputs[i]] + int(summary.longest[i, o]) for i in inputs if summary.longest[i, o] >= 0
+        ]
+        return max(max(times), 0)
                    
-    def get_arrival_times(self) -> Dict[str, int]:               
+    def auto_pipeline(self, stage_depth: int, clock: str = "clock") -> int:
+        """
+        Balances the module and cuts it in stages of stage_depth ticks, with a latch on
+        every wire crossing a stage boundary. Boundaries alternate between positive and
+        negative latches (as in hdlm.DLatchP and hdlm.DLatchN) enabled by the clock block,
+        which is added to the input port, so a new input can be fed every clock period
+        (2 * stage_depth ticks) instead of every full latency. Returns the number of stages.
+        """
+        assert stage_depth > 1, "Stage depth must be at least 2 ticks, counting its latch"
+        assert not clock in self.blocks, f"Block '{clock}' already exists"
+
+        self.auto_balance()
+        arrival_times = self.get_arrival_times()
+        graph = self.get_block_graph()
+
+        module_outputs = self._get_port_blocks("output")
+        latency = max(arrival_times[o] for o in module_outputs)
+        # Each latch adds a tick, so boundaries are one tick closer than stage_depth to stay
+        # aligned with the clock: the wave reaches the i-th latch at about i * stage_depth
+        boundaries = list(range(stage_depth - 1, latency, stage_depth - 1))
+
+        # Split delays spanning boundaries, so their latches go where the signal is at
+        # that tick instead of before the whole delay
+        incoming: Dict[str, List[str]] = {}
+        for key, w in self.wires.items():
+            incoming.setdefault(w.dst, []).append(key)
+        split = False
+        for name, c in list(self.blocks.items()):
+            # Delay arrays spanning a boundary are developed, to split their blocks one by one
+            if not (isinstance(c, Array) and c.block_id == "delay"):
+                continue
+            assert c.properties
+            members = c.get_blocks()
+            if any(end - int(c.properties[0]) < t <= end for end in (arrival_times[n] for n in members) for t in boundaries):
+                del self.blocks[name]
+                self.add(list(members.values()))
+        for name, c in list(self.blocks.items()):
+            if not (isinstance(c, Block) and c.block_id == "delay"):
+                continue
+            assert c.properties
+            end = arrival_times[name]
+            start = end - int(c.properties[0])
+            cuts = [t - 1 for t in boundaries if start < t <= end]
+            # Only the piece before the first cut can be empty, then the latch goes on the input wire
+            pieces = [
+                (f"{name}.split{j}", cut - previous)
+                for j, (previous, cut) in enumerate(zip([start] + cuts, cuts)) if cut > previous
+            ]
+            if not pieces:
+                continue
+            split = True
+            c.properties = [f"{end - cuts[-1]}"]
+            chain = [piece for piece, _ in pieces] + [name]
+            for key in incoming.get(name, []):
+                w = self.wires.pop(key)
+                self.add(Wire(w.src, chain[0]))
+            for j, (piece, length) in enumerate(pieces):
+                self.add([
+                    Block(piece, "delay", (c.pos.x, c.pos.y, c.pos.z), properties=[f"{length}"]),
+                    Wire(piece, chain[j + 1])
+                ])
+        if split:
+            arrival_times = self.get_arrival_times()
+            graph = self.get_block_graph()
+
+        # Registers only keep the paths aligned if every path crosses every boundary once
+        crossings: Dict[str, List[Tuple[str, Wire, List[int]]]] = {}
+        for key, w in self.wires.items():
+            if not (w.src in graph and w.dst in graph):
+                continue
+            src_time = arrival_times[w.src]
+            dst_time = arrival_times[w.dst]
+            assert dst_time >= src_time, f"Can't pipeline the feedback loop through wire '{key}'"
+            crossed = [i for i, t in enumerate(boundaries) if src_time < t <= dst_time]
+            if crossed:
+                crossings.setdefault(w.src, []).append((key, w, crossed))
+
+        components: List[Any] = [
+            Block(clock, "node"),
+            Block(f"{clock}.high", "or"),
+            Block(f"{clock}.low", "nor"),
+            Wire(clock, f"{clock}.high"),
+            Wire(clock, f"{clock}.low")
+        ]
+        for src, fanout in crossings.items():
+            # Chain a latch per boundary, so every fanout can tap the one it needs
+            first = min(crossed[0] for _, _, crossed in fanout)
+            last = max(crossed[-1] for _, _, crossed in fanout)
+            previous = src
+            registers: Dict[int, str] = {}
+            for i in range(first, last + 1):
+                register = f"{src}.stage{i + 1}"
+                enable, hold = (f"{clock}.high", f"{clock}.low") if i % 2 == 0 else (f"{clock}.low", f"{clock}.high")
+                components.extend([
+                    Block(f"{register}.pass", "and"),
+                    Block(f"{register}.trap", "and"),
+                    Block(register, "node"),
+                    Wire(previous, f"{register}.pass"),
+                    Wire(enable, f"{register}.pass"),
+                    Wire(hold, f"{register}.trap"),
+                    Wire(f"{register}.pass", register),
+                    Wire(f"{register}.trap", register),
+                    Wire(register, f"{register}.trap")
+                ])
+                registers[i] = register
+                previous = register
+            for key, w, crossed in fanout:
+                del self.wires[key]
+                components.append(Wire(registers[crossed[-1]], w.dst))
+
+        self.add(components)
+        inputs = self.ports["input"]
+        self.ports["input"] = (inputs if isinstance(inputs, list) else [inputs]) + [clock]
+        return len(boundaries) + 1
+
+    def collapse_gates(self, duplicate_parity: bool = True) -> int:
+        """
+        Merges trees of associative gates into single wide gates, as CM2 gates take any
+        number of inputs: and(and(a, b), c) becomes and(a, b, c), the same goes for or,
+        and xor/xnor trees become a single parity gate. Inverters merge into the gate
+        they invert, nor(and(a, b)) becomes nand(a, b). Gates driving other blocks too
+        are kept, but shared parity gates are still copied into each tree when
+        duplicate_parity is set. Gates without inputs are constants and stay, and gates
+        only merge when that doesn't add wires: merging never lengthens a path, so
+        neither the wire count nor the depth goes up. Returns the number of removed gates.
+        """
+        families: Dict[str, str] = {
+            "and": "and", "nand": "and",
+            "or": "or", "nor": "or",
+            "xor": "xor", "xnor": "xor"
+        }
+        inverse: Dict[str, str] = {
+            "and": "nand", "nand": "and",
+            "or": "nor", "nor": "or",
+            "xor": "xnor", "xnor": "xor"
+        }
+
+        # Blocks seen from outside keep their logic
+        protected: set[str] = set(self.links.values())
+        for port in self.ports.values():
+            for p in flatten_recursive(port if isinstance(port, list) else [port]):
+                expanded = self.get_blocks_expanded(p)
+                if expanded:
+                    protected.update(b.name for b in expanded)
+        for building in self.buildings.values():
+            for pin in building.wires:
+                protected.update(bw.src for bw in pin)
+
+        inputs: Dict[str, Dict[str, str]] = {} # dst -> src -> wire key
+        outputs: Dict[str, set[str]] = {}
+        for key, w in self.wires.items():
+            inputs.setdefault(w.dst, {})[w.src] = key
+            outputs.setdefault(w.src, set()).add(w.dst)
+
+        def get_gate(name: str) -> Optional[Block]:
+            block = self.blocks.get(name)
+            if isinstance(block, Block) and block.block_id in families and not block.state and block.properties is None:
+                return block
+            return None
+
+        def connect(src: str, dst: str, parity: bool):
+            if src in inputs[dst]:
+                if parity: # x ^ x cancels out
+                    disconnect(src, dst)
+                return
+            key = f"{src}->{dst}"
+            self.wires[key] = Wire(src, dst)
+            inputs[dst][src] = key
+            outputs.setdefault(src, set()).add(dst)
+
+        def disconnect(src: str, dst: str):
+            del self.wires[inputs[dst].pop(src)]
+            outputs[src].discard(dst)
+
+        def absorb(outer: Block, inner: Block) -> bool:
+            """Merges inner into outer if the logic allows it, updating outer's type"""
+            shared = len(outputs[inner.name]) > 1
+            parity = inner.block_id in ("xor", "xnor")
+            # Wires the merge adds: copied inputs, less the one into outer, the parity inputs
+            # cancelling out and the inner gate's own if it goes
+            copied = [src for src in inputs[inner.name] if src not in inputs[outer.name]]
+            added = len(copied) - 1 - (len(inputs[inner.name]) - len(copied) if parity else 0)
+            if not shared:
+                added -= len(inputs[inner.name])
+            if added > 0:
+                return False
+
+            if outer.block_id == "nor" and len(inputs[outer.name]) == 1 and not shared:
+                outer.block_id = inverse[inner.block_id] # Inverter
+            elif families[outer.block_id] != families[inner.block_id] or not inner.block_id in ("and", "or", "xor", "xnor"):
+                return False
+            elif shared and not (duplicate_parity and inner.block_id in ("xor", "xnor")):
+                return False
+            elif inner.block_id == "xnor":
+                outer.block_id = inverse[outer.block_id]
+
+            disconnect(inner.name, outer.name)
+            for src in list(inputs[inner.name]):
+                connect(src, outer.name, parity)
+            return True
+
+        removed = 0
+        for name in list(self.blocks):
+            outer = get_gate(name)
+            if outer is None:
+                continue
+            inputs.setdefault(name, {})
+            merged = True
+            while merged:
+                merged = False
+                for src in list(inputs[name]):
+                    inner = get_gate(src)
+                    # Loops through the outer gate can't be merged
+                    if inner is None or src in protected or src == name or name in inputs.get(src, {}) or not inputs.get(src):
+                        continue
+                    if absorb(outer, inner):
+                        if not outputs[src]:
+                            for s in list(inputs.get(src, {})):
+                                disconnect(s, src)
+                            del self.blocks[src]
+                            removed += 1
+                        merged = True
+                        break
+        return removed
+
+    def specialize(self, constants: Dict[str, Union[int, bool]], name: Optional[str] = None) -> "Module":
+        """
+        Copy of the module with input port bits tied to 0 or 1, e.g. {"addr.0": 1}.
+        The constants are propagated through the gates (their steady state), gates
+        that become constant are removed and so is the logic that no longer reaches
+        an output port, a building or a block other than a gate. Remaining gates only
+        lose inputs, so delays don't change. Tied bits leave the input port. Copies
+        are made from a cache by tied bits, kept until the module changes.
+        """
+        port_blocks = set(self._get_port_blocks("input"))
+        tied: Dict[str, bool] = {}
+        for bit, value in constants.items():
+            block = self.get_reference(bit)
+            assert block in port_blocks, f"'{bit}' is not an input port bit of module '{self.name}'"
+            assert value in (0, 1), f"Input '{bit}' can only be tied to 0 or 1"
+            tied[block] = bool(value)
+
+        key = ("specialize", tuple(sorted(tied.items())))
+        cached = self._derived.get(key)
+        if cached is None or cached[0] != self.ports:
+            cached = (copy.deepcopy(self.ports), self._specialize(tied))
+            self._derived[key] = cached
+        return cached[1]._copy(self.name if name is None else name)
+
+    def _specialize(self, tied: Dict[str, bool]) -> "Module":
+        blocks: Dict[str, Block] = {}
+        for k, c in self.blocks.items():
+            if isinstance(c, Array):
+                blocks.update(c.get_blocks())
+            else:
+                blocks[k] = c
+
+        inputs: Dict[str, Dict[str, None]] = {name: {} for name in blocks}
+        outputs: Dict[str, List[str]] = {name: [] for name in blocks}
+        for w in self.wires.values():
+            if w.src in blocks and w.dst in blocks and w.src not in inputs[w.dst]:
+                inputs[w.dst][w.src] = None
+                outputs[w.src].append(w.dst)
+
+        # Blocks driven from outside, and blocks that must stay
+        driven = {name for name in self._get_port_blocks("input") if name not in tied}
+        roots = driven | set(self._get_port_blocks("output"))
+        for building in self.buildings.values():
+            for pin in building.wires:
+                for bw in pin:
+                    roots.add(bw.src)
+                    if bw.port == "out":
+                        driven.add(bw.src)
+        roots.update(name for name, b in blocks.items() if b.block_id not in LOGIC_BLOCKS)
+
+        def evaluate(name: str, ones: int, zeros: int) -> Optional[bool]:
+            """Output of a gate if its known inputs decide it"""
+            block = blocks[name]
+            kind = block.block_id
+            n = len(inputs[name])
+            value: Optional[bool] = None
+            if kind in ("and", "nand"):
+                value = False if zeros or n == 0 else (True if ones == n else None)
+            elif kind in ("or", "nor", "node", "delay"):
+                value = True if ones else (False if zeros == n else None)
+            elif kind in ("xor", "xnor"):
+                value = ones % 2 == 1 if ones + zeros == n else None
+            elif kind == "flipflop":
+                value = block.state if zeros == n else None
+            if value is not None and kind in ("nand", "nor", "xnor"):
+                value = not value
+            return value
+
+        values: Dict[str, bool] = dict(tied)
+        foldable = {
+            name for name, b in blocks.items() if b.block_id in LOGIC_BLOCKS and name not in driven and name not in tied
+        }
+        for name in foldable:
+            if not inputs[name]:
+                value = evaluate(name, 0, 0)
+                if value is not None:
+                    values[name] = value
+
+        ones = dict.fromkeys(foldable, 0)
+        zeros = dict.fromkeys(foldable, 0)
+        queue = list(values)
+        while queue:
+            src = queue.pop()
+            for dst in outputs[src]:
+                if dst not in foldable or dst in values:
+                    continue
+                if values[src]:
+                    ones[dst] += 1
+                else:
+                    zeros[dst] += 1
+                value = evaluate(dst, ones[dst], zeros[dst])
+                if value is not None:
+                    values[dst] = value
+                    queue.append(dst)
+
+        def dropped(src: str, dst: str) -> bool:
+            """Whether a constant input can be left out of a gate that isn't constant"""
+            if blocks[dst].block_id in ("and", "nand"):
+                return values[src]
+            return blocks[dst].block_id in ("xor", "xnor") or not values[src]
+
+        # Keep what the roots reach, through gates that aren't constant
+        kept: set[str] = set(roots)
+        stack = [name for name in roots if name not in values]
+        while stack:
+            name = stack.pop()
+            for src in inputs[name]:
+                if src in kept or (src in values and dropped(src, name)):
+                    continue
+                kept.add(src)
+                if src not in values:
+                    stack.append(src)
+
+        def inverted(name: str) -> bool:
+            """Parity gates tied to an odd number of ones swap their type"""
+            return blocks[name].block_id in ("xor", "xnor") and sum(values.get(src, False) for src in inputs[name]) % 2 == 1
+
+        def make_block(name: str, block: Block) -> Block:
+            if name in values: # Same constants as Yosys netlists
+                if values[name]:
+                    return Block(name, "flipflop", (block.pos.x, block.pos.y, block.pos.z), state=True)
+                return Block(name, "node", (block.pos.x, block.pos.y, block.pos.z))
+            block_id = block.block_id
+            if inverted(name):
+                block_id = "xnor" if block_id == "xor" else "xor"
+            properties = None if block.properties is None else list(block.properties)
+            return Block(name, block_id, (block.pos.x, block.pos.y, block.pos.z), block.state, properties)
+
+        m = Module(self.name)
+        m.size = self.size
+        new_blocks: List[Union[Block, Array]] = []
+        for k, c in self.blocks.items():
+            if isinstance(c, Array):
+                members = c.get_blocks()
+                if all(name in kept and name not in values and not inverted(name) for name in members):
+                    array = copy.copy(c)
+                    object.__setattr__(array, "_owner", None)
+                    array.pos = Vector3(c.pos.x, c.pos.y, c.pos.z)
+                    array.info = cast(ArrayInfo, dict(c.info))
+                    array.properties = None if c.properties is None else list(c.properties)
+                    new_blocks.append(array)
+                else:
+                    new_blocks.extend(make_block(name, b) for name, b in members.items() if name in kept)
+            elif k in kept:
+                new_blocks.append(make_block(k, c))
+
+        new_wires: Dict[str, Wire] = {}
+        for dst in kept:
+            if dst in values:
+                continue
+            for src in inputs[dst]:
+                if src in kept and not (src in values and dropped(src, dst)):
+                    new_wires[f"{src}->{dst}"] = Wire(src, dst)
+        m.add_bulk(new_blocks, new_wires)
+
+        for name, building in self.buildings.items():
+            m.buildings[name] = self._copy_building(building)
+
+        def rewrite(entry: Any) -> Any:
+            """Port entry without the tied bits, splitting the arrays they were in"""
+            if isinstance(entry, list):
+                names: List[Any] = []
+                for e in entry:
+                    if isinstance(e, list):
+                        names.append(rewrite(e))
+                    else:
+                        names.extend(rewrite(e))
+                return names
+            expanded = self._expand_port_name(entry)
+            if not any(name in tied for name in expanded):
+                return [entry]
+            return [name for name in expanded if name not in tied]
+
+        m.ports = {port: rewrite(value) for port, value in self.ports.items()}
+        m.links = {
+            link: to for link, to in self.links.items() if to in kept or to in m.blocks or f"{to}.0" in kept
+        }
+        return m
+
+    @staticmethod
+    def _copy_building(building: Building) -> Building:
+        new = copy.copy(building)
+        object.__setattr__(new, "_owner", None)
+        new.cframe = copy.deepcopy(building.cframe)
+        new.wires = [[BuildingWire(w.building, w.index, w.port, w.src) for w in pin] for pin in building.wires]
+        return new
+
+    def _copy(self, name: str) -> "Module":
+        """Copy of the components, ports and links of the module, under another name"""
+        m = Module(name)
+        m.size = self.size
+        components: List[Union[Block, Array]] = []
+        for c in self.blocks.values():
+            component = copy.copy(c)
+            object.__setattr__(component, "_owner", None)
+            component.pos = Vector3(c.pos.x, c.pos.y, c.pos.z)
+            component.properties = None if c.properties is None else list(c.properties)
+            if isinstance(c, Array):
+                component.info = cast(ArrayInfo, dict(c.info))
+            components.append(component)
+        m.add_bulk(components, {key: Wire(w.src, w.dst) for key, w in self.wires.items()})
+        for building_name, building in self.buildings.items():
+            m.buildings[building_name] = self._copy_building(building)
+        m.ports = copy.deepcopy(self.ports)
+        m.links = dict(self.links)
+        return m
+
+    def fingerprint(self, names: bool = False, positions: bool = False) -> str:
+        """
+        Canonical hash of the block graph, the same for two modules with the same blocks,
+        wires, ports and buildings, whatever the block names and the order they were
+        added in. Set names or positions to tell apart modules that only differ there.
+        Port bits count in port order. Linear in the blocks and wires, and cached until
+        the module changes. Memory images count by their contents, read again when
+        their files change.
+        """
+        key = ("fingerprint", names, positions)
+        data_stamp = tuple(
+            (name, building.data, os.stat(building.data).st_mtime_ns, os.stat(building.data).st_size)
+            for name, building in self.buildings.items() if building.data is not None
+        )
+        cached = self._derived.get(key)
+        if cached is not None and cached[0] == self.ports and cached[1][0] == data_stamp:
+            return cached[1][1]
+
+        labels: Dict[Any, int] = {}
+        def label(value: Any) -> int:
+            if value not in labels:
+                labels[value] = hash_label(value)
+            return labels[value]
+
+        index: Dict[str, int] = {}
+        seeds: List[int] = []
+        for k, c in self.blocks.items():
+            attributes = (c.block_id, c.state, tuple(c.properties or ()))
+            if isinstance(c, Array):
+                columns = c.get_positions() if positions else None
+                for i in range(c.width or 0):
+                    name = f"{k}.{i}"
+                    extra: Tuple[Any, ...] = (name,) if names else ()
+                    if columns is not None:
+                        extra += tuple(round(float(column[i]), 3) for column in columns)
+                    index[name] = len(seeds)
+                    seeds.append(label(attributes + extra))
+            else:
+                extra = (k,) if names else ()
+                if positions:
+                    extra += (round(c.pos.x, 3), round(c.pos.y, 3), round(c.pos.z, 3))
+                index[k] = len(seeds)
+                seeds.append(label(attributes + extra))
+
+        # Port bits and building pins anchor the blocks they name
+        port_bits: Dict[str, List[int]] = {}
+        for port in sorted(self.ports):
+            bits = [index[name] for name in self._get_port_blocks(port) if name in index]
+            for j, v in enumerate(bits):
+                seeds[v] = (seeds[v] + label(("port", port, j))) & MASK64
+            port_bits[port] = bits
+        for building in self.buildings.values():
+            for pin, building_wires in enumerate(building.wires):
+                for bw in building_wires:
+                    if bw.src in index:
+                        v = index[bw.src]
+                        seeds[v] = (seeds[v] + label(("pin", building.building_type, pin, bw.port))) & MASK64
+
+        n = len(seeds)
+        wire_src: List[int] = []
+        wire_dst: List[int] = []
+        for w in self.wires.values():
+            if w.src in index and w.dst in index:
+                wire_src.append(index[w.src])
+                wire_dst.append(index[w.dst])
+        edges = np.unique(np.array(wire_src, np.int64) * n + np.array(wire_dst, np.int64))
+        src, dst = edges // n, edges % n # Sorted by source
+
+        # Exact hashes of the fan in and fan out cones, over the wires between loops
+        vertices = np.arange(n + 1)
+        comp, ncomp = _strongly_connected(np.searchsorted(src, vertices).tolist(), dst.tolist())
+        comp_array = np.array(comp, np.int64)
+        between = comp_array[src] != comp_array[dst]
+        out_src, out_dst = src[between], dst[between]
+        by_dst = np.argsort(out_dst, kind="stable")
+        in_src, in_dst = out_src[by_dst], out_dst[by_dst]
+        in_start = np.searchsorted(in_dst, vertices).tolist()
+        out_start = np.searchsorted(out_src, vertices).tolist()
+        inputs, outputs = in_src.tolist(), out_dst.tolist()
+        order = np.argsort(-comp_array, kind="stable").tolist() # Sources first
+
+        forward = [0] * n
+        for v in order:
+            forward[v] = mix64((seeds[v] + sum(map(forward.__getitem__, inputs[in_start[v]:in_start[v + 1]]))) & MASK64)
+        backward = [0] * n
+        for v in reversed(order):
+            total = (seeds[v] ^ FINGERPRINT_KEYS[0]) + sum(map(backward.__getitem__, outputs[out_start[v]:out_start[v + 1]]))
+            backward[v] = mix64(total & MASK64)
+
+        # Then rounds over every wire, for the wiring inside loops, until blocks stop
+        # splitting in more classes. Circuits without long loops settle in a round or two
+        h = mix64_array(np.array(forward, np.uint64) + mix64_array(np.array(backward, np.uint64) ^ np.uint64(FINGERPRINT_KEYS[1])))
+        if len(edges):
+            classes = len(np.unique(h))
+            for _ in range(FINGERPRINT_ROUNDS):
+                incoming = np.zeros(n, np.uint64)
+                outgoing = np.zeros(n, np.uint64)
+                np.add.at(incoming, dst, mix64_array(h[src] ^ np.uint64(FINGERPRINT_KEYS[2])))
+                np.add.at(outgoing, src, mix64_array(h[dst] ^ np.uint64(FINGERPRINT_KEYS[3])))
+                h = mix64_array(h + mix64_array(incoming) + mix64_array(outgoing ^ np.uint64(FINGERPRINT_KEYS[4])))
+                refined = len(np.unique(h))
+                if refined == classes:
+                    break
+                classes = refined
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((n, len(edges))).encode())
+        digest.update(np.sort(h).tobytes())
+        for port, bits in port_bits.items():
+            digest.update(repr(port).encode())
+            digest.update(h[bits].tobytes())
+        buildings: List[int] = []
+        for building in self.buildings.values():
+            image = ()
+            if building.data is not None:
+                with open(building.data, "rb") as file:
+                    image = (hashlib.blake2b(file.read(), digest_size=16).hexdigest(),)
+            value = label(
+                (building.building_type,) + image
+                + ((building.name,) if names else ())
+                + (tuple(round(x, 3) for x in (building.cframe.pos.x, building.cframe.pos.y, building.cframe.pos.z))
+                   + tuple(round(x, 3) for row in building.cframe.rot for x in row) if positions else ())
+            )
+            for pin, building_wires in enumerate(building.wires):
+                for bw in building_wires:
+                    if bw.src in index:
+                        value = (value + mix64((label((pin, bw.port)) + int(h[index[bw.src]])) & MASK64)) & MASK64
+            buildings.append(value)
+        digest.update(np.array(sorted(buildings), np.uint64).tobytes())
+        if names:
+            digest.update(repr(sorted(self.links.items())).encode())
+
+        result = digest.hexdigest()
+        self._derived[key] = (copy.deepcopy(self.ports), (data_stamp, result))
+        return result
+
+    def get_arrival_times(self, summaries: bool = False) -> Dict[str, int]:               
+        """
+        Worst arrival time of every block, in ticks. With summaries, merged
+        instances are timed by their summaries, and only their pins are listed.
+        """
         assert "input" in self.ports, "Module doesn't have input port defined"
         assert "output" in self.ports, "Module doesn't have output port defined"
+
+        if summaries:
+            graph = _TimingGraph(self, self._get_usable_summaries())
+            times: Dict[str, int] = {}
+
+            def wire_arrival(name: str, node: Any) -> int:
+                sources = graph.wires_into[name]
+                if not sources:
+                    return 0
+                return max(0 if (src, node) in graph.back_edges else times[src] for src in sources) + graph.delays[name]
+
+            for node in graph.order:
+                if node in graph.groups:
+                    summary, inputs, outputs = graph.groups[node]
+                    names = [summary.inputs[i] for i in inputs]
+                else:
+                    summary, inputs, outputs, names = None, [], [], [node]
+                for name in names:
+                    times[name] = wire_arrival(name, node)
+                for o in outputs:
+                    name = cast(LatencySummary, summary).outputs[o]
+                    if name not in times:
+                        times[name] = max(
+                            wire_arrival(name, node),
+                            self._summary_arrival(cast(LatencySummary, summary), o, inputs, times)
+                        )
+            return times
         
         arrival_times: Dict[str, int] = {} # cache get_arrival_time results
         visiting: set[str] = set()
@@ -876,6 +2215,142 @@ class Module:
                     
         return arrival_times
               
+    def _get_port_blocks(self, port: str) -> List[str]:
+        """Expanded block names of a port, developed arrays included, skipping names of no block"""
+        names: List[str] = []
+        for p in flatten_recursive(self.get_port(port)):
+            names.extend(self._expand_port_name(p))
+        return list(dict.fromkeys(names))
+
+    def _expand_port_name(self, name: str) -> List[str]:
+        """Expanded block names of a port entry"""
+        name = self.get_reference(name)
+        component = self.blocks.get(name)
+        if isinstance(component, Array):
+            return [f"{name}.{i}" for i in range(component.width or 0)]
+        if component is not None:
+            return [name]
+        if f"{name}.0" in self.blocks:
+            return [f"{name}.{i}" for i in range(self.find_developed_array_size(name))]
+        head, _, tail = name.rpartition(".")
+        if tail.isdigit() and isinstance(self.blocks.get(head), Array):
+            return [name]
+        return []
+
+    def _summarize_instances(self):
+        """Work out the pending summaries of merged instances, from their blocks and inner wires"""
+        instances: Dict[str, Module] = {}
+        for prefix, (ports, links) in self._pending_summaries.items():
+            instance = Module(prefix)
+            instance.ports, instance.links = ports, links
+            start = len(prefix) + 1
+            dict.update(instance.blocks, {name[start:]: self.blocks[name] for name in self._summary_members[prefix]})
+            instances[prefix] = instance
+        self._pending_summaries = {}
+
+        # Plain dict inserts, so the blocks keep this module as their owner
+        for w in self.wires.values():
+            prefix = self._instance_prefix(w.src)
+            if prefix in instances and self._instance_prefix(w.dst) == prefix:
+                start = len(prefix) + 1
+                src, dst = w.src[start:], w.dst[start:]
+                dict.__setitem__(instances[prefix].wires, f"{src}->{dst}", Wire(src, dst))
+        for prefix, instance in instances.items():
+            self._summaries[prefix] = instance.get_latency_matrix().prefixed(prefix)
+
+    def _get_usable_summaries(self) -> Dict[str, LatencySummary]:
+        """Summaries of the instances that no port of this module reaches inside of"""
+        if self._pending_summaries:
+            self._summarize_instances()
+        instances = dict(self._summaries)
+        if instances:
+            for name in self._get_port_blocks("input") + self._get_port_blocks("output"):
+                prefix = self._instance_prefix(name)
+                if prefix is not None and name not in self._summary_pins[prefix]:
+                    instances.pop(prefix, None)
+        return instances
+
+    def get_latency_matrix(self) -> LatencySummary:
+        """
+        Longest and shortest ticks from every input block to every output block,
+        and the arrivals at the outputs from blocks inside (see LatencySummary).
+        Cached until the module or its ports change. Merged instances are timed by
+        their own summaries, so the cost grows with the instances, not their gates.
+        """
+        if self._latency is not None and self._latency[0] == self.ports:
+            return self._latency[1]
+        assert "input" in self.ports, "Module doesn't have input port defined"
+        assert "output" in self.ports, "Module doesn't have output port defined"
+
+        inputs, outputs = self._get_port_blocks("input"), self._get_port_blocks("output")
+        graph = _TimingGraph(self, self._get_usable_summaries())
+
+        # Ticks from every input, a chunk of inputs at a time, kept far from the
+        # int32 limits so sums of unreachable values stay unreachable
+        index = {name: k for k, name in enumerate(graph.delays)}
+        unreachable = 1 << 29
+        n, chunk = len(index), LATENCY_MATRIX_CHUNK
+        longest = np.full((len(inputs), len(outputs)), -1, np.int64)
+        shortest = np.full((len(inputs), len(outputs)), -1, np.int64)
+        internal = np.full(len(outputs), -1, np.int64)
+        for start in range(0, max(len(inputs), 1), chunk):
+            own = {name: k - start for k, name in enumerate(inputs[start:start + chunk], start)}
+            width = len(own)
+            late = np.full((n, width), -unreachable, np.int32)
+            early = np.full((n, width), unreachable, np.int32)
+            inside = np.full(n, -unreachable, np.int64)
+
+            def arrive(name: str, node: Any, summarized: bool = False):
+                """Arrivals at a block through its wires. Summarized blocks (instance outputs) aren't sources"""
+                k = index[name]
+                if name in own:
+                    late[k, own[name]] = early[k, own[name]] = 0
+                sources = graph.wires_into[name]
+                if not sources and name not in own and not summarized:
+                    inside[k] = 0
+                delay = graph.delays[name]
+                for src in sources:
+                    if (src, node) in graph.back_edges:
+                        inside[k] = max(inside[k], delay)
+                        continue
+                    j = index[src]
+                    np.maximum(late[k], late[j] + delay, out=late[k])
+                    np.minimum(early[k], early[j] + delay, out=early[k])
+                    inside[k] = max(inside[k], inside[j] + delay)
+
+            for node in graph.order:
+                if node not in graph.groups:
+                    arrive(node, node)
+                    continue
+                summary, group_inputs, group_outputs = graph.groups[node]
+                for i in group_inputs:
+                    arrive(summary.inputs[i], node)
+                for o in group_outputs:
+                    name = summary.outputs[o]
+                    k = index[name]
+                    if name in summary.inputs_set:
+                        continue
+                    arrive(name, node, summarized=True)
+                    if summary.internal[o] >= 0:
+                        inside[k] = max(inside[k], int(summary.internal[o]))
+                    for i in group_inputs:
+                        if summary.longest[i, o] >= 0:
+                            j = index[summary.inputs[i]]
+                            np.maximum(late[k], late[j] + int(summary.longest[i, o]), out=late[k])
+                            np.minimum(early[k], early[j] + int(summary.shortest[i, o]), out=early[k])
+                            inside[k] = max(inside[k], inside[j] + int(summary.longest[i, o]))
+
+            rows = [index[name] for name in outputs]
+            reached = late[rows].T >= 0
+            longest[start:start + width] = np.where(reached, late[rows].T, -1)
+            shortest[start:start + width] = np.where(reached, early[rows].T, -1)
+            if start == 0:
+                internal = np.where(inside[rows] >= 0, inside[rows], -1)
+
+        summary = LatencySummary(inputs, outputs, longest, shortest, internal)
+        self._latency = (copy.deepcopy(self.ports), summary)
+        return summary
+
     def def_ic(self):
         """Put IC terminals on module"""
         assert "input" in self.ports, "Module doesn't have input port defined"
@@ -928,6 +2403,102 @@ class Module:
         dims = (max_v - min_v) + Vector3.ones()
         return dims
 
+    def _update_voxels(self):
+        """Reindexes the components changed since the last voxel query"""
+        voxels = self._voxels
+
+        def unindex(entries: List[Tuple[Voxel, str]]):
+            for voxel, occupant in entries:
+                occupants = voxels[voxel]
+                occupants.remove(occupant)
+                if not occupants:
+                    del voxels[voxel]
+
+        def index(entries: List[Tuple[Voxel, str]]):
+            for voxel, occupant in entries:
+                voxels.setdefault(voxel, []).append(occupant)
+
+        for name in self._dirty_block_voxels:
+            unindex(self._block_voxels.pop(name, []))
+            c = self.blocks.get(name)
+            if c is None:
+                continue
+            if isinstance(c, Array):
+                if not c.width:
+                    continue
+                xs, ys, zs = (np.floor(column + 0.5).astype(np.int64).tolist() for column in c.get_positions())
+                entries = [((x, y, z), f"{name}.{i}") for i, (x, y, z) in enumerate(zip(xs, ys, zs))]
+            else:
+                entries = [(to_voxel(c.pos), name)]
+            index(entries)
+            self._block_voxels[name] = entries
+        self._dirty_block_voxels.clear()
+
+        for name in self._dirty_building_voxels:
+            unindex(self._building_voxels.pop(name, []))
+            building = self.buildings.get(name)
+            if building is None:
+                continue
+            entries = [(voxel, name) for voxel in building.get_voxels()]
+            index(entries)
+            self._building_voxels[name] = entries
+        self._dirty_building_voxels.clear()
+
+    def get_occupants(self, pos: Tuple[float, float, float]) -> List[str]:
+        """Blocks (arrays expanded) and buildings at the grid position of pos"""
+        self._update_voxels()
+        return list(self._voxels.get(to_voxel(pos), []))
+
+    def is_free(self, pos: Tuple[float, float, float]) -> bool:
+        self._update_voxels()
+        return to_voxel(pos) not in self._voxels
+
+    def get_collisions(self) -> Dict[Voxel, List[str]]:
+        """Grid positions taken by more than one block or building"""
+        self._update_voxels()
+        return {voxel: list(occupants) for voxel, occupants in self._voxels.items() if len(occupants) > 1}
+
+    def find_free_region(
+        self,
+        size: Tuple[int, int, int],
+        near: Tuple[float, float, float] = (0, 0, 0),
+        margin: int = 0
+    ) -> Voxel:
+        """
+        Lowest corner of the free region of size (width, height, depth) closest to
+        near, with at least margin free voxels around it. The search covers the
+        bounding box of everything in the module grown by the region, so there is
+        always an answer.
+        """
+        assert all(s >= 1 for s in size), "Region size must be at least 1 in every axis"
+        assert margin >= 0, "Margin can't be negative"
+        self._update_voxels()
+        target = np.array(to_voxel(near), np.int64)
+        if not self._voxels:
+            return to_voxel(near)
+
+        box = np.array(size, np.int64) + 2 * margin # Must be empty, margin included
+        occupied = np.array(list(self._voxels.keys()), np.int64)
+        low = np.minimum(occupied.min(axis=0) - box, target - margin)
+        high = np.maximum(occupied.max(axis=0) + box, target + box)
+        grid = np.zeros(tuple((high - low + 1).tolist()), np.int32)
+        grid[tuple((occupied - low).T)] = 1
+
+        # Occupied voxels in every box, from a summed volume table
+        table = np.zeros(tuple(s + 1 for s in grid.shape), np.int32)
+        table[1:, 1:, 1:] = grid.cumsum(0).cumsum(1).cumsum(2)
+        (w, h, d), (nx, ny, nz) = box.tolist(), (np.array(grid.shape) - box + 1).tolist()
+        x, y, z = slice(0, nx), slice(0, ny), slice(0, nz)
+        xw, yh, zd = slice(w, w + nx), slice(h, h + ny), slice(d, d + nz)
+        counts = (
+            table[xw, yh, zd] - table[x, yh, zd] - table[xw, y, zd] - table[xw, yh, z]
+            + table[x, y, zd] + table[x, yh, z] + table[xw, y, z] - table[x, y, z]
+        )
+
+        corners = np.argwhere(counts == 0) + low + margin
+        distances = ((corners - target) ** 2).sum(axis=1)
+        return cast(Voxel, tuple(corners[np.argmin(distances)].tolist()))
+
     def get_block_indexes(self) -> Dict[str, int]:
         block_indexes: Dict[str, int] = {}
 
@@ -1053,32 +2624,174 @@ class Module:
 
         return mid
 
-    def save(self, path: str):
-        """Export module as a Circuit Maker 2 save string."""
-        block_list = self.get_blocks()
-        block_indexes = self.get_block_indexes()
-        wire_list = self.get_wires()
-        buildings_list = self.get_buildings()
-        block_table = [b.savestring_encode() for b in block_list]
-        wire_table = [w.savestring_encode(block_indexes) for w in wire_list]
-        building_table = [bd.savestring_encode(block_indexes) for bd in buildings_list]
-        #data_table = []
-        
-        # TODO: Custom build and data support
+    @staticmethod
+    def _dirty_in_order(dirty: set[str], table: Dict[str, Any]) -> List[str]:
+        """
+        Dirty names that are still in the table: in table order when many are
+        dirty, as walking the dict is much friendlier to the cache than walking
+        the set, otherwise in set order. The fragment dicts keep table order on
+        their own, so the saved order doesn't depend on it.
+        """
+        if len(dirty) * 4 > len(table):
+            return [name for name in table if name in dirty]
+        return [name for name in dirty if name in table]
+
+    def _refresh_save_cache(self, workers: int = 1):
+        """
+        Encode the components changed since the last save, split between
+        forked worker processes when there are many of them
+        """
+        blocks = self.blocks
+        dirty_blocks = self._dirty_in_order(self._dirty_blocks, blocks)
+        appended: List[str] = []
+        for name in dirty_blocks:
+            component = blocks[name]
+            if isinstance(component, Array):
+                width = cast(int, component.width)
+                names = [f"{component.name}.{i}" for i in range(width)]
+            else:
+                names = [component.name]
+            old_names = self._block_names.get(name)
+            if old_names is None:
+                appended.append(name)
+            elif old_names != names:
+                self._renumber = True
+            self._block_names[name] = names
+
+        block_index = self._block_index
+        if self._renumber:
+            block_index.clear()
+            index = 1
+            for name in self._block_fragments:
+                for n in self._block_names[name]:
+                    block_index[n] = index
+                    index += 1
+            self._next_index = index
+        elif appended:
+            # New components always land at the end of the dicts, so the
+            # existing indexes don't change
+            new_names = set(appended)
+            tail: List[str] = []
+            for name in reversed(self._block_fragments):
+                if name not in new_names:
+                    break
+                tail.append(name)
+            index = self._next_index
+            for name in reversed(tail):
+                for n in self._block_names[name]:
+                    block_index[n] = index
+                    index += 1
+            self._next_index = index
+
+        # Indexes may have shifted, so every wire and building is encoded again
+        wires = self.wires
+        all_wires = self._renumber or len(self._dirty_wires) == len(wires)
+        wire_list = list(wires.values()) if all_wires else []
+        block_fragments = self._block_fragments
+        if workers > 1 and len(dirty_blocks) + len(wire_list) >= PARALLEL_SAVE_MIN:
+            encoded_blocks, encoded_wires = self._encode_in_workers(dirty_blocks, wire_list, workers)
+        else:
+            encoded_blocks = encode_block_fragments(blocks, dirty_blocks)
+            encoded_wires = encode_wire_fragments(wire_list, block_index)
+        block_fragments.update(zip(dirty_blocks, encoded_blocks))
 
-        string = ";".join(block_table) + "?" + ";".join(wire_table) + "?" + ";".join(building_table) +"?"
+        if all_wires:
+            self._wire_fragments = dict(zip(wires.keys(), encoded_wires))
+        else:
+            wire_fragments = self._wire_fragments
+            for name in self._dirty_in_order(self._dirty_wires, wires):
+                wire_fragments[name] = wires[name].savestring_encode(block_index)
+
+        buildings = self.buildings
+        building_fragments = self._building_fragments
+        building_names = buildings.keys() if self._renumber else self._dirty_in_order(self._dirty_buildings, buildings)
+        for name in building_names:
+            building_fragments[name] = buildings[name].savestring_encode(block_index)
+
+        self._dirty_blocks.clear()
+        self._dirty_wires.clear()
+        self._dirty_buildings.clear()
+        self._renumber = False
+
+    def _encode_in_workers(self, names: List[str], wires: List[Wire], workers: int) -> Tuple[List[str], List[str]]:
+        """
+        Fragments of the named components and of the wires, encoded in shards by
+        worker processes and put back in order. The workers are forked, so they
+        get the module from their initializer without pickling it; without fork
+        it is done here.
+        """
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return encode_block_fragments(self.blocks, names), encode_wire_fragments(wires, self._block_index)
+
+        def shards(kind: str, n: int) -> List[Tuple[str, int, int]]:
+            step = max(-(-n // workers), 1)
+            return [(kind, start, min(start + step, n)) for start in range(0, n, step)]
+
+        block_shards = shards("blocks", len(names))
+        wire_shards = shards("wires", len(wires))
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_save_worker, initargs=((self, names, wires),)
+        ) as pool:
+            encoded = list(pool.map(_encode_save_shard, block_shards + wire_shards))
+        blocks = [f for fragments in encoded[:len(block_shards)] for f in fragments]
+        return blocks, [f for fragments in encoded[len(block_shards):] for f in fragments]
+
+    def save(self, path: str, workers: int = 1):
+        """
+        Export module as a Circuit Maker 2 save string. The data section is left
+        empty: memory images (Building.data) aren't written until their format is
+        checked against game saves.
+        With workers > 1, big saves encode blocks and wires in that many processes,
+        giving the same string.
+        """
+        self._refresh_save_cache(workers)
+        block_table = filter(None, self._block_fragments.values()) # Skip empty arrays
+        wire_table = self._wire_fragments.values()
+        building_table = self._building_fragments.values()
+        string = ";".join(block_table) + "?" + ";".join(wire_table) + "?" + ";".join(building_table) + "?"
         
         with open(path, "w") as file:
             file.write(string)
 
         return string
-    
+
     def merge(self, other: 'Module'):
+        # Instances are summarized on first use (see _summarize_instances), unless already timed
+        timed = "input" in other.ports and "output" in other.ports
+        if timed:
+            pins = {f"{other.name}.{name}" for name in other._get_port_blocks("input") + other._get_port_blocks("output")}
+            summary = other._latency[1] if other._latency is not None and other._latency[0] == other.ports else None
+        # The blocks and wires are all new here, so no other summary of this module changes
+        if other.name in self._summary_members:
+            self._drop_summary(other.name)
+        blocks: Dict[str, Union[Block, Array]] = {}
         for name, component in other.blocks.items():
-            component.name = f"{other.name}.{component.name}"
-            self.blocks[f"{other.name}.{name}"] = component
-        for name, wire in other.wires.items():
-            self.wires[f"{other.name}.{name}"] = Wire(f"{other.name}.{wire.src}", f"{other.name}.{wire.dst}")
+            object.__setattr__(component, "name", f"{other.name}.{component.name}")
+            blocks[f"{other.name}.{name}"] = component
+        self._insert_blocks(blocks)
+        wires: Dict[str, Wire] = {}
+        for wire in other.wires.values():
+            src, dst = f"{other.name}.{wire.src}", f"{other.name}.{wire.dst}"
+            wires[f"{src}->{dst}"] = Wire(src, dst)
+        self._insert_wires(wires)
+        for name, building in other.buildings.items():
+            for building_wires in building.wires:
+                for w in building_wires:
+                    w.building = f"{other.name}.{w.building}"
+                    w.src = f"{other.name}.{w.src}"
+            building.name = f"{other.name}.{building.name}"
+            self.buildings[f"{other.name}.{name}"] = building
+        if timed:
+            members = [f"{other.name}.{name}" for name in other.blocks]
+            if summary is not None:
+                self._summaries[other.name] = summary.prefixed(other.name)
+            else:
+                self._pending_summaries[other.name] = (copy.deepcopy(other.ports), dict(other.links))
+            self._summary_pins[other.name] = pins
+            self._summary_members[other.name] = members
+            for name in members:
+                self._summary_of[name] = other.name
 
     def show_components(self, wires: bool = False):
         for k, b in self.blocks.items():
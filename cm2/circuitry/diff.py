@@ -0,0 +1,434 @@
+"""cm2/circuitry/diff.py
+
+Structural diff of two Modules, or of two builds on disk (savestrings, binary
+netlists or Yosys JSON netlists). Blocks are matched by port bits, names and
+the structure around them, using hashes of their surroundings instead of
+comparing blocks pairwise. The added, removed and retyped blocks and the
+rewired wires are reported by hierarchical prefix.
+
+Usage: python -m cm2.circuitry.diff <old_file> <new_file> [--top ALU] [--depth 1] [--no-names] [--json]
+"""
+
+from .core import *
+from .timing import get_prefix
+import argparse
+import json
+import sys
+
+DIFF_ROUNDS = 3 # Wires away from a block that its signature covers
+DIFF_PASSES = 8 # Most rounds of signature matching, each anchored on the matches of the last
+
+class BlockChange(TypedDict):
+    name: str
+    prefix: str
+    type: str
+
+class RetypedBlock(TypedDict):
+    old: str
+    new: str
+    prefix: str
+    old_type: str
+    new_type: str
+
+class WireChange(TypedDict):
+    src: str
+    dst: str
+    prefix: str
+
+class PrefixChanges(TypedDict):
+    prefix: str
+    added: int
+    removed: int
+    retyped: int
+    rewired: int
+
+class ModuleDiff(TypedDict):
+    matched: int
+    added: List[BlockChange]
+    removed: List[BlockChange]
+    retyped: List[RetypedBlock]
+    added_wires: List[WireChange]
+    removed_wires: List[WireChange]
+    prefixes: List[PrefixChanges]
+
+def block_type(block: Union[Block, Array]) -> str:
+    """Block id with its properties and initial state, e.g. 'delay 3' or 'flipflop on'"""
+    return " ".join([block.block_id] + (block.properties or []) + (["on"] if block.state else []))
+
+def _number(text: str) -> float | int:
+    return int(text) if text.lstrip("-").isdigit() else float(text)
+
+def savestring_to_module(string: str, name: str = "main") -> Module:
+    """
+    Module of a savestring, with blocks named by their index from 1, as wires refer
+    to them, and buildings as 'building.<index>'. Custom builds and memory images
+    in the data section aren't loaded.
+    """
+    sections = string.strip().split("?")
+    sections += [""] * (4 - len(sections))
+    m = Module(name)
+
+    blocks: List[Union[Block, Array]] = []
+    for i, fragment in enumerate(f for f in sections[0].split(";") if f):
+        fields = fragment.split(",")
+        properties = fields[5].split("+") if len(fields) > 5 and fields[5] else None
+        pos = (_number(fields[2]), _number(fields[3]), _number(fields[4]))
+        blocks.append(Block(str(i + 1), BlockID(int(fields[0])).name.lower(), pos, fields[1] == "1", properties))
+    wires: Dict[str, Wire] = {}
+    for fragment in sections[1].split(";"):
+        if fragment:
+            src, dst = fragment.split(",")
+            wires[f"{src}->{dst}"] = Wire(src, dst)
+    m.add_bulk(blocks, wires)
+
+    building_types = {cast(str, b.value["name"]): b.name.lower() for b in BuildingData}
+    for i, fragment in enumerate(f for f in sections[2].split(";") if f):
+        fields = fragment.split(",")
+        assert fields[0] in building_types, f"Can't load building type '{fields[0]}', custom builds aren't supported"
+        building_type = building_types[fields[0]]
+        # Building adds the offset of its type back
+        offset = cast(Tuple[int, int, int], BuildingData[str.upper(building_type)].value["pos_offset"])
+        pos = Vector3(float(fields[1]), float(fields[2]), float(fields[3])) - Vector3(*offset)
+        rot = [[float(x) for x in fields[4 + 3 * r:7 + 3 * r]] for r in range(3)]
+        building = Building(f"building.{i}", building_type, CFrame(pos, rot))
+        for pin, entries in enumerate(fields[13:]):
+            for entry in entries.split("+") if entries else []:
+                building.add_wire(BuildingWire(building.name, pin, Port(int(entry[0])).name.lower(), entry[1:]))
+        m.add(building)
+    return m
+
+class DiffGraph:
+    """Expanded block graph of a Module, with the type of every block and its wires both ways"""
+
+    def __init__(self, module: Module, depth: Optional[int] = None):
+        self.names: List[str] = []
+        self.types: List[str] = []
+        self.index: Dict[str, int] = {}
+        for k, c in module.blocks.items():
+            t = block_type(c)
+            expanded = [f"{k}.{i}" for i in range(c.width or 0)] if isinstance(c, Array) else [k]
+            for name in expanded:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+                self.types.append(t)
+        self.n = len(self.names)
+        self.depth = depth
+
+        wire_src: List[int] = []
+        wire_dst: List[int] = []
+        for w in module.wires.values():
+            if w.src in self.index and w.dst in self.index:
+                wire_src.append(self.index[w.src])
+                wire_dst.append(self.index[w.dst])
+        self.edges = np.unique(np.array(wire_src, np.int64) * self.n + np.array(wire_dst, np.int64))
+        self.src, self.dst = self.edges // max(self.n, 1), self.edges % max(self.n, 1) # Sorted by source
+
+        vertices = np.arange(self.n + 1)
+        self.out_start: List[int] = np.searchsorted(self.src, vertices).tolist()
+        self.outputs: List[int] = self.dst.tolist()
+        by_dst = np.argsort(self.dst, kind="stable")
+        self.in_start: List[int] = np.searchsorted(self.dst[by_dst], vertices).tolist()
+        self.inputs: List[int] = self.src[by_dst].tolist()
+
+        self.ports: Dict[str, List[int]] = {
+            port: [self.index[name] for name in module._get_port_blocks(port) if name in self.index] for port in module.ports
+        }
+
+    def get_inputs(self, v: int) -> List[int]:
+        return self.inputs[self.in_start[v]:self.in_start[v + 1]]
+
+    def get_outputs(self, v: int) -> List[int]:
+        return self.outputs[self.out_start[v]:self.out_start[v + 1]]
+
+    def prefix(self, v: int) -> str:
+        return get_prefix(self.names[v], self.depth)
+
+    def signatures(self, labels: np.ndarray, rounds: int) -> List[np.ndarray]:
+        """The labels, then hashes of each block with the blocks up to 1, 2, ... rounds wires away"""
+        levels = [labels]
+        h = labels
+        for _ in range(rounds):
+            incoming, outgoing = self.neighbors(h)
+            h = mix64_array(h + incoming + outgoing)
+            levels.append(h)
+        return levels
+
+    def neighbors(self, h: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Hashes of the labels of the inputs and of the outputs of each block"""
+        incoming = np.zeros(self.n, np.uint64)
+        outgoing = np.zeros(self.n, np.uint64)
+        np.add.at(incoming, self.dst, mix64_array(h[self.src] ^ np.uint64(FINGERPRINT_KEYS[2])))
+        np.add.at(outgoing, self.src, mix64_array(h[self.dst] ^ np.uint64(FINGERPRINT_KEYS[3])))
+        return mix64_array(incoming), mix64_array(outgoing ^ np.uint64(FINGERPRINT_KEYS[4]))
+
+def _unique_values(values: np.ndarray, blocks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The values found once, sorted, and the blocks they belong to"""
+    unique, first, counts = np.unique(values, return_index=True, return_counts=True)
+    once = counts == 1
+    return unique[once], blocks[first[once]]
+
+def match_blocks(old: DiffGraph, new: DiffGraph, names: bool = True) -> np.ndarray:
+    """
+    New block matched to each old block, -1 where there is none. Port bits match
+    in port order, then blocks of the same name (if names is set) unless both their
+    type and their neighbors changed. Blocks left match on hashes of their
+    surroundings found once on each side, nearest blocks to the matched ones first,
+    then by elimination between the neighbors of matched blocks. Blocks nothing
+    tells apart are paired in any order.
+    """
+    old_to_new = np.full(old.n, -1, np.int64)
+    new_to_old = np.full(new.n, -1, np.int64)
+
+    def pair(a: np.ndarray, b: np.ndarray):
+        free = (old_to_new[a] < 0) & (new_to_old[b] < 0)
+        a, b = a[free], b[free]
+        # Keep the first pair of a block matched twice in the same batch
+        a, first = np.unique(a, return_index=True)
+        b = b[first]
+        b, first = np.unique(b, return_index=True)
+        a = a[first]
+        old_to_new[a] = b
+        new_to_old[b] = a
+
+    for port, bits in old.ports.items():
+        other = new.ports.get(port, [])
+        count = min(len(bits), len(other))
+        pair(np.array(bits[:count], np.int64), np.array(other[:count], np.int64))
+
+    labels: Dict[str, int] = {}
+    def type_labels(graph: DiffGraph) -> np.ndarray:
+        for t in graph.types:
+            if t not in labels:
+                labels[t] = hash_label(t)
+        return np.array([labels[t] for t in graph.types], np.uint64)
+    old_types, new_types = type_labels(old), type_labels(new)
+
+    if names:
+        common = [(a, new.index[name]) for a, name in enumerate(old.names) if name in new.index]
+        if common:
+            a, b = np.array(common, np.int64).T
+            old_context = sum(old.neighbors(old_types))
+            new_context = sum(new.neighbors(new_types))
+            same = (old_types[a] == new_types[b]) | (old_context[a] == new_context[b])
+            pair(a[same], b[same])
+
+    def anchored_levels() -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """Signatures of both sides, with matched blocks labeled the same on both"""
+        old_labels, new_labels = old_types.copy(), new_types.copy()
+        matched = np.flatnonzero(old_to_new >= 0)
+        pair_labels = mix64_array(old_to_new[matched].astype(np.uint64) ^ np.uint64(FINGERPRINT_KEYS[0]))
+        old_labels[matched] = pair_labels
+        new_labels[old_to_new[matched]] = pair_labels
+        return old.signatures(old_labels, DIFF_ROUNDS), new.signatures(new_labels, DIFF_ROUNDS)
+
+    def match_signatures():
+        for _ in range(DIFF_PASSES):
+            old_levels, new_levels = anchored_levels()
+            found = 0
+            for k in range(DIFF_ROUNDS, 0, -1):
+                a = np.flatnonzero(old_to_new < 0)
+                b = np.flatnonzero(new_to_old < 0)
+                if len(a) == 0 or len(b) == 0:
+                    return
+                old_values, old_blocks = _unique_values(old_levels[k][a], a)
+                new_values, new_blocks = _unique_values(new_levels[k][b], b)
+                _, i, j = np.intersect1d(old_values, new_values, assume_unique=True, return_indices=True)
+                pair(old_blocks[i], new_blocks[j])
+                found += len(i)
+            if found == 0:
+                return
+
+    def propagate():
+        """
+        Unmatched neighbors of matched blocks, alone or alone of their type on both sides,
+        if most of their matched neighbors are matched to neighbors of the other
+        """
+        forward: List[int] = old_to_new.tolist()
+        backward: List[int] = new_to_old.tolist()
+
+        def agree(x: int, y: int) -> bool:
+            same = total = 0
+            for xs, ys in ((old.get_inputs(x), new.get_inputs(y)), (old.get_outputs(x), new.get_outputs(y))):
+                matched = [forward[v] for v in xs if forward[v] >= 0]
+                total += len(matched)
+                same += len(set(matched).intersection(ys))
+            return 2 * same > total
+
+        queue = [a for a in range(old.n) if forward[a] >= 0]
+        while queue:
+            a = queue.pop()
+            b = forward[a]
+            for xs, ys in ((old.get_inputs(a), new.get_inputs(b)), (old.get_outputs(a), new.get_outputs(b))):
+                xs = [x for x in xs if forward[x] < 0]
+                ys = [y for y in ys if backward[y] < 0]
+                if not xs or not ys:
+                    continue
+                if len(xs) == 1 and len(ys) == 1:
+                    pairs = [(xs[0], ys[0])]
+                else:
+                    by_type: Dict[str, Tuple[List[int], List[int]]] = {}
+                    for x in xs:
+                        by_type.setdefault(old.types[x], ([], []))[0].append(x)
+                    for y in ys:
+                        by_type.setdefault(new.types[y], ([], []))[1].append(y)
+                    pairs = [(x[0], y[0]) for x, y in by_type.values() if len(x) == 1 and len(y) == 1]
+                for x, y in pairs:
+                    if not agree(x, y):
+                        continue
+                    forward[x] = y
+                    backward[y] = x
+                    queue.append(x)
+        old_to_new[:] = forward
+        new_to_old[:] = backward
+
+    def break_ties() -> int:
+        """
+        Pairs one block of each group that no signature tells apart, the same number
+        of them on both sides (e.g. copies of the same instance), for the next
+        signatures to tell the others apart
+        """
+        old_levels, new_levels = anchored_levels()
+        a = np.flatnonzero(old_to_new < 0)
+        b = np.flatnonzero(new_to_old < 0)
+        if len(a) == 0 or len(b) == 0:
+            return 0
+        old_values, old_first, old_counts = np.unique(old_levels[-1][a], return_index=True, return_counts=True)
+        new_values, new_first, new_counts = np.unique(new_levels[-1][b], return_index=True, return_counts=True)
+        _, i, j = np.intersect1d(old_values, new_values, assume_unique=True, return_indices=True)
+        tied = (old_counts[i] == new_counts[j]) & (old_counts[i] > 1)
+        pair(a[old_first[i[tied]]], b[new_first[j[tied]]])
+        return int(tied.sum())
+
+    for _ in range(DIFF_PASSES):
+        match_signatures()
+        propagate()
+        if break_ties() == 0:
+            break
+    return old_to_new
+
+def diff_modules(old: Module, new: Module, names: bool = True, depth: Optional[int] = None) -> ModuleDiff:
+    """
+    Blocks added, removed and retyped from old to new, and wires added or removed
+    between matched blocks, counted by hierarchical prefix (cut to depth levels, if
+    given). Set names to False when block names mean nothing, e.g. for savestrings.
+    """
+    old_graph, new_graph = DiffGraph(old, depth), DiffGraph(new, depth)
+    old_to_new = match_blocks(old_graph, new_graph, names)
+    new_to_old = np.full(new_graph.n, -1, np.int64)
+    matched = np.flatnonzero(old_to_new >= 0)
+    new_to_old[old_to_new[matched]] = matched
+
+    added: List[BlockChange] = [
+        {"name": new_graph.names[b], "prefix": new_graph.prefix(b), "type": new_graph.types[b]}
+        for b in np.flatnonzero(new_to_old < 0).tolist()
+    ]
+    removed: List[BlockChange] = [
+        {"name": old_graph.names[a], "prefix": old_graph.prefix(a), "type": old_graph.types[a]}
+        for a in np.flatnonzero(old_to_new < 0).tolist()
+    ]
+    retyped: List[RetypedBlock] = []
+    for a, b in zip(matched.tolist(), old_to_new[matched].tolist()):
+        if old_graph.types[a] != new_graph.types[b]:
+            retyped.append({
+                "old": old_graph.names[a], "new": new_graph.names[b], "prefix": new_graph.prefix(b),
+                "old_type": old_graph.types[a], "new_type": new_graph.types[b]
+            })
+
+    def changed_wires(graph: DiffGraph, mapping: np.ndarray, other: DiffGraph) -> List[WireChange]:
+        """Wires of graph between matched blocks that other doesn't have"""
+        src, dst = mapping[graph.src], mapping[graph.dst]
+        both = (src >= 0) & (dst >= 0)
+        missing = both & ~np.isin(src * other.n + dst, other.edges)
+        return [
+            {"src": graph.names[u], "dst": graph.names[v], "prefix": graph.prefix(v)}
+            for u, v in zip(graph.src[missing].tolist(), graph.dst[missing].tolist())
+        ]
+    removed_wires = changed_wires(old_graph, old_to_new, new_graph)
+    added_wires = changed_wires(new_graph, new_to_old, old_graph)
+
+    counts: Dict[str, PrefixChanges] = {}
+    def count(prefix: str, kind: str):
+        if prefix not in counts:
+            counts[prefix] = {"prefix": prefix, "added": 0, "removed": 0, "retyped": 0, "rewired": 0}
+        counts[prefix][kind] += 1
+    for changes, kind in ((added, "added"), (removed, "removed"), (retyped, "retyped"),
+                          (added_wires, "rewired"), (removed_wires, "rewired")):
+        for change in changes:
+            count(change["prefix"], kind)
+    prefixes = sorted(
+        counts.values(), key=lambda c: (-(c["added"] + c["removed"] + c["retyped"] + c["rewired"]), c["prefix"])
+    )
+
+    return {
+        "matched": len(matched),
+        "added": added,
+        "removed": removed,
+        "retyped": retyped,
+        "added_wires": added_wires,
+        "removed_wires": removed_wires,
+        "prefixes": prefixes
+    }
+
+def diff_report(diff: ModuleDiff, limit: int = 20) -> str:
+    """Human readable report of a diff, listing up to limit changes of each kind"""
+    lines = [
+        f"{diff['matched']} block(s) matched, {len(diff['added'])} added, {len(diff['removed'])} removed, "
+        f"{len(diff['retyped'])} retyped, {len(diff['added_wires'])} wire(s) added and "
+        f"{len(diff['removed_wires'])} removed between matched blocks"
+    ]
+    if diff["prefixes"]:
+        lines.append("")
+        lines.append("Changes per prefix (added, removed, retyped, rewired):")
+        for c in diff["prefixes"]:
+            lines.append(f"  {c['added']:6} {c['removed']:6} {c['retyped']:6} {c['rewired']:6}  {c['prefix'] or '<top>'}")
+
+    def section(title: str, entries: List[str]):
+        if entries:
+            lines.append("")
+            lines.append(f"{title}:")
+            lines.extend(f"  {entry}" for entry in entries[:limit])
+            if len(entries) > limit:
+                lines.append(f"  ... {len(entries) - limit} more")
+    section("Added blocks", [f"+ {c['type']:<8} {c['name']}" for c in diff["added"]])
+    section("Removed blocks", [f"- {c['type']:<8} {c['name']}" for c in diff["removed"]])
+    section("Retyped blocks", [f"~ {c['old_type']} -> {c['new_type']}  {c['old']} -> {c['new']}" for c in diff["retyped"]])
+    section("Added wires", [f"+ {w['src']} -> {w['dst']}" for w in diff["added_wires"]])
+    section("Removed wires", [f"- {w['src']} -> {w['dst']}" for w in diff["removed_wires"]])
+    return "\n".join(lines)
+
+def load_module(path: str, top: Optional[str] = None) -> Tuple[Module, bool]:
+    """Module from a savestring, binary netlist or Yosys JSON netlist, and whether its block names are meaningful"""
+    with open(path, "rb") as file:
+        head = file.read(64)
+    if head.startswith(b"CM2NET"):
+        from .netlist import netlist_to_module
+        return netlist_to_module(path), True
+    if head.lstrip().startswith(b"{"):
+        from .hdl import json_to_module
+        assert top is not None, f"The top module is needed to load Yosys JSON netlist '{path}'"
+        return json_to_module(path)[top], True
+    with open(path) as file:
+        return savestring_to_module(file.read()), False
+
+def main():
+    parser = argparse.ArgumentParser(description="Lists what changed between two builds of a circuit")
+    parser.add_argument("old", help="savestring, binary netlist or Yosys JSON netlist")
+    parser.add_argument("new", help="savestring, binary netlist or Yosys JSON netlist")
+    parser.add_argument("--top", help="top module, when loading Yosys JSON netlists")
+    parser.add_argument("--depth", type=int, default=None, help="hierarchy levels to group changes by")
+    parser.add_argument("--no-names", action="store_true", help="match blocks by structure only")
+    parser.add_argument("--limit", type=int, default=20, help="changes of each kind to list (default: 20)")
+    parser.add_argument("--json", action="store_true", help="print the diff as JSON")
+    args = parser.parse_args()
+
+    old, old_named = load_module(args.old, args.top)
+    new, new_named = load_module(args.new, args.top)
+    diff = diff_modules(old, new, old_named and new_named and not args.no_names, args.depth)
+    if args.json:
+        json.dump(diff, sys.stdout, indent=2)
+        print()
+    else:
+        print(diff_report(diff, args.limit))
+
+if __name__ == "__main__":
+    main()
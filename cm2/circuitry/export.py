@@ -0,0 +1,263 @@
+"""cm2/circuitry/export.py
+
+Chunked export of a Module into several savestrings, one per spatial region
+or hierarchical prefix, for builds too big to paste at once. Every chunk
+numbers its own blocks, and the wires between chunks are listed instead of
+saved, to be joined by hand or through antennas. Chunks are encoded and
+written by worker processes.
+
+Usage: python -m cm2.circuitry.export <file> <out_dir> [--top ALU] [--by region|prefix] [--size 64] [--depth 1] [--workers 8] [--json]
+"""
+
+from .core import *
+from .timing import get_prefix
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import sys
+
+EXPORT_REGION_SIZE = 64 # Side of the cubic regions chunks are cut by, in blocks
+
+class ChunkInfo(TypedDict):
+    name: str
+    path: str
+    blocks: int
+    wires: int
+    buildings: int
+    links: int # Connections to other chunks, left out of the savestring
+
+class ChunkLink(TypedDict):
+    src: str # Block name, or building name and pin as "name[pin]"
+    dst: str
+    src_chunk: str
+    dst_chunk: str
+    src_index: int # Block index in the savestring of its chunk, or pin index
+    dst_index: int
+
+class ChunkExport(TypedDict):
+    chunks: List[ChunkInfo]
+    links: List[ChunkLink]
+
+class _ChunkPayload(TypedDict):
+    """What the workers encode the chunks from, plain data so it pickles without the module"""
+    paths: List[str]
+    fragments: List[str] # Savestring fragment of every component
+    components: List[np.ndarray] # Indexes into fragments of each chunk, in module order
+    wires: List[Tuple[np.ndarray, np.ndarray]] # Local source and destination indexes of each chunk
+    buildings: List[List[str]]
+
+_payload: Optional[_ChunkPayload] = None
+
+def _init_worker(payload: _ChunkPayload):
+    global _payload
+    _payload = payload
+
+def _write_chunk(chunk: int) -> int:
+    """Encode a chunk and write it to its file, returning its length"""
+    payload = cast(_ChunkPayload, _payload)
+    fragments = payload["fragments"]
+    block_table = filter(None, [fragments[i] for i in payload["components"][chunk].tolist()]) # Skip empty arrays
+    wire_table = encode_wire_pairs(*payload["wires"][chunk])
+    string = ";".join(block_table) + "?" + ";".join(wire_table) + "?" + ";".join(payload["buildings"][chunk]) + "?"
+    with open(payload["paths"][chunk], "w") as file:
+        file.write(string)
+    return len(string)
+
+def _group(chunk_of: np.ndarray, n_chunks: int) -> List[np.ndarray]:
+    """Indexes of the items of every chunk, in their order"""
+    order = np.argsort(chunk_of, kind="stable")
+    bounds = np.searchsorted(chunk_of[order], np.arange(n_chunks + 1))
+    return [order[bounds[c]:bounds[c + 1]] for c in range(n_chunks)]
+
+def get_chunk_keys(
+    module: Module,
+    by: Literal["region", "prefix"] = "region",
+    size: float = EXPORT_REGION_SIZE,
+    depth: Optional[int] = 1
+) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Chunk of every component and building: the cube of the given size its
+    position falls in, named "x_y_z" in sizes, or its hierarchical prefix down
+    to depth levels (the module name for the top level). Arrays stay whole,
+    in the region of their first block.
+    """
+    assert by in ("region", "prefix"), f"Chunks can be cut by 'region' or 'prefix', not '{by}'"
+    assert size > 0, "Region size must be positive"
+
+    def key(name: str, pos: Vector3) -> str:
+        if by == "prefix":
+            return get_prefix(name, depth) or module.name
+        return "_".join(str(math.floor(v / size)) for v in (pos.x, pos.y, pos.z))
+
+    components = {name: key(name, c.pos) for name, c in module.blocks.items()}
+    buildings = {name: key(name, b.cframe.pos) for name, b in module.buildings.items()}
+    return components, buildings
+
+def save_chunks(
+    module: Module,
+    directory: str,
+    by: Literal["region", "prefix"] = "region",
+    size: float = EXPORT_REGION_SIZE,
+    depth: Optional[int] = 1,
+    workers: Optional[int] = None
+) -> ChunkExport:
+    """
+    Save the module as one savestring per chunk (see get_chunk_keys), written
+    to chunk_<i>.txt in the directory by up to workers processes (one per core
+    by default). Each chunk has the blocks and buildings of the chunk, in
+    module order, and the wires and building pins inside it. The connections
+    between chunks are returned, with the indexes of their ends in the
+    savestrings of their chunks.
+    """
+    workers = workers or os.cpu_count() or 1
+    module._refresh_save_cache(workers)
+    component_keys, building_keys = get_chunk_keys(module, by, size, depth)
+    chunk_names = list(dict.fromkeys([*component_keys.values(), *building_keys.values()]))
+    chunk_ids = {name: c for c, name in enumerate(chunk_names)}
+    n_chunks = len(chunk_names)
+    os.makedirs(directory, exist_ok=True)
+    paths = [os.path.join(directory, f"chunk_{c}.txt") for c in range(n_chunks)]
+
+    # Same numbering as save, from the cache, then local to each chunk
+    components = list(module._block_fragments)
+    block_names = [n for name in components for n in module._block_names[name]]
+    counts = np.array([len(module._block_names[name]) for name in components], np.int64)
+    component_chunk = np.array([chunk_ids[component_keys[name]] for name in components], np.int64)
+    block_chunk = np.repeat(component_chunk, counts)
+    local = np.empty(len(block_chunk), np.int64)
+    for members in _group(block_chunk, n_chunks):
+        local[members] = np.arange(1, len(members) + 1)
+
+    block_index = module._block_index
+    wire_list = list(module.wires.values())
+    src = np.array([block_index.get(w.src, 0) for w in wire_list], np.int64) - 1
+    dst = np.array([block_index.get(w.dst, 0) for w in wire_list], np.int64) - 1
+    if np.any(src < 0) or np.any(dst < 0):
+        for w in wire_list:
+            w.savestring_encode(block_index) # Fails on the first missing block
+    src_chunk = block_chunk[src]
+    dst_chunk = block_chunk[dst]
+    inside = src_chunk == dst_chunk
+    wire_chunk = np.where(inside, src_chunk, n_chunks) # Crossing wires go past the last chunk
+    wires = [(local[src[members]], local[dst[members]]) for members in _group(wire_chunk, n_chunks)]
+
+    links: List[ChunkLink] = []
+    for i in np.flatnonzero(~inside).tolist():
+        s, d = int(src[i]), int(dst[i])
+        links.append({
+            "src": block_names[s],
+            "dst": block_names[d],
+            "src_chunk": chunk_names[block_chunk[s]],
+            "dst_chunk": chunk_names[block_chunk[d]],
+            "src_index": int(local[s]),
+            "dst_index": int(local[d])
+        })
+
+    # Pins wired to blocks of other chunks are left empty
+    buildings: List[List[str]] = [[] for _ in range(n_chunks)]
+    building_counts = [0] * n_chunks
+    for name, building in module.buildings.items():
+        c = chunk_ids[building_keys[name]]
+        chunk_building = Module._copy_building(building)
+        local_index: Dict[str, int] = {}
+        for pin, pin_wires in enumerate(chunk_building.wires):
+            kept: List[BuildingWire] = []
+            for w in pin_wires:
+                assert w.src in block_index, f"Block '{w.src}' wired to building '{name}' doesn't exist"
+                b = block_index[w.src] - 1
+                if block_chunk[b] == c:
+                    local_index[w.src] = int(local[b])
+                    kept.append(w)
+                    continue
+                block_end: Tuple[str, str, int] = (w.src, chunk_names[block_chunk[b]], int(local[b]))
+                pin_end: Tuple[str, str, int] = (f"{name}[{pin}]", chunk_names[c], pin)
+                ends = (block_end, pin_end) if w.port == "in" else (pin_end, block_end)
+                links.append({
+                    "src": ends[0][0],
+                    "dst": ends[1][0],
+                    "src_chunk": ends[0][1],
+                    "dst_chunk": ends[1][1],
+                    "src_index": ends[0][2],
+                    "dst_index": ends[1][2]
+                })
+            chunk_building.wires[pin] = kept
+        buildings[c].append(chunk_building.savestring_encode(local_index))
+        building_counts[c] += 1
+
+    payload: _ChunkPayload = {
+        "paths": paths,
+        "fragments": [module._block_fragments[name] for name in components],
+        "components": _group(component_chunk, n_chunks),
+        "wires": wires,
+        "buildings": buildings
+    }
+    workers = min(workers, n_chunks)
+    if workers <= 1:
+        _init_worker(payload)
+        list(map(_write_chunk, range(n_chunks)))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(payload,)) as pool:
+            list(pool.map(_write_chunk, range(n_chunks)))
+
+    link_counts = [0] * n_chunks
+    for link in links:
+        link_counts[chunk_ids[link["src_chunk"]]] += 1
+        link_counts[chunk_ids[link["dst_chunk"]]] += 1
+    block_counts = np.bincount(block_chunk, minlength=n_chunks).tolist()
+    chunks: List[ChunkInfo] = [
+        {
+            "name": chunk_names[c],
+            "path": paths[c],
+            "blocks": block_counts[c],
+            "wires": len(wires[c][0]),
+            "buildings": building_counts[c],
+            "links": link_counts[c]
+        }
+        for c in range(n_chunks)
+    ]
+    return {"chunks": chunks, "links": links}
+
+def export_report(export: ChunkExport, limit: int = 20) -> str:
+    """Text summary of a chunked export"""
+    lines = [f"{len(export['chunks'])} chunk(s), {len(export['links'])} connection(s) between them"]
+    for chunk in export["chunks"]:
+        lines.append(
+            f"  {chunk['path']}: {chunk['name']}, {chunk['blocks']} block(s), {chunk['wires']} wire(s), "
+            f"{chunk['buildings']} building(s), {chunk['links']} link(s)"
+        )
+    if export["links"]:
+        lines.append("Connections to join:")
+        for link in export["links"][:limit]:
+            lines.append(
+                f"  {link['src']} ({link['src_chunk']} #{link['src_index']}) -> "
+                f"{link['dst']} ({link['dst_chunk']} #{link['dst_index']})"
+            )
+        if len(export["links"]) > limit:
+            lines.append(f"  ... {len(export['links']) - limit} more")
+    return "\n".join(lines)
+
+def main():
+    from .diff import load_module
+
+    parser = argparse.ArgumentParser(description="Saves a circuit as one savestring per region or module")
+    parser.add_argument("file", help="savestring, binary netlist or Yosys JSON netlist")
+    parser.add_argument("out_dir", help="directory to write the chunk savestrings to")
+    parser.add_argument("--top", help="top module, when loading Yosys JSON netlists")
+    parser.add_argument("--by", choices=["region", "prefix"], default="region", help="how to cut chunks (default: region)")
+    parser.add_argument("--size", type=float, default=EXPORT_REGION_SIZE, help=f"region side (default: {EXPORT_REGION_SIZE})")
+    parser.add_argument("--depth", type=int, default=1, help="hierarchy levels of prefix chunks (default: 1)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--limit", type=int, default=20, help="connections to list (default: 20)")
+    parser.add_argument("--json", action="store_true", help="print the export report as JSON")
+    args = parser.parse_args()
+
+    module, _ = load_module(args.file, args.top)
+    export = save_chunks(module, args.out_dir, args.by, args.size, args.depth, args.workers)
+    if args.json:
+        json.dump(export, sys.stdout, indent=2)
+        print()
+    else:
+        print(export_report(export, args.limit))
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,11 @@ Functions for Hardware Description Language compilation
 from .builder import *
 from cm2.utils import random_id
 from cm2.modules.hdlm import *
+from typing import Callable
+import base64
+import itertools
 import json
+import zlib
 
 gate_map: Dict[str, Any] = {
     "$reduce_and": And,
@@ -30,10 +34,118 @@ gate_map: Dict[str, Any] = {
     "$_XNOR_": Xnor,
     "$_DLATCH_P_": DLatchP,
     "$_DLATCH_N_": DLatchN,
-    "$_DFF_P_": DFFP
+    "$_DFF_P_": DFFP,
+    "$_MUX_": Mux2,
+    "$_ANDNOT_": AndNot,
+    "$_ORNOT_": OrNot,
+    "$mem_v2": HugeMemory
 }
 
-def parse_json_module(name: str, json_module: Dict[str, Any], auto_balance: bool) -> Module:
+# Pins after the polarity letters of flip-flop cells, e.g. $_SDFFE_PN0P_ is
+# positive clock, negative reset, reset value 0 and positive enable
+FLIPFLOP_PINS: Dict[str, str] = {
+    "DFFE": "CE",
+    "SDFF": "CRV",
+    "SDFFE": "CRVE",
+    "SDFFCE": "CRVE",
+    "DFFSR": "CSR",
+    "DFFSRE": "CSRE"
+}
+
+for kind, pins in FLIPFLOP_PINS.items():
+    for polarities in itertools.product(*["01" if pin == "V" else "NP" for pin in pins]):
+        gate_map[f"$_{kind}_{''.join(polarities)}_"] = DFlipflop
+
+GATE_PINS: Dict[str, Tuple[str, ...]] = {
+    "$_MUX_": ("A", "B", "S"),
+    "$_ANDNOT_": ("A", "B"),
+    "$_ORNOT_": ("A", "B")
+}
+
+def get_parameter(value: Union[int, str]) -> int:
+    """Yosys parameters come as ints or as bit strings, undefined bits read as 0"""
+    if isinstance(value, int):
+        return value
+    return int(value.replace("x", "0").replace("z", "0") or "0", 2)
+
+def parse_memory(name: str, cell: Dict[str, Any], is_bit_on_ports: Callable[[str], bool], auto_balance: bool = False) -> List[Any]:
+    """Maps a $mem_v2 cell to a HugeMemory building, if it fits in one"""
+    parameters = cell["parameters"]
+    connections = cell["connections"]
+    hint = "Synthesize with cm2v.ys instead of cm2v_hugememory.ys to map it to latches"
+
+    abits = get_parameter(parameters["ABITS"])
+    width = get_parameter(parameters["WIDTH"])
+    size = get_parameter(parameters["SIZE"])
+    offset = get_parameter(parameters["OFFSET"])
+    rd_ports = get_parameter(parameters["RD_PORTS"])
+    wr_ports = get_parameter(parameters["WR_PORTS"])
+
+    assert rd_ports == 1 and wr_ports <= 1, f"Memory '{name}' has {rd_ports} read and {wr_ports} write ports, HugeMemory has one of each. {hint}"
+    assert abits <= HUGE_MEMORY_ADDRESS_BITS and size <= 2 ** HUGE_MEMORY_ADDRESS_BITS, f"Memory '{name}' doesn't fit in a HugeMemory address space. {hint}"
+    assert offset == 0, f"Memory '{name}' starts at address {offset}. {hint}"
+    assert width <= HUGE_MEMORY_WORD_BITS, f"Memory '{name}' is {width} bits wide, HugeMemory words have {HUGE_MEMORY_WORD_BITS}. {hint}"
+    assert get_parameter(parameters["RD_CLK_ENABLE"]) == 0, f"Memory '{name}' has a synchronous read port, HugeMemory reads are asynchronous. {hint}"
+    assert set(str(parameters.get("INIT", ""))) <= {"0", "x"}, f"Memory '{name}' has initial contents, which HugeMemory can't load. {hint}"
+
+    components: List[Any] = []
+    constants: List[Any] = []
+    high = f"{name}.high"
+
+    def get_source(bit: Union[int, str]) -> Optional[str]:
+        if bit == "1": # Same constant as on output ports
+            if not constants:
+                constants.append(Flipflop(high, state=True))
+            return high
+        if isinstance(bit, str): # Constant 0 or undefined
+            return None
+        return str(bit)
+
+    read_address = connections["RD_ADDR"]
+    address: List[Optional[str]] = [get_source(bit) for bit in read_address]
+
+    value: List[Optional[str]] = []
+    write: Optional[str] = None
+    if wr_ports == 1:
+        assert connections["WR_ADDR"] == read_address, f"Memory '{name}' reads and writes at different addresses, HugeMemory has a single address bus. {hint}"
+        enables = connections["WR_EN"]
+        assert all(bit == enables[0] for bit in enables), f"Memory '{name}' has per bit write enables. {hint}"
+        value = [get_source(bit) for bit in connections["WR_DATA"]]
+
+        enable = get_source(enables[0])
+        if enable is not None and get_parameter(parameters["WR_CLK_ENABLE"]):
+            # HugeMemory writes while write is on, so write on a one tick pulse after the clock edge,
+            # from the clock and its inverse a tick older: it ends before registers on the same clock
+            # change the address, data or enable. Balancing would align both arms and kill the pulse
+            assert not auto_balance, f"Memory '{name}' has a synchronous write port, which auto_balance can't keep. {hint}"
+            clock = get_source(connections["WR_CLK"][0])
+            if clock is not None:
+                write = f"{name}.write"
+                if get_parameter(parameters["WR_CLK_POLARITY"]):
+                    components.append([
+                        Nor(f"{name}.~clock", inputs=[clock]),
+                        And(write, inputs=[enable, clock, f"{name}.~clock"])
+                    ])
+                else:
+                    components.append([
+                        Nor(f"{name}.~clock", inputs=[clock]),
+                        Delay(f"{name}.clock", inputs=[clock], properties=["2"]),
+                        And(write, inputs=[enable, f"{name}.~clock", f"{name}.clock"])
+                    ])
+        else:
+            write = enable
+
+    output: List[Optional[str]] = []
+    for bit in connections["RD_DATA"]:
+        block_name = str(bit)
+        if not is_bit_on_ports(block_name):
+            components.append(Node(block_name))
+        output.append(block_name)
+
+    components.append(HugeMemory(name, address, value, write, output))
+    return constants + components
+
+def parse_json_module(name: str, json_module: Dict[str, Any], auto_balance: bool, collapse_gates: bool = False) -> Module:
     ports = json_module["ports"]
     cells = json_module["cells"]
 
@@ -170,6 +282,49 @@ def parse_json_module(name: str, json_module: Dict[str, Any], auto_balance: bool
                         Node(outputs[i]),
                         Wire(f"{block_name}.Q", outputs[i])
                     ])
+        elif cell_type in GATE_PINS:
+            pins = [[str(i) for i in cell["connections"][pin]] for pin in GATE_PINS[cell_type]]
+            for i in range(len(outputs)):
+                gate_name = block_name if len(outputs) == 1 else f"{block_name}.{i}"
+                if is_bit_on_ports(outputs[i]):
+                    components.append([
+                        gate_class(gate_name, f"{gate_name}.Y", *[p[i] for p in pins]),
+                        Wire(f"{gate_name}.Y", outputs[i])
+                    ])
+                else:
+                    components.append(gate_class(gate_name, outputs[i], *[p[i] for p in pins]))
+        elif gate_class is DFlipflop:
+            kind, polarities = cell_type[2:-1].split("_")
+            pins = dict(zip(FLIPFLOP_PINS[kind], polarities))
+            connections = {pin: [str(i) for i in bits] for pin, bits in cell["connections"].items()}
+            for i in range(len(outputs)):
+                gate_name = block_name if len(outputs) == 1 else f"{block_name}.{i}"
+                arguments: Dict[str, Any] = {"clock": connections["C"][i], "clock_positive": pins["C"] == "P"}
+                if "E" in pins:
+                    arguments.update(enable=connections["E"][i], enable_positive=pins["E"] == "P")
+                if kind.startswith("SDFF"):
+                    arguments.update(
+                        sync_reset=connections["R"][i],
+                        sync_reset_positive=pins["R"] == "P",
+                        sync_reset_value=pins["V"] == "1",
+                        sync_reset_over_enable=kind != "SDFFCE"
+                    )
+                if kind.startswith("DFFSR"):
+                    arguments.update(
+                        async_set=connections["S"][i],
+                        async_set_positive=pins["S"] == "P",
+                        async_reset=connections["R"][i],
+                        async_reset_positive=pins["R"] == "P"
+                    )
+                if is_bit_on_ports(outputs[i]):
+                    components.append([
+                        gate_class(gate_name, f"{gate_name}.Q", connections["D"][i], **arguments),
+                        Wire(f"{gate_name}.Q", outputs[i])
+                    ])
+                else:
+                    components.append(gate_class(gate_name, outputs[i], connections["D"][i], **arguments))
+        elif cell_type == "$mem_v2":
+            components.append(parse_memory(block_name, cell, is_bit_on_ports, auto_balance))
         elif cell_type == "$_DFF_P_":
             inputs = [[str(i) for i in cell["connections"]["C"]], [str(i) for i in cell["connections"]["D"]]]
             for i in range(len(outputs)):
@@ -206,14 +361,17 @@ def parse_json_module(name: str, json_module: Dict[str, Any], auto_balance: bool
                     ])   
 
     m.add(components)
+    if collapse_gates:
+        m.collapse_gates()
     if auto_balance:
         m.auto_balance()
     m.auto_place()
     return m
 
-def json_to_module(filepath: str, auto_balance: bool = False) -> Dict[str, Module]:
+def json_to_module(filepath: str, auto_balance: bool = False, collapse_gates: bool = False) -> Dict[str, Module]:
     """
-    Compiles json hdl to Module
+    Compiles json hdl to Module. With collapse_gates, the two input gate chains
+    from abc are merged into wide gates (see Module.collapse_gates)
     """
 
     compiled_modules: Dict[str, Module] = {}
@@ -224,7 +382,7 @@ def json_to_module(filepath: str, auto_balance: bool = False) -> Dict[str, Modul
     modules = jsonhdl["modules"]
 
     for module_name, module in modules.items():
-        compiled_modules[module_name] = parse_json_module(module_name, module, auto_balance)
+        compiled_modules[module_name] = parse_json_module(module_name, module, auto_balance, collapse_gates)
 
     return compiled_modules
 
@@ -241,37 +399,94 @@ def jsons_to_module(filepaths: List[str]) -> Dict[str, Module]:
         
     return compiled_modules
 
+def _pack_column(values: Any) -> str:
+    """Packs a column of ints as base64 of zlib compressed little endian int64"""
+    data = np.asarray(values, dtype="<i8").tobytes()
+    return base64.b64encode(zlib.compress(data)).decode()
+
+def _pack_names(names: List[str]) -> str:
+    return base64.b64encode(zlib.compress("\0".join(names).encode())).decode()
+
+def _write_literal(file: Any, name: str, packed: str, width: int = 96):
+    """Writes a long string literal, split in lines"""
+    file.write(f"{name} = (\n")
+    for i in range(0, len(packed), width):
+        file.write(f"    \"{packed[i:i + width]}\"\n")
+    file.write(")\n\n")
+
 def module_to_python(module: Module, savepath: str):
     """
-    Writes a circuitry python function from a module    
+    Writes a circuitry python function from a module
+
+    Blocks and wires are written as packed columns (names, block_id
+    indexes, positions, states and the block indexes of each wire), which
+    are decoded on import and rebuilt by a single loop.
     """
+    blocks = module.get_blocks()
+    wires = module.get_wires()
 
-    content = f"""from cm2.circuitry.core import *
-    
-def {module.name}(name: str, pos: Tuple[float, float, float] = (0, 0, 0)):
+    block_ids: Dict[str, int] = {}
+    name_indexes: Dict[str, int] = {}
+    for i, block in enumerate(blocks):
+        block_ids.setdefault(block.block_id, len(block_ids))
+        name_indexes.setdefault(block.name, i)
+    for wire in wires:
+        assert wire.src in name_indexes, f"Source component '{wire.src}' not found"
+        assert wire.dst in name_indexes, f"Destination component '{wire.dst}' not found"
+
+    properties = {block.name: block.properties for block in blocks if block.properties}
+
+    ports = {
+        "input": ("input" in module.ports) and ", ".join([repr(input) for input in module.get_port("input")]) or "",
+        "output": ("output" in module.ports) and ", ".join([repr(output) for output in module.get_port("output")]) or ""
+    }
+
+    with open(savepath, "w", buffering=1 << 20) as file:
+        file.write(
+            "from cm2.circuitry.core import *\n"
+            "import base64\n"
+            "import zlib\n"
+            "\n"
+            "def _unpack_column(packed: str) -> List[int]:\n"
+            "    return np.frombuffer(zlib.decompress(base64.b64decode(packed)), \"<i8\").tolist()\n"
+            "\n"
+            "def _unpack_names(packed: str) -> List[str]:\n"
+            "    return zlib.decompress(base64.b64decode(packed)).decode().split(\"\\0\")\n"
+            "\n"
+        )
+        file.write(f"_BLOCK_IDS = {tuple(block_ids)!r}\n\n")
+        file.write(f"_PROPERTIES = {properties!r}\n\n")
+        _write_literal(file, "_NAMES", _pack_names([block.name for block in blocks]))
+        _write_literal(file, "_TYPES", _pack_column([block_ids[block.block_id] for block in blocks]))
+        _write_literal(file, "_XS", _pack_column([int(block.pos.x) for block in blocks]))
+        _write_literal(file, "_YS", _pack_column([int(block.pos.y) for block in blocks]))
+        _write_literal(file, "_ZS", _pack_column([int(block.pos.z) for block in blocks]))
+        _write_literal(file, "_STATES", _pack_column([bool(block.state) for block in blocks]))
+        _write_literal(file, "_WIRES", _pack_column([
+            index for wire in wires for index in (name_indexes[wire.src], name_indexes[wire.dst])
+        ]))
+        file.write(f"""def {module.name}(name: str, pos: Tuple[float, float, float] = (0, 0, 0)):
     m = Module(name)
     m.set_ports({{
-        "input": [{("input" in module.ports) and ", ".join([str(input) for input in module.get_port("input")]) or ""}],
-        "output": [{("output" in module.ports) and ", ".join([str(output) for output in module.get_port("output")]) or ""}]
+        "input": [{ports["input"]}],
+        "output": [{ports["output"]}]
     }})
 
-    m.add([
-"""
-    for block in module.get_blocks():
-        content += f"        Block(\"{block.name}\", \"{block.block_id}\", {int(block.pos.x), int(block.pos.y), int(block.pos.z)}"
-        if block.state:
-            content += ", state=True"
-        if block.properties:
-            content += f", properties={block.properties}"
-            
-        content += "),\n"
-    for wire in module.get_wires():
-        content += f"        Wire(\"{wire.src}\", \"{wire.dst}\"),\n"
-    content += """    ])
+    names = _unpack_names(_NAMES)
+    block_ids = [_BLOCK_IDS[t] for t in _unpack_column(_TYPES)]
+    positions = zip(_unpack_column(_XS), _unpack_column(_YS), _unpack_column(_ZS))
+    states = [s == 1 for s in _unpack_column(_STATES)]
+    wires = _unpack_column(_WIRES)
+    m.add_bulk(
+        [
+            Block(n, t, p, s, list(_PROPERTIES[n]) if n in _PROPERTIES else None)
+            for n, t, p, s in zip(names, block_ids, positions, states)
+        ],
+        {{
+            f"{{names[src]}}->{{names[dst]}}": Wire(names[src], names[dst])
+            for src, dst in zip(wires[::2], wires[1::2])
+        }}
+    )
     m.move(pos)
     return m
-    """
-    
-    
-    with open(savepath, "w") as file:
-        file.write(content)
\ No newline at end of file
+""")
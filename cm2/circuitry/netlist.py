@@ -0,0 +1,310 @@
+"""cm2/circuitry/netlist.py
+
+Compact binary netlist format, to reload compiled Modules without going
+through the HDL compilation again.
+
+The file is an 8 byte preamble (magic, version, compression) followed by the
+payload: a little endian u32 with the length of a JSON header, the header and
+the typed arrays it describes, each aligned to 8 bytes. Uncompressed files
+are memory mapped, so the arrays are read straight from the page cache.
+"""
+
+from .core import *
+import json
+import mmap
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NETLIST_MAGIC = b"CM2NET"
+NETLIST_VERSION = 1
+
+Compression: TypeAlias = Literal["none", "zlib", "zstd"]
+COMPRESSION_CODES: Dict[str, int] = {"none": 0, "zlib": 1, "zstd": 2}
+
+# Array info fields stored as numbers, in this order
+INFO_FIELDS = (
+    "x_step", "y_step", "z_step",
+    "x_cycle", "y_cycle", "z_cycle",
+    "x_cluster", "y_cluster", "z_cluster",
+    "x_cluster_space", "y_cluster_space", "z_cluster_space"
+)
+
+# Block flags
+FLAG_ARRAY = 1
+FLAG_PROPERTIES = 2
+FLAG_INT_X = 4
+FLAG_INT_Y = 8
+FLAG_INT_Z = 16
+
+NO_KEY = 0xFFFFFFFF
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, (int, np.integer))
+
+def _plain(value: Any) -> Any:
+    """NumPy scalars as Python numbers, so they can go in the JSON header"""
+    return value.item() if isinstance(value, np.generic) else value
+
+def _number(value: float, is_int: bool) -> Union[int, float]:
+    return int(value) if is_int else float(value)
+
+class _StringTable:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def get(self, string: str) -> int:
+        index = self.ids.get(string)
+        if index is None:
+            assert "\0" not in string, f"Name '{string}' contains a NUL character"
+            index = len(self.strings)
+            self.ids[string] = index
+            self.strings.append(string)
+        return index
+
+def _encode_module(module: Module) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    table = _StringTable()
+    get = table.get
+
+    components = list(module.blocks.values())
+    n = len(components)
+    names = np.empty(n, np.uint32)
+    block_ids = np.empty(n, np.uint32)
+    states = np.empty(n, np.uint8)
+    flags = np.empty(n, np.uint8)
+    positions = np.empty((n, 3), np.float64)
+    widths = np.zeros(n, np.int64)
+    property_offsets = np.zeros(n + 1, np.uint32)
+    properties: List[int] = []
+    info_rows: List[List[float]] = []
+    info_int: List[int] = []
+    info_snap: List[bool] = []
+
+    for i, c in enumerate(components):
+        names[i] = get(c.name)
+        block_ids[i] = get(c.block_id)
+        states[i] = bool(c.state)
+        pos = c.pos
+        positions[i] = (pos.x, pos.y, pos.z)
+        flag = (
+            (FLAG_INT_X if _is_int(pos.x) else 0)
+            | (FLAG_INT_Y if _is_int(pos.y) else 0)
+            | (FLAG_INT_Z if _is_int(pos.z) else 0)
+        )
+        if c.properties is not None:
+            flag |= FLAG_PROPERTIES
+            properties.extend(get(p) for p in c.properties)
+        property_offsets[i + 1] = len(properties)
+        if isinstance(c, Array):
+            flag |= FLAG_ARRAY
+            widths[i] = -1 if c.width is None else c.width
+            info = c.info
+            info_rows.append([info[f] for f in INFO_FIELDS])
+            info_int.append(sum(1 << j for j, f in enumerate(INFO_FIELDS) if _is_int(info[f])))
+            info_snap.append(bool(info["snap_to_grid"]))
+        flags[i] = flag
+
+    wires = list(module.wires.items())
+    m = len(wires)
+    wire_src = np.empty(m, np.uint32)
+    wire_dst = np.empty(m, np.uint32)
+    wire_inverted = np.empty(m, np.uint8)
+    wire_keys = np.empty(m, np.uint32)
+    for i, (key, w) in enumerate(wires):
+        wire_src[i] = get(w.src)
+        wire_dst[i] = get(w.dst)
+        wire_inverted[i] = w.inverted
+        wire_keys[i] = NO_KEY if key == f"{w.src}->{w.dst}" else get(key)
+
+    buildings: List[Dict[str, Any]] = []
+    for key, b in module.buildings.items():
+        buildings.append({
+            "key": key,
+            "name": b.name,
+            "type": b.building_type,
+            "pos": [_plain(b.cframe.pos.x), _plain(b.cframe.pos.y), _plain(b.cframe.pos.z)],
+            "rot": [[_plain(v) for v in row] for row in b.cframe.rot],
+            "wires": [[[bw.building, bw.index, bw.port, bw.src] for bw in w] for w in b.wires],
+            "data": b.data
+        })
+
+    header: Dict[str, Any] = {
+        "name": module.name,
+        "size": module.size,
+        "ports": module.ports,
+        "links": module.links,
+        "buildings": buildings
+    }
+    arrays: Dict[str, np.ndarray] = {
+        "strings": np.frombuffer("\0".join(table.strings).encode(), np.uint8),
+        "names": names,
+        "block_ids": block_ids,
+        "states": states,
+        "flags": flags,
+        "positions": positions,
+        "widths": widths,
+        "property_offsets": property_offsets,
+        "properties": np.array(properties, np.uint32),
+        "info": np.array(info_rows, np.float64).reshape(-1, len(INFO_FIELDS)),
+        "info_int": np.array(info_int, np.uint16),
+        "info_snap": np.array(info_snap, np.uint8),
+        "wire_src": wire_src,
+        "wire_dst": wire_dst,
+        "wire_inverted": wire_inverted,
+        "wire_keys": wire_keys
+    }
+    return header, arrays
+
+def _pack(header: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> bytes:
+    table: List[Dict[str, Any]] = []
+    chunks: List[bytes] = []
+    offset = 0
+    for name, array in arrays.items():
+        data = np.ascontiguousarray(array).astype(array.dtype.newbyteorder("<"), copy=False).tobytes()
+        table.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+        padding = -len(data) % 8
+        chunks.append(data + b"\0" * padding)
+        offset += len(data) + padding
+
+    header = dict(header, arrays=table)
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    # Align the data section, counting the preamble and the length field
+    header_bytes += b" " * (-(8 + 4 + len(header_bytes)) % 8)
+    return len(header_bytes).to_bytes(4, "little") + header_bytes + b"".join(chunks)
+
+def _unpack(payload: Any) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    view = memoryview(payload)
+    header_size = int.from_bytes(view[:4], "little")
+    header = json.loads(bytes(view[4:4 + header_size]))
+    data_start = 4 + header_size
+    arrays: Dict[str, np.ndarray] = {}
+    for entry in header["arrays"]:
+        dtype = np.dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape)) if shape else 1
+        arrays[entry["name"]] = np.frombuffer(
+            payload, dtype, count, data_start + entry["offset"]
+        ).reshape(shape)
+    return header, arrays
+
+def _decode_module(header: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> Module:
+    strings = bytes(arrays["strings"]).decode().split("\0")
+
+    m = Module(header["name"])
+    m.size = header["size"]
+    m.ports = header["ports"]
+    m.links = header["links"]
+
+    names = [strings[i] for i in arrays["names"].tolist()]
+    block_ids = [strings[i] for i in arrays["block_ids"].tolist()]
+    states = arrays["states"].astype(bool).tolist()
+    flags = arrays["flags"]
+    positions = arrays["positions"]
+
+    # Coordinates come back as ints or floats, as they were saved
+    columns: List[List[Any]] = []
+    for axis, int_flag in enumerate((FLAG_INT_X, FLAG_INT_Y, FLAG_INT_Z)):
+        is_int = (flags & int_flag) != 0
+        if is_int.all():
+            columns.append(positions[:, axis].astype(np.int64).tolist())
+        elif not is_int.any():
+            columns.append(positions[:, axis].tolist())
+        else:
+            ints = positions[:, axis].astype(np.int64).tolist()
+            floats = positions[:, axis].tolist()
+            columns.append([i if b else f for i, f, b in zip(ints, floats, is_int.tolist())])
+    block_positions = list(zip(*columns))
+
+    block_properties: List[Optional[List[str]]] = [None] * len(names)
+    property_offsets = arrays["property_offsets"].tolist()
+    properties = [strings[i] for i in arrays["properties"].tolist()]
+    for i in np.flatnonzero(flags & FLAG_PROPERTIES).tolist():
+        block_properties[i] = properties[property_offsets[i]:property_offsets[i + 1]]
+
+    components: List[Union[Block, Array]] = list(map(Block, names, block_ids, block_positions, states, block_properties))
+
+    widths = arrays["widths"].tolist()
+    info_rows = arrays["info"].tolist()
+    info_int = arrays["info_int"].tolist()
+    info_snap = arrays["info_snap"].astype(bool).tolist()
+    for j, i in enumerate(np.flatnonzero(flags & FLAG_ARRAY).tolist()):
+        info = cast(ArrayInfo, {
+            f: _number(info_rows[j][k], bool(info_int[j] & (1 << k))) for k, f in enumerate(INFO_FIELDS)
+        })
+        info["snap_to_grid"] = info_snap[j]
+        components[i] = Array(
+            names[i], block_ids[i], block_positions[i], None if widths[i] < 0 else widths[i],
+            info, states[i], block_properties[i]
+        )
+
+    wire_src = [strings[i] for i in arrays["wire_src"].tolist()]
+    wire_dst = [strings[i] for i in arrays["wire_dst"].tolist()]
+    wire_inverted = arrays["wire_inverted"].astype(bool).tolist()
+    wire_keys = [
+        f"{src}->{dst}" if key == NO_KEY else strings[key]
+        for src, dst, key in zip(wire_src, wire_dst, arrays["wire_keys"].tolist())
+    ]
+    wires = dict(zip(wire_keys, map(Wire, wire_src, wire_dst, wire_inverted)))
+
+    m.add_bulk(components, wires)
+
+    for entry in header["buildings"]:
+        b = Building.__new__(Building)
+        b.__dict__.update(
+            name=entry["name"],
+            building_type=entry["type"],
+            cframe=CFrame(Vector3(*entry["pos"]), entry["rot"]),
+            wires=[[BuildingWire(*bw) for bw in w] for w in entry["wires"]],
+            data=entry.get("data")
+        )
+        m.buildings[entry["key"]] = b
+
+    return m
+
+def module_to_netlist(module: Module, savepath: str, compression: Compression = "zlib"):
+    """
+    Writes a module as a binary netlist. Use compression "none" to be able
+    to memory map the file on load.
+    """
+    assert compression in COMPRESSION_CODES, f"Compression '{compression}' not supported"
+    payload = _pack(*_encode_module(module))
+    if compression == "zlib":
+        payload = zlib.compress(payload, 6)
+    elif compression == "zstd":
+        assert zstandard is not None, "Compression 'zstd' requires the 'zstandard' package"
+        payload = zstandard.ZstdCompressor().compress(payload)
+
+    with open(savepath, "wb") as file:
+        file.write(NETLIST_MAGIC + bytes([NETLIST_VERSION, COMPRESSION_CODES[compression]]))
+        file.write(payload)
+
+def netlist_to_module(filepath: str) -> Module:
+    """
+    Loads a module from a binary netlist
+    """
+    with open(filepath, "rb") as file:
+        preamble = file.read(8)
+        assert preamble[:6] == NETLIST_MAGIC, f"'{filepath}' is not a netlist file"
+        assert preamble[6] == NETLIST_VERSION, f"Netlist version {preamble[6]} not supported"
+        compression = preamble[7]
+
+        if compression == COMPRESSION_CODES["none"]:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                payload = memoryview(mapped)[8:]
+                try:
+                    return _decode_module(*_unpack(payload))
+                finally:
+                    payload.release()
+
+        data = file.read()
+
+    if compression == COMPRESSION_CODES["zlib"]:
+        payload = zlib.decompress(data)
+    else:
+        assert zstandard is not None, "Compression 'zstd' requires the 'zstandard' package"
+        payload = zstandard.ZstdDecompressor().decompress(data)
+    return _decode_module(*_unpack(payload))
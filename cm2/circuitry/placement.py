@@ -0,0 +1,394 @@
+"""cm2/circuitry/placement.py
+
+Wirelength driven placement. Blocks are placed by quadratic placement (every
+wire pulls its blocks together like a spring), solved with conjugate gradients,
+then spread onto a grid by sorting, in the style of SimPL: each round anchors
+the blocks to their spread positions and solves again. Input ports go on the
+first row, output ports on the last one, and the grid can have several layers
+along y. Everything is vectorized with NumPy, so 100k blocks place in seconds.
+
+Arrays are not moved (other than array ports), they only pull on what they are
+wired to.
+
+floorplan lays whole modules out next to each other, before merging them into
+one build: their bounding boxes are packed in shelves, in the order and shelf
+width that simulated annealing finds best for area and wire length between them.
+"""
+
+from .core import *
+import random
+
+def _expanded_positions(module: Module) -> Tuple[Dict[str, int], np.ndarray]:
+    """Index and position of every expanded block"""
+    index: Dict[str, int] = {}
+    columns: List[Tuple[Any, Any, Any]] = []
+    for c in module.blocks.values():
+        if isinstance(c, Array):
+            for name in c.get_blocks():
+                index[name] = len(index)
+            xs, ys, zs = c.get_positions()
+            columns.extend(zip(xs.tolist(), ys.tolist(), zs.tolist()))
+        else:
+            index[c.name] = len(index)
+            columns.append((c.pos.x, c.pos.y, c.pos.z))
+    return index, np.array(columns, np.float64).reshape(-1, 3)
+
+def _wire_indexes(module: Module, index: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    src = np.fromiter((index[w.src] for w in module.wires.values()), np.int64, len(module.wires))
+    dst = np.fromiter((index[w.dst] for w in module.wires.values()), np.int64, len(module.wires))
+    return src, dst
+
+def _hpwl(pos: np.ndarray, src: np.ndarray, dst: np.ndarray) -> float:
+    """Sum of the half perimeters of the bounding boxes of every net (a source and its destinations)"""
+    if len(src) == 0:
+        return 0.0
+    order = np.argsort(src, kind="stable")
+    src, dst = src[order], dst[order]
+    starts = np.flatnonzero(np.r_[True, src[1:] != src[:-1]])
+    dst_pos = pos[dst]
+    src_pos = pos[src[starts]]
+    low = np.minimum(np.minimum.reduceat(dst_pos, starts), src_pos)
+    high = np.maximum(np.maximum.reduceat(dst_pos, starts), src_pos)
+    return float((high - low).sum())
+
+def wirelength(module: Module) -> float:
+    """Total half perimeter wirelength of a module, over every net"""
+    index, pos = _expanded_positions(module)
+    return _hpwl(pos, *_wire_indexes(module, index))
+
+def _extents(module: Module) -> Tuple[np.ndarray, np.ndarray]:
+    """Lowest and highest grid position taken by the blocks and buildings of a module"""
+    _, pos = _expanded_positions(module)
+    voxels = [v for b in module.buildings.values() for v in b.get_voxels()]
+    if voxels:
+        pos = np.concatenate([pos, np.array(voxels, np.float64)])
+    if len(pos) == 0:
+        return np.zeros(3), np.zeros(3)
+    pos = np.floor(pos + 0.5)
+    return pos.min(axis=0), pos.max(axis=0)
+
+def bounding_box(module: Module) -> Tuple[Vector3, Vector3]:
+    """Lowest and highest grid position taken by the blocks and buildings of a module"""
+    low, high = _extents(module)
+    return Vector3(*low.astype(np.int64).tolist()), Vector3(*high.astype(np.int64).tolist())
+
+def _place_ports(module: Module, port: str, z: float) -> int:
+    """Lays a port out on a row at z, like Module.auto_place. Returns the row length"""
+    if port not in module.ports:
+        return 0
+    i = 0
+    for item in module.ports[port]:
+        j = 0
+        # hdl.py:parse_json_module generates reversed port blocks
+        for p in (cast(List[str], item[::-1]) if isinstance(item, list) else [item]):
+            component = module.get_block(p)
+            assert component, f"Block '{p}' from {port} port doesn't exist"
+            component.set_pos((i + j, 0, z))
+            j += cast(int, component.width) if isinstance(component, Array) else 1
+        i += j + (1 if isinstance(item, list) else 0)
+    return i
+
+def _port_side(module: Module, port: str) -> int:
+    """Row length of a port, without moving it"""
+    if port not in module.ports:
+        return 0
+    length = 0
+    for item in module.ports[port]:
+        for p in (item if isinstance(item, list) else [item]):
+            component = module.get_block(p)
+            length += cast(int, component.width) if isinstance(component, Array) else 1
+        length += 1 if isinstance(item, list) else 0
+    return length
+
+LEGALIZE_REGION_SIZE = 64 # Regions up to this many slots per layer are filled by sorting
+
+def _fill(pos: np.ndarray, x0: int, width: int, z0: int, layers: int) -> np.ndarray:
+    """
+    Puts blocks on the slots of a region by sorting: rows by z (highest first),
+    then columns by x within a row and layers by y within a column
+    """
+    n = len(pos)
+    row_size = width * layers
+    row = np.empty(n, np.int64)
+    row[np.argsort(-pos[:, 2], kind="stable")] = np.arange(n) // row_size
+    rank = np.empty(n, np.int64)
+    rank[np.lexsort((pos[:, 0], row))] = np.arange(n) % row_size
+    column = rank // layers
+    layer = np.empty(n, np.int64)
+    layer[np.lexsort((pos[:, 1], column, row))] = np.arange(n) % layers
+    return np.stack([x0 + column, layer, -1 - z0 - row], axis=1)
+
+def _legalize(pos: np.ndarray, width: int, layers: int, rows: int) -> np.ndarray:
+    """
+    Spreads positions onto a grid of width columns, layers along y and rows along
+    -z, by recursive bisection: a region is cut in half across its longer side and
+    its blocks split at the matching quantile of their coordinate along that side,
+    so blocks keep their relative order in both directions
+    """
+    legal = np.empty_like(pos)
+    stack = [(np.arange(len(pos)), 0, width, 0, rows)]
+    while stack:
+        idx, x0, x1, z0, z1 = stack.pop()
+        if len(idx) == 0:
+            continue
+        if (x1 - x0) * (z1 - z0) <= LEGALIZE_REGION_SIZE:
+            legal[idx] = _fill(pos[idx], x0, x1 - x0, z0, layers)
+            continue
+        # Each side gets its share of the blocks, within the slots it has
+        if x1 - x0 >= z1 - z0:
+            cut = (x0 + x1) // 2
+            low, high = (cut - x0) * (z1 - z0), (x1 - cut) * (z1 - z0)
+            order = idx[np.argsort(pos[idx, 0], kind="stable")]
+            regions = ((x0, cut, z0, z1), (cut, x1, z0, z1))
+        else:
+            cut = (z0 + z1) // 2
+            low, high = (cut - z0) * (x1 - x0), (z1 - cut) * (x1 - x0)
+            order = idx[np.argsort(-pos[idx, 2], kind="stable")] # Rows go down
+            regions = ((x0, x1, z0, cut), (x0, x1, cut, z1))
+        count = round(len(idx) * low / (low + high))
+        count = max(min(count, low * layers), len(idx) - high * layers)
+        stack.append((order[:count], *regions[0]))
+        stack.append((order[count:], *regions[1]))
+    return legal
+
+def _conjugate_gradient(
+    diagonal: np.ndarray, i: np.ndarray, j: np.ndarray, w: np.ndarray,
+    b: np.ndarray, x: np.ndarray, iterations: int
+) -> np.ndarray:
+    """
+    Solves (diag(diagonal) - W) x = b, where W has weight w at (i, j) and (j, i),
+    one column at a time, with a Jacobi preconditioner
+    """
+    n = len(diagonal)
+
+    def multiply(v: np.ndarray) -> np.ndarray:
+        return diagonal * v - np.bincount(i, w * v[j], n) - np.bincount(j, w * v[i], n)
+
+    solution = np.empty_like(x)
+    for axis in range(x.shape[1]):
+        v = x[:, axis].copy()
+        r = b[:, axis] - multiply(v)
+        z = r / diagonal
+        p = z.copy()
+        rz = r @ z
+        for _ in range(iterations):
+            if rz <= 1e-12 * n:
+                break
+            q = multiply(p)
+            alpha = rz / (p @ q)
+            v += alpha * p
+            r -= alpha * q
+            z = r / diagonal
+            rz, rz_old = r @ z, rz
+            p = z + (rz / rz_old) * p
+        solution[:, axis] = v
+    return solution
+
+def place(module: Module, layers: int = 1, rounds: int = 8, iterations: int = 100):
+    """
+    Places the blocks of a module to keep wires short, on a grid with input ports
+    on the first row (z = 0), output ports on the last one and layers rows along y
+    """
+    assert layers >= 1, "Placement needs at least 1 layer"
+    inputs = set(flatten_recursive(module.ports.get("input", [])))
+    outputs = set(flatten_recursive(module.ports.get("output", [])))
+    movable_names = [
+        c.name for k, c in module.blocks.items()
+        if isinstance(c, Block) and k not in inputs and k not in outputs
+    ]
+    n = len(movable_names)
+    if n == 0:
+        _place_ports(module, "input", 0)
+        _place_ports(module, "output", -1)
+        return
+
+    port_side = max(_port_side(module, "input"), _port_side(module, "output"))
+    width = max(math.ceil(math.sqrt(n / layers)), port_side - 1, 1)
+    rows = math.ceil(n / (width * layers))
+    _place_ports(module, "input", 0)
+    _place_ports(module, "output", -(rows + 1))
+
+    index, fixed_pos = _expanded_positions(module)
+    src, dst = _wire_indexes(module, index)
+
+    # Movable blocks come first in the solve, fixed ones only add to the right side
+    movable = np.fromiter((index[name] for name in movable_names), np.int64, n)
+    solve_index = np.full(len(index), -1, np.int64)
+    solve_index[movable] = np.arange(n)
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    fanout = np.bincount(src, minlength=len(index))
+    weight = 2.0 / (fanout[src] + 1) # A source driving many blocks pulls each one less
+
+    a, b = solve_index[src], solve_index[dst]
+    both = (a >= 0) & (b >= 0)
+    edge_i, edge_j, edge_w = a[both], b[both], weight[both]
+    # Empty weights would make int64 counts, that the fixed wires can't be added to
+    degree = (np.bincount(edge_i, edge_w, n) + np.bincount(edge_j, edge_w, n)).astype(np.float64)
+    rhs = np.zeros((n, 3))
+    for movable_end, fixed_end, mask in ((a, dst, (a >= 0) & (b < 0)), (b, src, (a < 0) & (b >= 0))):
+        degree += np.bincount(movable_end[mask], weight[mask], n)
+        for axis in range(3):
+            rhs[:, axis] += np.bincount(movable_end[mask], weight[mask] * fixed_pos[fixed_end[mask], axis], n)
+
+    # Weak pull to the middle of the grid, so blocks without wires have a place too
+    center = np.array([(width - 1) / 2, (layers - 1) / 2, -(rows + 1) / 2])
+    anchors = np.tile(center, (n, 1))
+    anchor_weight = 1e-3
+    pos = np.tile(center, (n, 1))
+    all_pos = fixed_pos.copy()
+    best, best_length = anchors, math.inf
+    for r in range(rounds + 1):
+        diagonal = degree + anchor_weight
+        pos = _conjugate_gradient(diagonal, edge_i, edge_j, edge_w, rhs + anchor_weight * anchors, pos, iterations)
+        anchors = _legalize(pos, width, layers, rows)
+        all_pos[movable] = anchors
+        length = _hpwl(all_pos, src, dst)
+        if length < best_length:
+            best, best_length = anchors, length
+        anchor_weight = 0.05 * 2 ** r
+
+    for name, (x, y, z) in zip(movable_names, best.astype(np.int64).tolist()):
+        module.blocks[name].set_pos((x, y, z))
+
+def _pack(order: List[int], sizes: List[Tuple[int, int]], width: int, spacing: int) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Shelf packing: modules go along x until width, then a new shelf starts
+    below (along -z). Returns the x and top z of every module, and the area
+    """
+    corners: List[Tuple[int, int]] = [(0, 0)] * len(sizes)
+    x = top = depth = used = 0
+    for i in order:
+        w, d = sizes[i]
+        if x > 0 and x + w > width:
+            top -= depth + spacing
+            x = depth = 0
+        corners[i] = (x, top)
+        used = max(used, x + w)
+        x += w + spacing
+        depth = max(depth, d)
+    return corners, used * (depth - top)
+
+def floorplan(
+    modules: List[Module],
+    wires: Optional[List[Wire]] = None,
+    origin: Tuple[float, float, float] = (0, 0, 0),
+    spacing: int = 1,
+    wirelength_weight: float = 1.0,
+    iterations: int = 5000,
+    seed: int = 0
+) -> Dict[str, Vector3]:
+    """
+    Moves modules so their bounding boxes don't overlap, packed in shelves from
+    origin toward +x and -z, keeping the wires between them short. Wire ends are
+    named like after merging, e.g. Wire("adder.sum.0", "mux.a.3"). The order and
+    shelf width come from simulated annealing over area + wirelength_weight *
+    wire length, both relative to the starting layout. Returns the offset of
+    each module, by name.
+    """
+    assert spacing >= 0, "Spacing can't be negative"
+    by_name = {m.name: i for i, m in enumerate(modules)}
+    assert len(by_name) == len(modules), "Modules must have unique names"
+    n = len(modules)
+    if n == 0:
+        return {}
+
+    extents = [_extents(m) for m in modules]
+    sizes = [(int(high[0] - low[0]) + 1, int(high[2] - low[2]) + 1) for low, high in extents]
+
+    # Wire ends as (module, position from the lowest x, lowest y and highest z)
+    ends: List[Tuple[int, float, float, float]] = []
+    for w in wires or []:
+        for end in (w.src, w.dst):
+            module_name, _, block = end.partition(".")
+            assert module_name in by_name, f"Wire end '{end}' isn't in any of the modules"
+            i = by_name[module_name]
+            module = modules[i]
+            component = module.get_block(block)
+            if component is None: # Expanded array block
+                array, _, k = block.rpartition(".")
+                component = module.get_block(array)
+                assert isinstance(component, Array) and k.isdigit(), f"Block '{end}' doesn't exist"
+                xs, ys, zs = component.get_positions()
+                pos = (xs[int(k)], ys[int(k)], zs[int(k)])
+            else:
+                pos = (component.pos.x, component.pos.y, component.pos.z)
+            low, high = extents[i]
+            ends.append((i, pos[0] - low[0], pos[1] - low[1], pos[2] - high[2]))
+    end_module = np.array([e[0] for e in ends], np.int64)
+    end_offset = np.array([e[1:] for e in ends], np.float64).reshape(-1, 3)
+
+    def wire_length(corners: List[Tuple[int, int]]) -> float:
+        if len(ends) == 0:
+            return 0.0
+        corner = np.array(corners, np.float64)[end_module]
+        pos = end_offset.copy()
+        pos[:, 0] += corner[:, 0]
+        pos[:, 2] += corner[:, 1]
+        return float(np.abs(pos[0::2] - pos[1::2]).sum())
+
+    # Start from a breadth first order over the wires, so connected modules start close
+    neighbours: List[Dict[int, int]] = [{} for _ in range(n)]
+    for a, b in zip(end_module[0::2].tolist(), end_module[1::2].tolist()):
+        if a != b:
+            neighbours[a][b] = neighbours[a].get(b, 0) + 1
+            neighbours[b][a] = neighbours[b].get(a, 0) + 1
+    order: List[int] = []
+    seen = [False] * n
+    for root in sorted(range(n), key=lambda i: -sum(neighbours[i].values())):
+        if seen[root]:
+            continue
+        seen[root] = True
+        queue = [root]
+        while queue:
+            i = queue.pop(0)
+            order.append(i)
+            for j in sorted(neighbours[i], key=lambda j: -neighbours[i][j]):
+                if not seen[j]:
+                    seen[j] = True
+                    queue.append(j)
+
+    widest = max(w for w, _ in sizes)
+    width = max(widest, math.ceil(math.sqrt(sum((w + spacing) * (d + spacing) for w, d in sizes))))
+    corners, area = _pack(order, sizes, width, spacing)
+    area_scale, length_scale = max(area, 1), max(wire_length(corners), 1.0)
+
+    def cost(corners: List[Tuple[int, int]], area: int) -> float:
+        return area / area_scale + wirelength_weight * wire_length(corners) / length_scale
+
+    rng = random.Random(seed)
+    window = max(2, n // 10)
+    current = cost(corners, area)
+    best, best_corners = current, corners
+    temperature, cooling = 0.05, (1e-4 / 0.05) ** (1 / max(iterations, 1))
+    for _ in range(iterations if n > 1 else 0):
+        new_order, new_width = order[:], width
+        move = rng.random()
+        i = rng.randrange(n)
+        j = min(max(i + rng.randint(-window, window), 0), n - 1) # Mostly local moves, that keep neighbours close
+        if move < 0.4:
+            new_order[i], new_order[j] = new_order[j], new_order[i]
+        elif move < 0.8:
+            new_order.insert(j, new_order.pop(i))
+        else:
+            new_width = max(widest, round(width * rng.uniform(0.8, 1.25)))
+        new_corners, new_area = _pack(new_order, sizes, new_width, spacing)
+        new_cost = cost(new_corners, new_area)
+        if new_cost <= current or rng.random() < math.exp((current - new_cost) / temperature):
+            current, order, width = new_cost, new_order, new_width
+            if current < best:
+                best, best_corners = current, new_corners
+        temperature *= cooling
+
+    offsets: Dict[str, Vector3] = {}
+    for module, (low, high), (x, top) in zip(modules, extents, best_corners):
+        offset = Vector3(
+            origin[0] + x - float(low[0]),
+            origin[1] - float(low[1]),
+            origin[2] + top - float(high[2])
+        )
+        module.move((offset.x, offset.y, offset.z))
+        for building in module.buildings.values():
+            building.cframe = CFrame(building.cframe.pos + offset, building.cframe.rot)
+        offsets[module.name] = offset
+    return offsets
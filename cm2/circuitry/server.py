@@ -0,0 +1,146 @@
+"""cm2/circuitry/server.py
+
+Compile daemon: compiles Yosys JSON netlists to savestrings for clients
+connecting over a Unix socket (see cm2/circuitry/client.py), so NumPy and
+the compiler are imported once, and netlists and the save caches of their
+modules stay warm between builds. Requests and responses are one JSON
+object per line. The daemon exits when idle for a while, or when the cm2
+sources change so the next build gets a fresh one.
+
+Usage: python -m cm2.circuitry.server [--socket PATH] [--idle 900]
+"""
+
+from .core import *
+from .client import default_socket_path, request
+from .hdl import json_to_module
+import argparse
+import json
+import os
+import socketserver
+import sys
+import time
+
+SERVER_IDLE_SECONDS = 900 # Idle time before the daemon exits
+
+class CompileResult(TypedDict, total=False):
+    ok: bool
+    error: str
+    blocks: int
+    wires: int
+    cached: bool # The netlist was already parsed
+    seconds: float
+
+def get_source_stamp() -> Tuple[Tuple[str, int], ...]:
+    """Modification times of the cm2 sources this process runs"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    stamp: List[Tuple[str, int]] = []
+    for directory, _, files in os.walk(root):
+        for file in files:
+            if file.endswith(".py"):
+                path = os.path.join(directory, file)
+                stamp.append((path, os.stat(path).st_mtime_ns))
+    return tuple(sorted(stamp))
+
+class CompileCache:
+    """Modules of the netlists compiled so far, until their files change"""
+
+    def __init__(self):
+        self.netlists: Dict[str, Tuple[Tuple[int, int], Dict[str, Module]]] = {}
+
+    def compile(self, json_file: str, top: str, output: str) -> CompileResult:
+        start = time.perf_counter()
+        assert os.path.exists(json_file), f"Json file '{json_file}' doesn't exists"
+        stat = os.stat(json_file)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self.netlists.get(json_file)
+        hit = cached is not None and cached[0] == key
+        if not hit:
+            cached = (key, json_to_module(json_file))
+            self.netlists[json_file] = cached
+        modules = cast(Tuple[Tuple[int, int], Dict[str, Module]], cached)[1]
+        assert top in modules, f"The parsed json file does not contain module '{top}'"
+
+        # The module keeps its encoded fragments, so saving an unchanged netlist again is cheap
+        module = modules[top]
+        module.save(output)
+        return {
+            "ok": True,
+            "blocks": len(module.get_block_indexes()),
+            "wires": len(module.wires),
+            "cached": hit,
+            "seconds": time.perf_counter() - start
+        }
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = cast(CompileServer, self.server)
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+            response = server.respond(request)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write((json.dumps(response) + "\n").encode())
+
+class CompileServer(socketserver.UnixStreamServer):
+    """
+    Serves one request at a time: {"command": "compile", "json": path, "top":
+    name, "output": path} with absolute paths, {"command": "ping"} or
+    {"command": "stop"}
+    """
+
+    def __init__(self, path: str, idle: float = SERVER_IDLE_SECONDS):
+        self.path = path
+        self.cache = CompileCache()
+        self.stamp = get_source_stamp()
+        self.running = True
+        self.timeout = idle
+        mask = os.umask(0o077) # Only this user may connect
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(mask)
+
+    def respond(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        command = request.get("command")
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if command == "stop":
+            self.running = False
+            return {"ok": True}
+        assert command == "compile", f"Unknown command '{command}'"
+        if get_source_stamp() != self.stamp:
+            self.running = False
+            return {"ok": False, "stale": True, "error": "The cm2 sources changed, the server is restarting"}
+        return cast(Dict[str, Any], self.cache.compile(request["json"], request["top"], request["output"]))
+
+    def handle_timeout(self):
+        self.running = False
+
+    def serve(self):
+        try:
+            while self.running:
+                self.handle_request()
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Keeps the compiler loaded to turn netlists into savestrings")
+    parser.add_argument("--socket", default=None, help="socket path (default: per user, in the temp directory)")
+    parser.add_argument("--idle", type=float, default=SERVER_IDLE_SECONDS, help=f"seconds idle before exiting (default: {SERVER_IDLE_SECONDS})")
+    args = parser.parse_args()
+
+    path = args.socket or default_socket_path()
+    if os.path.exists(path):
+        try:
+            request(path, {"command": "ping"})
+            print(f"A compile server is already running on '{path}'", file=sys.stderr)
+            return
+        except OSError:
+            os.unlink(path) # Left by a server that didn't exit cleanly
+    CompileServer(path, args.idle).serve()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""cm2/circuitry/timing.py
+
+Static timing analysis: arrival times and the top K critical paths from the
+input ports to the output ports of a Module, in ticks, using the same delay
+model as Module.get_arrival_times (nodes take 0 ticks, delays their property
+and every other block 1 tick).
+
+Usage: python -m cm2.circuitry.timing <json_file> <entry_module> | <netlist_file> [-k 10] [--depth 1] [--json]
+"""
+
+from .core import *
+import argparse
+import heapq
+import json
+import sys
+
+class TimingHop(TypedDict):
+    name: str
+    block_id: str
+    prefix: str
+    delay: int # Ticks this hop adds to the path
+    arrival: int # Worst arrival time of the block
+
+class TimingGroup(TypedDict):
+    prefix: str
+    delay: int
+    hops: int
+
+class TimingPath(TypedDict):
+    delay: int
+    start: str
+    end: str
+    hops: List[TimingHop]
+    groups: List[TimingGroup]
+
+def get_prefix(name: str, depth: Optional[int] = None) -> str:
+    """Hierarchical module prefix of a component name, down to depth levels"""
+    names = name.split(".")
+    while len(names) > 1 and names[-1].isdigit(): # Array indexes
+        names.pop()
+    parts: List[str] = []
+    for part in names[:-1]:
+        if part.startswith("$"): # Yosys generated names have dots of their own
+            break
+        parts.append(part)
+    if depth is not None:
+        parts = parts[:depth]
+    return ".".join(parts)
+
+class TimingGraph:
+    """Expanded block graph of a Module with the worst arrival time of every block"""
+
+    def __init__(self, module: Module, depth: Optional[int] = None):
+        assert "input" in module.ports, "Module doesn't have input port defined"
+        assert "output" in module.ports, "Module doesn't have output port defined"
+
+        self.blocks: Dict[str, Block] = {}
+        self.prefixes: Dict[str, str] = {}
+        for k, c in module.blocks.items():
+            prefix = get_prefix(k, depth)
+            if isinstance(c, Array):
+                for j, b in c.get_blocks().items():
+                    self.blocks[j] = b
+                    self.prefixes[j] = prefix
+            else:
+                self.blocks[k] = c
+                self.prefixes[k] = prefix
+
+        self.inputs: Dict[str, List[str]] = {name: [] for name in self.blocks}
+        for w in module.wires.values():
+            assert w.src in self.blocks, f"Block '{w.src}' from wire '{w.src}->{w.dst}' doesn't exist"
+            assert w.dst in self.blocks, f"Block '{w.dst}' from wire '{w.src}->{w.dst}' doesn't exist"
+            self.inputs[w.dst].append(w.src)
+        for name, inputs in self.inputs.items():
+            self.inputs[name] = list(dict.fromkeys(inputs))
+
+        self.input_ports = self._port_blocks(module, "input")
+        self.output_ports = self._port_blocks(module, "output")
+        self.delays: Dict[str, int] = {name: block_delay(b) for name, b in self.blocks.items()}
+        self.arrival_times, self.back_edges = self._get_arrival_times()
+
+    @staticmethod
+    def _port_blocks(module: Module, port: str) -> List[str]:
+        names: List[str] = []
+        for p in flatten_recursive(module.get_port(port)):
+            expanded = module.get_blocks_expanded(p)
+            if expanded:
+                names.extend(b.name for b in expanded)
+        return list(dict.fromkeys(names))
+
+    def _get_arrival_times(self) -> Tuple[Dict[str, int], set[Tuple[str, str]]]:
+        """
+        Iterative version of Module.get_arrival_times, so deep netlists don't
+        hit the recursion limit. Wires closing a loop count as arriving at 0.
+        """
+        arrival_times: Dict[str, int] = {}
+        back_edges: set[Tuple[str, str]] = set()
+        visiting: set[str] = set()
+
+        for root in self.blocks:
+            if root in arrival_times:
+                continue
+            stack: List[Tuple[str, int]] = [(root, 0)]
+            visiting.add(root)
+            while stack:
+                name, i = stack[-1]
+                inputs = self.inputs[name]
+                if i < len(inputs):
+                    stack[-1] = (name, i + 1)
+                    src = inputs[i]
+                    if src in visiting:
+                        back_edges.add((src, name))
+                    elif src not in arrival_times:
+                        visiting.add(src)
+                        stack.append((src, 0))
+                    continue
+
+                stack.pop()
+                visiting.discard(name)
+                if len(inputs) == 0:
+                    arrival_times[name] = 0
+                else:
+                    arrival_times[name] = max(
+                        0 if (src, name) in back_edges else arrival_times[src] for src in inputs
+                    ) + self.delays[name]
+        return arrival_times, back_edges
+
+    def _make_hop(self, name: str, delay: int) -> TimingHop:
+        return {
+            "name": name,
+            "block_id": self.blocks[name].block_id,
+            "prefix": self.prefixes[name],
+            "delay": delay,
+            "arrival": self.arrival_times[name]
+        }
+
+    def critical_paths(self, k: int = 10) -> List[TimingPath]:
+        """
+        The k slowest paths ending at an output port, slowest first. Paths start
+        at blocks without inputs (usually the input ports) or where a loop was cut.
+        """
+        # Best first search from the outputs back to the inputs. The arrival time is
+        # the exact length of the slowest way back, so paths complete in order.
+        heap: List[Tuple[int, int, str, int, bool, Any]] = []
+        counter = 0
+        for name in self.output_ports:
+            heap.append((-self.arrival_times[name], counter, name, 0, False, None))
+            counter += 1
+        heapq.heapify(heap)
+
+        paths: List[TimingPath] = []
+        while heap and len(paths) < k:
+            bound, _, name, tail, cut, after = heapq.heappop(heap)
+            inputs = self.inputs[name]
+            if cut or len(inputs) == 0:
+                paths.append(self._make_path(name, after, -bound))
+                continue
+            state = (name, after)
+            for src in inputs:
+                delay = tail + self.delays[name]
+                if (src, name) in self.back_edges:
+                    heapq.heappush(heap, (-delay, counter, src, delay, True, state))
+                else:
+                    heapq.heappush(heap, (-(self.arrival_times[src] + delay), counter, src, delay, False, state))
+                counter += 1
+        return paths
+
+    def _make_path(self, start: str, after: Any, delay: int) -> TimingPath:
+        hops = [self._make_hop(start, 0)]
+        while after is not None:
+            name, after = after
+            hops.append(self._make_hop(name, self.delays[name]))
+
+        groups: List[TimingGroup] = []
+        for hop in hops:
+            if groups and groups[-1]["prefix"] == hop["prefix"]:
+                groups[-1]["delay"] += hop["delay"]
+                groups[-1]["hops"] += 1
+            else:
+                groups.append({"prefix": hop["prefix"], "delay": hop["delay"], "hops": 1})
+
+        return {"delay": delay, "start": start, "end": hops[-1]["name"], "hops": hops, "groups": groups}
+
+def critical_paths(module: Module, k: int = 10, depth: Optional[int] = None) -> List[TimingPath]:
+    """
+    The k slowest input to output paths of a module, with the delay of every
+    hop, grouped by hierarchical prefix (cut to depth levels, if given)
+    """
+    return TimingGraph(module, depth).critical_paths(k)
+
+def timing_report(module: Module, k: int = 10, depth: Optional[int] = None) -> str:
+    """Human readable report of the k slowest paths of a module"""
+    paths = critical_paths(module, k, depth)
+    lines = [f"Module '{module.name}': {len(paths)} critical path(s)"]
+
+    totals: Dict[str, int] = {}
+    for path in paths:
+        for group in path["groups"]:
+            totals[group["prefix"]] = totals.get(group["prefix"], 0) + group["delay"]
+    if totals:
+        lines.append("")
+        lines.append("Ticks per prefix, over all paths:")
+        for prefix, delay in sorted(totals.items(), key=lambda item: -item[1]):
+            lines.append(f"  {delay:6}  {prefix or '<top>'}")
+
+    for i, path in enumerate(paths):
+        lines.append("")
+        lines.append(f"Path {i + 1}: {path['delay']} ticks, {path['start']} -> {path['end']}")
+        for group in path["groups"]:
+            lines.append(f"  [{group['prefix'] or '<top>'}] {group['delay']} ticks, {group['hops']} hop(s)")
+        for hop in path["hops"]:
+            lines.append(f"    {hop['arrival']:6}  +{hop['delay']:<4} {hop['block_id']:<6} {hop['name']}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Lists the critical paths of a compiled module")
+    parser.add_argument("file", help="Yosys JSON netlist, or binary netlist from module_to_netlist")
+    parser.add_argument("entry_module", nargs="?", help="top module, when loading a Yosys JSON netlist")
+    parser.add_argument("-k", type=int, default=10, help="number of paths (default: 10)")
+    parser.add_argument("--depth", type=int, default=None, help="hierarchy levels to group hops by")
+    parser.add_argument("--json", action="store_true", help="print the paths as JSON")
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as file:
+        is_netlist = file.read(6) == b"CM2NET"
+    if is_netlist:
+        from .netlist import netlist_to_module
+        module = netlist_to_module(args.file)
+    else:
+        from .hdl import json_to_module
+        if args.entry_module is None:
+            parser.error("entry_module is required for Yosys JSON netlists")
+        module = json_to_module(args.file)[args.entry_module]
+
+    if args.json:
+        json.dump(critical_paths(module, args.k, args.depth), sys.stdout, indent=2)
+        print()
+    else:
+        print(timing_report(module, args.k, args.depth))
+
+if __name__ == "__main__":
+    main()
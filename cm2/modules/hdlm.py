@@ -4,6 +4,7 @@ Extended modules, used primarly by 'cm2/circuitry/hdl.py'
 """
 
 from cm2.circuitry.builder import *
+from typing import Callable
 
 def DLatchP(name: str, pos: Tuple[float, float, float] = (0, 0, 0)):
     m = Module(name)
@@ -72,4 +73,143 @@ def DFFP(name: str, pos: Tuple[float, float, float] = (0, 0, 0)):
 
     m.auto_place()
     m.move(pos)
-    return m
\ No newline at end of file
+    return m
+
+HUGE_MEMORY_ADDRESS_BITS = 16
+HUGE_MEMORY_WORD_BITS = 16
+
+def HugeMemory(
+    name: str,
+    address: List[Optional[str]],
+    value: List[Optional[str]],
+    write: Optional[str],
+    output: List[Optional[str]],
+    pos: Tuple[float, float, float] = (0, 0, 0),
+    data: Optional[str] = None
+) -> List[Any]:
+    """
+    HugeMemory building wired to the given blocks, least significant bit first.
+    None leaves a pin unconnected. data is a binary file of little endian 16 bit
+    words to preload the memory with, kept with the module (netlists, fingerprints)
+    but not written to savestrings yet.
+    """
+    assert len(address) <= HUGE_MEMORY_ADDRESS_BITS, f"HugeMemory '{name}' takes at most {HUGE_MEMORY_ADDRESS_BITS} address bits"
+    assert len(value) <= HUGE_MEMORY_WORD_BITS, f"HugeMemory '{name}' takes at most {HUGE_MEMORY_WORD_BITS} value bits"
+    assert len(output) <= HUGE_MEMORY_WORD_BITS, f"HugeMemory '{name}' has at most {HUGE_MEMORY_WORD_BITS} output bits"
+
+    indexes = cast(Dict[str, int], BuildingData.HUGE_MEMORY.value["indexes"])
+    components: List[Any] = [Building(name, "huge_memory", pos, data=data)]
+    for pin, port, blocks in (
+        ("address", "in", address),
+        ("value", "in", value),
+        ("write", "in", [write]),
+        ("output", "out", output)
+    ):
+        for i, block in enumerate(blocks):
+            if block is not None:
+                components.append(BuildingWire(name, indexes[pin] + i, port, block))
+    return components
+
+def Mux2(name: str, output: str, a: str, b: str, s: str) -> List[Any]:
+    """output = b if s else a, with output as a node"""
+    return [
+        Nor(f"{name}.~S", inputs=[s]),
+        And(f"{name}.A", inputs=[a, f"{name}.~S"]),
+        And(f"{name}.B", inputs=[b, s]),
+        Node(output, inputs=[f"{name}.A", f"{name}.B"])
+    ]
+
+def AndNot(name: str, output: str, a: str, b: str) -> List[Any]:
+    """output = a and not b"""
+    return [
+        Nor(f"{name}.~B", inputs=[b]),
+        And(output, inputs=[a, f"{name}.~B"])
+    ]
+
+def OrNot(name: str, output: str, a: str, b: str) -> List[Any]:
+    """output = a or not b"""
+    return [
+        Nor(f"{name}.~B", inputs=[b]),
+        Or(output, inputs=[a, f"{name}.~B"])
+    ]
+
+def DFlipflop(
+    name: str,
+    output: str,
+    d: str,
+    clock: str,
+    clock_positive: bool = True,
+    enable: Optional[str] = None,
+    enable_positive: bool = True,
+    sync_reset: Optional[str] = None,
+    sync_reset_positive: bool = True,
+    sync_reset_value: bool = False,
+    sync_reset_over_enable: bool = True,
+    async_set: Optional[str] = None,
+    async_set_positive: bool = True,
+    async_reset: Optional[str] = None,
+    async_reset_positive: bool = True
+) -> List[Any]:
+    """
+    D register with optional enable, synchronous reset and asynchronous set/reset,
+    with output as a node. Level sensitive on the clock like DFFP. The load and hold
+    gates see the same controls, and data is delayed to reach the latch no earlier
+    than them, so it holds when data and clock change on the same tick.
+    """
+    components: List[Any] = []
+    depths: Dict[str, int] = {} # Ticks from the inputs, for generated signals
+
+    def invert(signal: str, pin: str) -> str:
+        inverted = f"{name}.~{pin}"
+        if not inverted in depths:
+            components.append(Nor(inverted, inputs=[signal]))
+            depths[inverted] = 1
+        return inverted
+
+    def active(signal: str, positive: bool, pin: str) -> str:
+        """Signal that is on when the pin is asserted"""
+        return signal if positive else invert(signal, pin)
+
+    def inactive(signal: str, positive: bool, pin: str) -> str:
+        """Signal that is on when the pin is not asserted"""
+        return invert(signal, pin) if positive else signal
+
+    def gate(make_gate: Callable[..., List[Any]], gate_name: str, inputs: List[str]) -> str:
+        components.append(make_gate(gate_name, inputs=inputs))
+        depths[gate_name] = max(depths.get(i, 0) for i in inputs) + 1
+        return gate_name
+
+    load = [active(clock, clock_positive, "C")]
+    if enable is not None:
+        e = active(enable, enable_positive, "E")
+        if sync_reset is not None and sync_reset_over_enable:
+            load.append(gate(Or, f"{name}.load", [e, active(sync_reset, sync_reset_positive, "R")]))
+        else:
+            load.append(e)
+    en = gate(And, f"{name}.en", load)
+    hold = gate(Nand, f"{name}.hold", load)
+
+    if sync_reset is None:
+        data = gate(Or, f"{name}.D", [d])
+    elif sync_reset_value:
+        data = gate(Or, f"{name}.D", [d, active(sync_reset, sync_reset_positive, "R")])
+    else:
+        data = gate(And, f"{name}.D", [d, inactive(sync_reset, sync_reset_positive, "R")])
+    if depths[data] < depths[en]:
+        components.append(Delay(f"{name}.delay", inputs=[data], properties=[f"{depths[en] - depths[data]}"]))
+        data = f"{name}.delay"
+
+    # Asynchronous reset overrides everything, including set
+    keep = [] if async_reset is None else [inactive(async_reset, async_reset_positive, "AR")]
+
+    q_inputs = [f"{name}.pass", f"{name}.trap"]
+    if async_set is not None:
+        s = active(async_set, async_set_positive, "S")
+        q_inputs.append(gate(And, f"{name}.set", [s] + keep) if keep else s)
+
+    components.extend([
+        And(f"{name}.pass", inputs=[data, en] + keep),
+        And(f"{name}.trap", inputs=[hold, output] + keep),
+        Node(output, inputs=q_inputs)
+    ])
+    return components
@@ -5,6 +5,7 @@ The standard modules
 
 from cm2.circuitry.core import *
 from cm2.utils import closest_divisors
+from cm2.modules.hdlm import HugeMemory, HUGE_MEMORY_ADDRESS_BITS, HUGE_MEMORY_WORD_BITS
 
 def Adder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
     """
@@ -75,6 +76,368 @@ def Adder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
     a.move(pos)
     return a
 
+def _prefix_adder(name: str, size: int, levels: List[List[Tuple[int, int]]], pos: Tuple[float, float, float]):
+    """
+    Adder with the same ports as Adder, whose carries come from a parallel prefix
+    network. Position 0 of the network is the carry in and position i + 1 is bit i.
+    Each level is a list of (i, j) pairs, merging the span ending at position j
+    into the one ending at position i, in 1 tick (an and gate and an or node).
+    """
+    assert size > 0, "Adder size must be positive"
+    a = Module(name)
+    a.set_size(size)
+    a.set_ports({
+        "input": ["input.0", "input.1", "input.2"],
+        "output": ["output.0", "output.1"]
+    })
+
+    depth = len(levels)
+    a.add([
+        Array("input.0", "node", (0, 0, 0)),
+        Array("input.1", "node", (size + 1, 0, 0)),
+        Block("input.2", "node", (2*size + 2, 0, 0)),
+
+        Array("generate", "and", (1, 0, -1)),
+        Array("propagate", "xor", (size + 2, 0, -1)),
+        Block("carry_in", "xor", (0, 0, -1)),
+
+        Array("delay", "delay", (size + 2, 0, -2), properties=[str(depth)]),
+        Block("carry_out", "xor", (0, 0, -(depth + 2))),
+        Array("result", "xor", (2, 0, -(depth + 2))),
+
+        Block("output.0", "node", (0, 0, -(depth + 3))),
+        Array("output.1", "node", (2, 0, -(depth + 3))),
+
+        Wire("input.2", "carry_in"),
+        Wire("propagate", "delay"),
+        Wire("delay", "result"),
+        Wire("carry_out", "output.0"),
+
+        # Inverted
+        Wire("input.0", "propagate", True),
+        Wire("input.0", "generate", True),
+        Wire("input.1", "generate", True),
+        Wire("input.1", "propagate", True),
+        Wire("result", "output.1", True)
+    ])
+
+    # Group generate/propagate signal of the span ending at each position, and where it starts
+    generate = ["carry_in"] + [f"generate.{i}" for i in range(size)]
+    propagate: List[Optional[str]] = [None] + [f"propagate.{i}" for i in range(size)]
+    low = list(range(size + 1))
+
+    for l, level in enumerate(levels):
+        z = -(l + 2)
+        new_generate: Dict[int, str] = {}
+        new_propagate: Dict[int, Optional[str]] = {}
+        for i, j in level:
+            assert low[i] <= j + 1, f"Span ending at {j} doesn't reach the one ending at {i}"
+            prefix = f"prefix.{l + 1}"
+            a.add([
+                Block(f"{prefix}.and.{i}", "and", (i, 1, z)),
+                Block(f"{prefix}.generate.{i}", "node", (i, 2, z)),
+                Wire(cast(str, propagate[i]), f"{prefix}.and.{i}"),
+                Wire(generate[j], f"{prefix}.and.{i}"),
+                Wire(generate[i], f"{prefix}.generate.{i}"),
+                Wire(f"{prefix}.and.{i}", f"{prefix}.generate.{i}")
+            ])
+            new_generate[i] = f"{prefix}.generate.{i}"
+            # Spans starting at the carry in never propagate
+            if propagate[j] is None:
+                new_propagate[i] = None
+            else:
+                a.add([
+                    Block(f"{prefix}.propagate.{i}", "and", (i, 3, z)),
+                    Wire(cast(str, propagate[i]), f"{prefix}.propagate.{i}"),
+                    Wire(cast(str, propagate[j]), f"{prefix}.propagate.{i}")
+                ])
+                new_propagate[i] = f"{prefix}.propagate.{i}"
+        new_low = {i: low[j] for i, j in level}
+        for i, _ in level:
+            generate[i] = new_generate[i]
+            propagate[i] = new_propagate[i]
+            low[i] = new_low[i]
+    assert all(l == 0 for l in low), "Prefix network doesn't reach the carry in from every position"
+
+    a.add([Wire(generate[i], f"result.{i}") for i in range(size)])
+    a.add(Wire(generate[size], "carry_out"))
+
+    a.move(pos)
+    return a
+
+def KoggeStoneAdder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
+    """
+    Creates a Kogge-Stone Adder with Carry, same ports as Adder.
+    log2(size + 1) prefix levels, about (size + 1) * log2(size + 1) merges
+    """
+    levels: List[List[Tuple[int, int]]] = []
+    d = 1
+    while d <= size:
+        levels.append([(i, i - d) for i in range(d, size + 1)])
+        d *= 2
+    return _prefix_adder(name, size, levels, pos)
+
+def BrentKungAdder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
+    """
+    Creates a Brent-Kung Adder with Carry, same ports as Adder.
+    Up to 2 * log2(size + 1) - 1 prefix levels, fewer than 2 * (size + 1) merges
+    """
+    levels: List[List[Tuple[int, int]]] = []
+    d = 1
+    while 2*d <= size + 1:
+        levels.append([(i, i - d) for i in range(2*d - 1, size + 1, 2*d)])
+        d *= 2
+    d //= 2
+    while d >= 1:
+        level = [(i, i - d) for i in range(3*d - 1, size + 1, 2*d)]
+        if level:
+            levels.append(level)
+        d //= 2
+    return _prefix_adder(name, size, levels, pos)
+
+def HanCarlsonAdder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
+    """
+    Creates a Han-Carlson Adder with Carry, same ports as Adder.
+    Kogge-Stone on the odd positions and a last level for the even ones:
+    log2(size + 1) + 1 prefix levels, about half the merges of Kogge-Stone
+    """
+    levels: List[List[Tuple[int, int]]] = [[(i, i - 1) for i in range(1, size + 1, 2)]]
+    d = 2
+    while d < size:
+        levels.append([(i, i - d) for i in range(d + 1, size + 1, 2)])
+        d *= 2
+    last = [(i, i - 1) for i in range(2, size + 1, 2)]
+    if last:
+        levels.append(last)
+    return _prefix_adder(name, size, levels, pos)
+
+MultiplierAlgorithm: TypeAlias = Literal["dadda", "wallace"]
+
+def _tree_multiplier(name: str, size: int, algorithm: MultiplierAlgorithm, pos: Tuple[float, float, float]):
+    """
+    Unsigned size x size multiplier: and gate partial products, reduced to two rows
+    by a tree of 1 tick full/half adders and added by a KoggeStoneAdder. Signals
+    that skip a stage are delayed, the whole module is then balanced, and early
+    product bits are delayed, so every path from an input to an output takes the
+    same ticks. Ports input.0, input.1 and output (2 * size bits), most significant
+    bit first.
+    """
+    assert size > 1, "Multiplier size must be at least 2"
+    m = Module(name)
+    m.set_size(size)
+    m.set_ports({
+        "input": ["input.0", "input.1"],
+        "output": ["output"]
+    })
+
+    blocks: List[Union[Block, Array]] = [
+        Array("input.0", "node", (0, 0, 0), size),
+        Array("input.1", "node", (size + 1, 0, 0), size),
+        Array("output", "node", (0, 0, -size - 4), 2*size)
+    ]
+    wires: Dict[str, Wire] = {}
+    arrival: Dict[str, int] = {}
+    delayed: Dict[Tuple[str, int], str] = {}
+
+    def gate(
+        block_name: str, block_id: str, inputs: List[str], tick: int,
+        p: Tuple[float, float, float], properties: Optional[List[str]] = None
+    ) -> str:
+        blocks.append(Block(block_name, block_id, p, properties=properties))
+        for src in inputs:
+            wires[f"{src}->{block_name}"] = Wire(src, block_name)
+        arrival[block_name] = tick
+        return block_name
+
+    def at(signal: str, tick: int) -> str:
+        """The signal, delayed to arrive at tick"""
+        if arrival[signal] == tick:
+            return signal
+        if (signal, tick) not in delayed:
+            delayed[(signal, tick)] = gate(
+                f"{signal}.delay{tick}", "delay", [signal], tick, (0, 0, 0), [str(tick - arrival[signal])]
+            )
+        return delayed[(signal, tick)]
+
+    # Partial products, column i + j gets a_i & b_j
+    columns: List[List[str]] = [[] for _ in range(2*size)]
+    for i in range(size):
+        for j in range(size):
+            product = gate(
+                f"partial.{i}.{j}", "and", [f"input.0.{size - i - 1}", f"input.1.{size - j - 1}"], 1, (i, 1, -j - 1)
+            )
+            columns[i + j].append(product)
+
+    # Dadda heights: reduce to the next one down in each stage
+    heights = [2]
+    while heights[-1] < size:
+        heights.append(heights[-1] * 3 // 2)
+
+    tick = 1
+    stage = 0
+    while max(len(c) for c in columns) > 2:
+        target = heights[max(i for i, h in enumerate(heights) if h < max(len(c) for c in columns))]
+        new_columns: List[List[str]] = [[] for _ in range(2*size)]
+        for c in range(2*size):
+            bits = columns[c]
+            k = 0
+            n = 0
+            while True:
+                remaining = len(bits) - k
+                if algorithm == "dadda":
+                    excess = remaining + len(new_columns[c]) - target
+                    count = 0 if excess <= 0 else 2 if excess == 1 else 3
+                else:
+                    count = 3 if remaining >= 3 else 2 if remaining == 2 else 0
+                if count == 0 or remaining < count:
+                    break
+                prefix = f"stage.{stage}.{c}.{n}"
+                inputs = [at(b, tick) for b in bits[k:k + count]]
+                p = (c, 2 + stage, -n)
+                new_columns[c].append(gate(f"{prefix}.sum", "xor", inputs, tick + 1, p))
+                if count == 3:
+                    ands = [
+                        gate(f"{prefix}.and.{j}", "and", [inputs[x], inputs[y]], tick + 1, p)
+                        for j, (x, y) in enumerate(((0, 1), (0, 2), (1, 2)))
+                    ]
+                    carry = gate(f"{prefix}.carry", "node", ands, tick + 1, p)
+                else:
+                    carry = gate(f"{prefix}.carry", "and", inputs, tick + 1, p)
+                if c + 1 < 2*size: # The product always fits, the last carry is 0
+                    new_columns[c + 1].append(carry)
+                k += count
+                n += 1
+            new_columns[c].extend(bits[k:])
+        columns = new_columns
+        tick += 1
+        stage += 1
+
+    m.add(KoggeStoneAdder("adder", 2*size, (0, 0, -size - 2)))
+    for c in range(2*size):
+        for row, bit in enumerate(columns[c]):
+            src = at(bit, tick)
+            dst = f"adder.input.{row}.{2*size - c - 1}"
+            wires[f"{src}->{dst}"] = Wire(src, dst)
+        wires[f"adder.output.1.{c}->output.{c}"] = Wire(f"adder.output.1.{c}", f"output.{c}")
+    m.add_bulk(blocks, wires)
+
+    # The prefix adder isn't balanced, and its sums take different ticks by position
+    m.auto_balance()
+    summary = m.get_latency_matrix()
+    latency = summary.longest.max(axis=0)
+    slowest = int(latency.max())
+    for o, output in enumerate(summary.outputs):
+        delay = slowest - int(latency[o])
+        if latency[o] >= 0 and delay > 0:
+            c = int(output.rpartition(".")[2])
+            m.remove(f"adder.output.1.{c}->{output}")
+            m.add([
+                Block(f"{output}.delay", "delay", (c, 0, -size - 3), properties=[f"{delay}"]),
+                Wire(f"adder.output.1.{c}", f"{output}.delay"),
+                Wire(f"{output}.delay", output)
+            ])
+
+    m.move(pos)
+    return m
+
+def DaddaMultiplier(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
+    """
+    Creates an unsigned Dadda tree Multiplier, 2 * size output bits.
+    Reduces each column only as much as each stage needs: fewest adders
+    """
+    return _tree_multiplier(name, size, "dadda", pos)
+
+def WallaceMultiplier(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
+    """
+    Creates an unsigned Wallace tree Multiplier, 2 * size output bits.
+    Reduces every column as much as possible in each stage
+    """
+    return _tree_multiplier(name, size, "wallace", pos)
+
+ShifterFill: TypeAlias = Literal["zero", "rotate", "sign"]
+
+def BarrelShifter(
+    name: str,
+    size: int,
+    direction: Literal["left", "right"] = "left",
+    fill: ShifterFill = "zero",
+    pos: Tuple[float, float, float] = (0, 0, 0)
+):
+    """
+    Creates a log depth Barrel Shifter: input.0 (data) shifted by input.1 (amount), to output,
+    most significant bit first. Stage s shifts by 2^s in 1 tick, after a 1 tick input buffer.
+    fill takes zeros, the bits shifted out (rotate) or the sign bit (right shifts only)
+    """
+    assert size > 1, "Shifter size must be at least 2"
+    assert fill != "sign" or direction == "right", "Only right shifts fill with the sign"
+    stages = math.ceil(math.log2(size))
+    s = Module(name)
+    s.set_size(size)
+    s.set_ports({
+        "input": ["input.0", "input.1"],
+        "output": ["output"]
+    })
+
+    blocks: List[Union[Block, Array]] = [
+        Array("input.0", "node", (0, 0, 0), size),
+        Array("input.1", "node", (size + 1, 0, 0), stages, ArrayInfo(x_step=0, y_step=1)),
+        Array("buffer", "or", (0, 0, -1), size),
+        Array("output", "node", (0, 0, -stages - 2), size)
+    ]
+    wires: Dict[str, Wire] = {}
+
+    def connect(src: str, dst: str):
+        wires[f"{src}->{dst}"] = Wire(src, dst)
+
+    for i in range(size):
+        connect(f"input.0.{i}", f"buffer.{i}")
+
+    data = "buffer"
+    for stage in range(stages):
+        distance = 2 ** stage
+        z = -stage - 2
+        # Amount bit, delayed to arrive with the data
+        amount = f"input.1.{stages - stage - 1}"
+        if stage > 0:
+            blocks.append(Block(f"amount.{stage}", "delay", (size + 1, stage, z), properties=[str(stage)]))
+            connect(amount, f"amount.{stage}")
+            amount = f"amount.{stage}"
+        blocks.extend([
+            Block(f"select.{stage}", "or", (size, 0, z)),
+            Block(f"select.{stage}.not", "nor", (size, 1, z)),
+            Array(f"keep.{stage}", "and", (0, 0, z), size),
+            Array(f"shift.{stage}", "and", (0, 1, z), size),
+            Array(f"stage.{stage}", "node", (0, 2, z), size)
+        ])
+        connect(amount, f"select.{stage}")
+        connect(amount, f"select.{stage}.not")
+
+        for i in range(size):
+            # Element i is bit size - i - 1
+            connect(f"{data}.{i}", f"keep.{stage}.{i}")
+            connect(f"select.{stage}.not", f"keep.{stage}.{i}")
+            connect(f"keep.{stage}.{i}", f"stage.{stage}.{i}")
+            connect(f"shift.{stage}.{i}", f"stage.{stage}.{i}")
+
+            src = i + distance if direction == "left" else i - distance
+            if 0 <= src < size:
+                connect(f"{data}.{src}", f"shift.{stage}.{i}")
+            elif fill == "rotate":
+                connect(f"{data}.{src % size}", f"shift.{stage}.{i}")
+            elif fill == "sign":
+                connect(f"{data}.0", f"shift.{stage}.{i}")
+            else: # Shifted in zeros
+                continue
+            connect(f"select.{stage}", f"shift.{stage}.{i}")
+        data = f"stage.{stage}"
+
+    for i in range(size):
+        connect(f"{data}.{i}", f"output.{i}")
+    s.add_bulk(blocks, wires)
+
+    s.move(pos)
+    return s
+
 def FullAdder(name: str, pos: Tuple[float, float, float] = (0, 0, 0)):
     a = Module(name)
     a.set_ports({
@@ -175,7 +538,19 @@ def Latch(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
     ff.move(pos)
     return ff
 
-def Decoder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
+# Decoders from this size up are predecoded by default
+DECODER_PREDECODE_SIZE = 6
+
+def Decoder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0), predecode: Optional[bool] = None):
+    """
+    Creates a Decoder. Each output ANDs every input bit, size * 2^size wires.
+    predecode uses PredecodedDecoder instead, by default from DECODER_PREDECODE_SIZE bits up
+    """
+    if predecode is None:
+        predecode = size >= DECODER_PREDECODE_SIZE
+    if predecode:
+        return PredecodedDecoder(name, size, pos=pos)
+
     dc = Module(name)
     dc.set_size(size)
     dc.set_ports({
@@ -199,7 +574,7 @@ def Decoder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
         bin_i = f"{i:0{size}b}"
         
         x = int(bin_i[:x_input_size], 2)
-        y = - y_size + (int(bin_i[x_input_size:], 2) + 1)
+        y = - y_size + (int(bin_i[x_input_size:] or "0", 2) + 1)
         dc.add(Block(f"output.{i}", "and", (x - (x_size - size) // 2, 0, -3 + y)))
         for b in range(len(bin_i)):
             if bin_i[b] == "1":
@@ -210,6 +585,56 @@ def Decoder(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
     dc.move(pos)
     return dc
 
+def PredecodedDecoder(name: str, size: int, groups: int = 2, pos: Tuple[float, float, float] = (0, 0, 0)):
+    """
+    Creates a Decoder, same ports as Decoder, that splits the input bits in groups,
+    decodes each group and ANDs one output per group: about groups * 2^size wires
+    for one more tick
+    """
+    assert 1 <= groups <= size, f"Can't split {size} input bits in {groups} groups"
+    dc = Module(name)
+    dc.set_size(size)
+    dc.set_ports({
+        "input": ["input"],
+        "output": ["output"]
+    })
+
+    noutputs = int(2 ** size)
+    y_size, x_size = closest_divisors(noutputs)
+    x_input_size = int(math.log2(x_size))
+    bounds = [size * k // groups for k in range(groups + 1)]
+
+    dc.add([
+        Array("input", "node", (0, 0, 0)),
+        Array("nor_gate", "nor", (0, 0, -1)),
+        Array("or_gate", "or", (0, 0, -2)),
+        Wire("input", "nor_gate"),
+        Wire("input", "or_gate")
+    ])
+
+    for k in range(groups):
+        start, end = bounds[k], bounds[k + 1]
+        for j in range(int(2 ** (end - start))):
+            bin_j = f"{j:0{end - start}b}"
+            dc.add(Block(f"group.{k}.{j}", "and", (j, 0, -3 - k)))
+            for b in range(len(bin_j)):
+                if bin_j[b] == "1":
+                    dc.add(Wire(f"or_gate.{start + b}", f"group.{k}.{j}"))
+                else:
+                    dc.add(Wire(f"nor_gate.{start + b}", f"group.{k}.{j}"))
+
+    for i in range(noutputs):
+        bin_i = f"{i:0{size}b}"
+
+        x = int(bin_i[:x_input_size], 2)
+        y = - y_size + (int(bin_i[x_input_size:] or "0", 2) + 1)
+        dc.add(Block(f"output.{i}", "and", (x - (x_size - size) // 2, 0, -3 - groups + y)))
+        for k in range(groups):
+            dc.add(Wire(f"group.{k}.{int(bin_i[bounds[k]:bounds[k + 1]], 2)}", f"output.{i}"))
+
+    dc.move(pos)
+    return dc
+
 def MuxExtended(name: str, data_size: int, addr_size: int, pos: Tuple[float, float, float] = (0, 0, 0)):
     mux = Module(name)
     mux.set_size(data_size)
@@ -245,6 +670,9 @@ def MuxExtended(name: str, data_size: int, addr_size: int, pos: Tuple[float, flo
     nor_array.set_info(ArrayInfo(x_step=0))
     or_array.set_pos((data_size, 0, 1))
     or_array.set_info(ArrayInfo(x_step=0))
+    for k, c in mux.blocks.items():
+        if k.startswith("decoder.group."):
+            c.set_pos((data_size, 0, 1))
     for i in range(num_gates):
         decoder_block = cast(Block, mux.blocks.get(f"decoder.output.{i}"))
         decoder_block.set_pos((data_size, 0, -i))
@@ -287,6 +715,9 @@ def Mux(name: str, data_size: int, addr_size: int, pos: Tuple[float, float, floa
     nor_array.set_info(ArrayInfo(x_step=0))
     or_array.set_pos((data_size, 0, 1))
     or_array.set_info(ArrayInfo(x_step=0))
+    for k, c in mux.blocks.items():
+        if k.startswith("decoder.group."):
+            c.set_pos((data_size, 0, 1))
     for i in range(num_gates):
         decoder_block = cast(Block, mux.blocks.get(f"decoder.output.{i}"))
         decoder_block.set_pos((data_size, 0, 0))
@@ -381,4 +812,183 @@ def RingCounter(name: str, size: int, pos: Tuple[float, float, float] = (0, 0, 0
             ])
 
     r.move(pos)
-    return r
\ No newline at end of file
+    return r
+
+# Register files from this many bits up use HugeMemory buildings, when they have 1 read and 1 write port
+REGISTER_FILE_HUGE_MEMORY_BITS = 4096
+
+RegisterFileBackend: TypeAlias = Literal["latch", "huge_memory"]
+
+def RegisterFile(
+    name: str,
+    words: int,
+    width: int,
+    read_ports: int = 1,
+    write_ports: int = 1,
+    backend: Optional[RegisterFileBackend] = None,
+    pos: Tuple[float, float, float] = (0, 0, 0)
+):
+    """
+    Creates a memory of words x width bits, with ports write.{w}.address, write.{w}.data,
+    write.{w}.enable, read.{r}.address and read.{r}.data (addresses most significant bit
+    first, like Decoder).
+
+    The "latch" backend stores every bit in a latch like Latch, with a Decoder per port.
+    The "huge_memory" backend uses HugeMemory buildings, and takes 1 read and 1 write
+    port sharing the building address: reads see the write address while enabled.
+    By default, HugeMemory is used from REGISTER_FILE_HUGE_MEMORY_BITS bits up, when possible.
+    """
+    assert words > 0 and width > 0, "Register file must have words and bits"
+    address_size = max(1, math.ceil(math.log2(words)))
+    fits_huge_memory = read_ports == 1 and write_ports == 1 and address_size <= HUGE_MEMORY_ADDRESS_BITS
+    if backend is None:
+        backend = "huge_memory" if fits_huge_memory and words * width >= REGISTER_FILE_HUGE_MEMORY_BITS else "latch"
+    assert backend in ("latch", "huge_memory"), f"Register file backend '{backend}' not supported"
+
+    rf = Module(name)
+    rf.set_size(width)
+    rf.set_ports({
+        "input": [
+            *[p for w in range(write_ports) for p in (f"write.{w}.address", f"write.{w}.data", f"write.{w}.enable")],
+            *[f"read.{r}.address" for r in range(read_ports)]
+        ],
+        "output": [f"read.{r}.data" for r in range(read_ports)]
+    })
+
+    blocks: List[Union[Block, Array]] = []
+    wires: Dict[str, Wire] = {}
+
+    def connect(src: str, dst: str, size: Optional[int] = None):
+        """Wires two blocks, or two arrays of size element by element"""
+        if size is None:
+            wires[f"{src}->{dst}"] = Wire(src, dst)
+        else:
+            for k in range(size):
+                wires[f"{src}.{k}->{dst}.{k}"] = Wire(f"{src}.{k}", f"{dst}.{k}")
+
+    def broadcast(src: str, dst: str):
+        """Wires a block to every element of an array"""
+        for k in range(width):
+            wires[f"{src}->{dst}.{k}"] = Wire(src, f"{dst}.{k}")
+
+    for w in range(write_ports):
+        blocks.extend([
+            Array(f"write.{w}.address", "node", (width + 2 + w, 0, 0), address_size, ArrayInfo(x_step=0, y_step=1)),
+            Array(f"write.{w}.data", "node", (0, w, 1), width),
+            Block(f"write.{w}.enable", "node", (width, w, 1))
+        ])
+    for r in range(read_ports):
+        blocks.append(
+            Array(f"read.{r}.address", "node", (width + 2 + write_ports + r, 0, 0), address_size, ArrayInfo(x_step=0, y_step=1))
+        )
+
+    if backend == "huge_memory":
+        assert fits_huge_memory, (
+            f"HugeMemory register files take 1 read and 1 write port and {2 ** HUGE_MEMORY_ADDRESS_BITS} words at most"
+        )
+        # Building address: the write address while enabled, the read address otherwise.
+        # The write pin and data wait a tick for the address to switch.
+        blocks.extend([
+            Block("enable.not", "nor", (width, 0, 0)),
+            Block("enable.delay", "delay", (width, 1, 0), properties=["1"]),
+            Block("write", "and", (width, 2, 0)),
+            Array("data.delay", "delay", (0, 0, 0), width, properties=["1"]),
+            Array("address.write", "and", (width + 1, 0, -1), address_size, ArrayInfo(x_step=0, y_step=1)),
+            Array("address.read", "and", (width + 2, 0, -1), address_size, ArrayInfo(x_step=0, y_step=1)),
+            Array("address", "node", (width + 3, 0, -1), address_size, ArrayInfo(x_step=0, y_step=1)),
+            Array("read.0.data", "node", (0, 0, -2), width)
+        ])
+        connect("write.0.enable", "enable.not")
+        connect("write.0.enable", "enable.delay")
+        connect("write.0.enable", "write")
+        connect("enable.delay", "write")
+        connect("write.0.data", "data.delay", width)
+        connect("write.0.address", "address.write", address_size)
+        connect("read.0.address", "address.read", address_size)
+        connect("address.write", "address", address_size)
+        connect("address.read", "address", address_size)
+        for b in range(address_size):
+            connect("write.0.enable", f"address.write.{b}")
+            connect("enable.not", f"address.read.{b}")
+        rf.add_bulk(blocks, wires)
+
+        address = [f"address.{address_size - b - 1}" for b in range(address_size)]
+        for j in range(0, width, HUGE_MEMORY_WORD_BITS):
+            bits = range(j, min(j + HUGE_MEMORY_WORD_BITS, width))
+            rf.add(HugeMemory(
+                f"memory.{j // HUGE_MEMORY_WORD_BITS}",
+                address,
+                [f"data.delay.{k}" for k in bits],
+                "write",
+                [f"read.0.data.{k}" for k in bits],
+                (pos[0], pos[1], pos[2] - 4 - 2 * j)
+            ))
+        rf.move(pos)
+        return rf
+
+    # Latch backend. Enables wait for the address decoders, and data for the word
+    # selects, so addresses, data and enables can all change on the same tick.
+    for port, n in (("write", write_ports), ("read", read_ports)):
+        for p in range(n):
+            decoder = f"{port}.{p}.decoder"
+            dc = Decoder(decoder, address_size, (width + 2, 0, 2 + p + (0 if port == "write" else write_ports)))
+            latency = max(dc.get_arrival_times().values())
+            rf.add(dc)
+            connect(f"{port}.{p}.address", f"{decoder}.input", address_size)
+
+    for w in range(write_ports):
+        blocks.extend([
+            Block(f"write.{w}.enable.delay", "delay", (width + 1, w, 1), properties=[str(latency)]),
+            Array(f"write.{w}.delay", "delay", (0, w, 0), width, properties=[str(latency + (2 if write_ports == 1 else 1))])
+        ])
+        connect(f"write.{w}.enable", f"write.{w}.enable.delay")
+        connect(f"write.{w}.data", f"write.{w}.delay", width)
+
+    for i in range(words):
+        z = -2 - i
+        word = f"word.{i}"
+        blocks.extend([
+            Array(f"{word}.pass", "and", (0, 0, z), width),
+            Array(f"{word}.trap", "and", (0, 1, z), width),
+            Array(f"{word}.output", "node", (0, 2, z), width),
+            Block(f"{word}.act_pass", "or", (width, 0, z)),
+            Block(f"{word}.act_trap", "nor", (width, 1, z))
+        ])
+        connect(f"{word}.pass", f"{word}.output", width)
+        connect(f"{word}.trap", f"{word}.output", width)
+        connect(f"{word}.output", f"{word}.trap", width)
+        broadcast(f"{word}.act_pass", f"{word}.pass")
+        broadcast(f"{word}.act_trap", f"{word}.trap")
+
+        for w in range(write_ports):
+            select = f"{word}.select.{w}"
+            blocks.append(Block(select, "and", (width + 1 + w, 0, z)))
+            connect(f"write.{w}.decoder.output.{i}", select)
+            connect(f"write.{w}.enable.delay", select)
+            connect(select, f"{word}.act_pass")
+            connect(select, f"{word}.act_trap")
+        if write_ports == 1:
+            connect("write.0.delay", f"{word}.pass", width)
+        else:
+            blocks.append(Array(f"{word}.data", "node", (0, 3, z), width))
+            connect(f"{word}.data", f"{word}.pass", width)
+            for w in range(write_ports):
+                blocks.append(Array(f"{word}.data.{w}", "and", (0, 4 + w, z), width))
+                broadcast(f"{word}.select.{w}", f"{word}.data.{w}")
+                connect(f"write.{w}.delay", f"{word}.data.{w}", width)
+                connect(f"{word}.data.{w}", f"{word}.data", width)
+
+        for r in range(read_ports):
+            gate = f"read.{r}.gate.{i}"
+            blocks.append(Array(gate, "and", (0, 4 + write_ports + r, z), width))
+            connect(f"{word}.output", gate, width)
+            broadcast(f"read.{r}.decoder.output.{i}", gate)
+            connect(gate, f"read.{r}.data", width)
+
+    for r in range(read_ports):
+        blocks.append(Array(f"read.{r}.data", "node", (0, 4 + write_ports + r, -2 - words), width))
+
+    rf.add_bulk(blocks, wires)
+
+    rf.move(pos)
+    return rf
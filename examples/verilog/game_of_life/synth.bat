@@ -12,7 +12,8 @@ shift
 
 echo read_verilog -sv %* > tmp.ys
 echo hierarchy -check -top %top% >> tmp.ys
-type cm2v.ys >> tmp.ys
+if "%CM2V_SCRIPT%"=="" set CM2V_SCRIPT=cm2v.ys
+type %CM2V_SCRIPT% >> tmp.ys
 echo json -o %output% >> tmp.ys
 yosys -s tmp.ys
 del tmp.ys
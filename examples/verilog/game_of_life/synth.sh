@@ -13,7 +13,7 @@ shift
 
 echo "read_verilog -sv $*" > tmp.ys
 echo "hierarchy -check -top $top" >> tmp.ys
-cat cm2v.ys >> tmp.ys
+cat "${CM2V_SCRIPT:-cm2v.ys}" >> tmp.ys
 echo "json -o $output" >> tmp.ys
 yosys -s tmp.ys
 rm tmp.ys
@@ -0,0 +1,42 @@
+from cm2.circuitry.builder import *
+from cm2.circuitry.diff import diff_modules, savestring_to_module
+from cm2.modules.stdm import Adder
+
+def adders() -> Module:
+    m = Module("top")
+    m.add([Adder(prefix, 4) for prefix in "abcd"])
+    return m
+
+def by_prefix(diff):
+    return {c["prefix"]: (c["added"], c["removed"], c["retyped"], c["rewired"]) for c in diff["prefixes"]}
+
+def test_self_diff_is_empty():
+    m = adders()
+    diff = diff_modules(m, adders())
+    assert diff["matched"] == sum(c.width or 0 if isinstance(c, Array) else 1 for c in m.blocks.values())
+    assert not (diff["added"] or diff["removed"] or diff["retyped"] or diff["added_wires"] or diff["removed_wires"])
+    assert diff["prefixes"] == []
+
+def test_changes_are_reported_by_prefix():
+    old, new = adders(), adders()
+    new.blocks["a.carry_in"].block_id = "or"
+    new.add([Block("b.extra", "and"), Wire("b.input.2", "b.extra")])
+    for key in [key for key, w in new.wires.items() if "c.carry_in" in (w.src, w.dst)]:
+        new.remove(key)
+    new.remove("c.carry_in")
+    new.remove("d.input.2->d.carry_in")
+    new.add(Wire("d.input.2", "d.generate.0"))
+
+    diff = diff_modules(old, new, depth=1)
+    assert by_prefix(diff) == {"a": (0, 0, 1, 0), "b": (1, 0, 0, 0), "c": (0, 1, 0, 0), "d": (0, 0, 0, 2)}
+    assert [(c["old"], c["old_type"], c["new_type"]) for c in diff["retyped"]] == [("a.carry_in", "xor", "or")]
+    assert [c["name"] for c in diff["added"]] == ["b.extra"]
+    assert [c["name"] for c in diff["removed"]] == ["c.carry_in"]
+    assert [(w["src"], w["dst"]) for w in diff["removed_wires"]] == [("d.input.2", "d.carry_in")]
+    assert [(w["src"], w["dst"]) for w in diff["added_wires"]] == [("d.input.2", "d.generate.0")]
+
+def test_savestring_round_trip(tmp_path):
+    string = adders().save(str(tmp_path / "before.txt"))
+    loaded = savestring_to_module(string)
+    assert loaded.save(str(tmp_path / "after.txt")) == string
+    assert diff_modules(loaded, savestring_to_module(string), names=False)["prefixes"] == []
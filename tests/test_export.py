@@ -0,0 +1,44 @@
+import collections
+
+import pytest
+
+from cm2.circuitry.builder import *
+from cm2.circuitry.export import get_chunk_keys, save_chunks
+from cm2.modules.stdm import Adder
+
+def chained_adders() -> Module:
+    m = Module("top")
+    m.add([Adder(prefix, 4, (5 * k, 0, 0)) for k, prefix in enumerate("abcd")])
+    m.add([Wire(f"{a}.output.1.0", f"{b}.input.2") for a, b in ("ab", "bc", "cd")])
+    return m
+
+def read_chunk(path: str):
+    with open(path) as file:
+        sections = file.read().split("?")
+    blocks = [f for f in sections[0].split(";") if f]
+    wires = [tuple(map(int, f.split(","))) for f in sections[1].split(";") if f]
+    return blocks, wires
+
+@pytest.mark.parametrize("by, workers", [("prefix", 1), ("region", 1), ("prefix", 2)])
+def test_chunks_split_the_module(tmp_path, by: str, workers: int):
+    m = chained_adders()
+    export = save_chunks(m, str(tmp_path), by, size=4, workers=workers)
+    chunks = export["chunks"]
+    assert len(chunks) > 1
+
+    for chunk in chunks:
+        blocks, wires = read_chunk(chunk["path"])
+        assert (len(blocks), len(wires)) == (chunk["blocks"], chunk["wires"])
+        assert all(1 <= i <= len(blocks) for wire in wires for i in wire)
+    assert sum(c["blocks"] for c in chunks) == len(m.get_block_indexes())
+
+    keys, _ = get_chunk_keys(m, by, 4)
+    chunk_of = {
+        block: keys[name]
+        for name, c in m.blocks.items()
+        for block in ([f"{name}.{i}" for i in range(c.width or 0)] if isinstance(c, Array) else [name])
+    }
+    crossing = collections.Counter((w.src, w.dst) for w in m.wires.values() if chunk_of[w.src] != chunk_of[w.dst])
+    assert crossing
+    assert collections.Counter((link["src"], link["dst"]) for link in export["links"]) == crossing
+    assert sum(c["wires"] for c in chunks) + sum(crossing.values()) == len(m.wires)
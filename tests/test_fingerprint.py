@@ -0,0 +1,21 @@
+from cm2.circuitry.builder import *
+from cm2.modules.hdlm import HugeMemory
+
+def memory_module(path: str) -> Module:
+    m = Module("rom")
+    m.add([Node("a"), HugeMemory("mem", ["a"], [], None, [], data=path)])
+    return m
+
+def test_fingerprint_hashes_memory_images(tmp_path):
+    first, copy, other = tmp_path / "first.bin", tmp_path / "copy.bin", tmp_path / "other.bin"
+    first.write_bytes(bytes([1, 0, 2, 0]))
+    copy.write_bytes(bytes([1, 0, 2, 0]))
+    other.write_bytes(bytes([1, 0, 3, 0]))
+    m = memory_module(str(first))
+    assert m.fingerprint() == memory_module(str(copy)).fingerprint()
+    assert m.fingerprint() != memory_module(str(other)).fingerprint()
+    assert m.fingerprint(names=True) != memory_module(str(other)).fingerprint(names=True)
+
+    before = m.fingerprint()
+    first.write_bytes(bytes([1, 0, 2, 0, 4, 0]))
+    assert m.fingerprint() != before
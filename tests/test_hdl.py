@@ -0,0 +1,52 @@
+import importlib.util
+
+import pytest
+
+from cm2.circuitry.builder import *
+from cm2.circuitry.hdl import module_to_python, parse_memory
+from test_pipeline import Simulator
+
+def memory_cell(polarity: int):
+    return {
+        "parameters": {
+            "ABITS": 2, "WIDTH": 1, "SIZE": 4, "OFFSET": 0, "RD_PORTS": 1, "WR_PORTS": 1,
+            "RD_CLK_ENABLE": "0", "WR_CLK_ENABLE": "1", "WR_CLK_POLARITY": polarity, "INIT": "xxxx"
+        },
+        "connections": {
+            "RD_ADDR": [2, 3], "WR_ADDR": [2, 3], "WR_DATA": [4], "WR_EN": [5], "WR_CLK": [6], "RD_DATA": [7]
+        }
+    }
+
+@pytest.mark.parametrize("polarity", [1, 0])
+def test_memory_writes_on_a_clock_edge_pulse(polarity: int):
+    m = Module("ram")
+    m.add([Node(str(bit)) for bit in range(2, 7)])
+    m.add(parse_memory("mem", memory_cell(polarity), lambda name: False))
+    sim = Simulator(m)
+    sim.driven = {"5": True, "6": not polarity}
+    pulses = []
+    for clock in [not polarity] * 4 + [bool(polarity)] * 8 + [not polarity] * 8:
+        sim.driven["6"] = clock
+        sim.tick()
+        pulses.append(sim.value["mem.write"])
+    assert sum(pulses) == 1
+    assert pulses.index(True) == (4 if polarity else 5) # Registers on the clock change two ticks after the edge or later
+
+def test_synchronous_memory_rejects_auto_balance():
+    with pytest.raises(AssertionError):
+        parse_memory("mem", memory_cell(1), lambda name: False, auto_balance=True)
+
+def test_generated_module_instances_own_their_properties(tmp_path):
+    m = Module("line")
+    m.set_ports({"input": ["a"], "output": ["d"]})
+    m.add([Node("a", "d"), Delay("d", properties=["3"])])
+    path = tmp_path / "line.py"
+    module_to_python(m, str(path))
+    spec = importlib.util.spec_from_file_location("line", path)
+    assert spec is not None and spec.loader is not None
+    generated = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(generated)
+
+    first, second = generated.line("first"), generated.line("second")
+    first.blocks["d"].properties[0] = "5"
+    assert second.blocks["d"].properties == ["3"]
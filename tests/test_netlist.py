@@ -0,0 +1,37 @@
+import pytest
+
+from cm2.circuitry.builder import *
+from cm2.circuitry.netlist import module_to_netlist, netlist_to_module
+from cm2.modules.hdlm import HugeMemory
+from cm2.modules.stdm import Mux
+
+def building_fields(m: Module):
+    return {
+        key: (
+            b.name, b.building_type, b.cframe.pos, b.cframe.rot, b.data,
+            [[(bw.building, bw.index, bw.port, bw.src) for bw in w] for w in b.wires]
+        )
+        for key, b in m.buildings.items()
+    }
+
+@pytest.mark.parametrize("compression", ["zlib", "none"])
+def test_netlist_round_trip(tmp_path, compression: str):
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes([1, 0, 2, 0]))
+    m = Mux("mux", 4, 2)
+    m.set_link("selected", "output")
+    m.add([
+        Node("a", pos=(0.5, 1, -2)),
+        HugeMemory("mem", ["a"], [], None, ["output.0"], (4, 0, 4), data=str(image))
+    ])
+    m.wires["custom"] = Wire("a", "decoder.input.0", inverted=True)
+
+    path = str(tmp_path / "mux.cm2net")
+    module_to_netlist(m, path, compression)
+    loaded = netlist_to_module(path)
+
+    assert list(loaded.blocks) == list(m.blocks) and list(loaded.wires) == list(m.wires)
+    assert loaded.ports == m.ports
+    assert loaded.links == m.links
+    assert building_fields(loaded) == building_fields(m)
+    assert loaded.save(str(tmp_path / "loaded.txt")) == m.save(str(tmp_path / "original.txt"))
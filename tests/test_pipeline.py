@@ -0,0 +1,152 @@
+import collections
+import random
+import sys
+
+import pytest
+
+from cm2.circuitry.core import *
+from cm2.modules.stdm import Adder, BrentKungAdder, HanCarlsonAdder, KoggeStoneAdder
+
+sys.setrecursionlimit(100000)
+
+class Simulator:
+    """Tick accurate simulation of the blocks of a module, with some nodes driven from outside"""
+
+    def __init__(self, module: Module):
+        graph = module.get_block_graph()
+        self.kind = {name: d["block"].block_id for name, d in graph.items()}
+        self.inputs = {name: [i["block"].name for i in d["inputs"]] for name, d in graph.items()}
+        self.value = dict.fromkeys(graph, False)
+        self.history = {
+            name: collections.deque([False] * int(d["block"].properties[0]), maxlen=int(d["block"].properties[0]))
+            for name, d in graph.items() if self.kind[name] == "delay"
+        }
+        self.driven: Dict[str, bool] = {}
+        self.nodes: List[str] = []
+        seen: set[str] = set()
+
+        def visit(name: str):
+            if name in seen:
+                return
+            seen.add(name)
+            for i in self.inputs[name]:
+                if self.kind[i] == "node":
+                    visit(i)
+            self.nodes.append(name)
+
+        for name in graph:
+            if self.kind[name] == "node":
+                visit(name)
+
+    def resolve(self):
+        for name in self.nodes:
+            self.value[name] = self.driven[name] if name in self.driven else any(self.value[i] for i in self.inputs[name])
+
+    def tick(self):
+        self.resolve()
+        new: Dict[str, bool] = {}
+        for name, kind in self.kind.items():
+            values = [self.value[i] for i in self.inputs[name]]
+            if kind == "node":
+                continue
+            elif kind in ("and", "nand"):
+                new[name] = (bool(values) and all(values)) != (kind == "nand")
+            elif kind in ("or", "nor"):
+                new[name] = any(values) != (kind == "nor")
+            elif kind in ("xor", "xnor"):
+                new[name] = (sum(values) % 2 == 1) != (kind == "xnor")
+            elif kind == "delay":
+                self.history[name].append(any(values))
+                new[name] = self.history[name][0]
+            else:
+                raise NotImplementedError(kind)
+        self.value.update(new)
+        self.resolve()
+
+def pipelined_outputs_match(build, stage_depth: int, vectors: int = 12) -> bool:
+    reference, pipelined = build(), build()
+    inputs = reference._get_port_blocks("input")
+    outputs = reference._get_port_blocks("output")
+    latency = reference.auto_balance()
+    stages = pipelined.auto_pipeline(stage_depth)
+
+    rng = random.Random(1)
+    patterns = [{i: rng.random() < 0.5 for i in inputs} for _ in range(vectors)]
+    expected = []
+    settled = Simulator(reference)
+    for pattern in patterns:
+        settled.driven = pattern
+        for _ in range(latency + 2):
+            settled.tick()
+        expected.append([settled.value[o] for o in outputs])
+
+    period = 2 * stage_depth
+    total = vectors * period + latency + 4 * stages * period
+    simulator = Simulator(pipelined)
+    trace = []
+    for t in range(total):
+        simulator.driven = dict(patterns[min(t // period, vectors - 1)])
+        simulator.driven["clock"] = t % period < stage_depth
+        simulator.tick()
+        trace.append([simulator.value[o] for o in outputs])
+
+    # Each vector must show up one period after the last, at some fixed lag
+    return any(
+        all(lag + k * period < total and trace[lag + k * period] == expected[k] for k in range(vectors))
+        for lag in range(total)
+    )
+
+@pytest.mark.parametrize("build", [
+    lambda: Adder("add", 8),
+    lambda: BrentKungAdder("add", 8),
+    lambda: KoggeStoneAdder("add", 16),
+    lambda: BrentKungAdder("add", 16),
+    lambda: HanCarlsonAdder("add", 16),
+])
+@pytest.mark.parametrize("stage_depth", [2, 3, 4])
+def test_pipelined_adders_match(build, stage_depth):
+    assert pipelined_outputs_match(build, stage_depth)
+
+def gates() -> Module:
+    m = Module("gates")
+    outputs = ["masked", "differ", "left", "middle", "right"]
+    m.set_ports({"input": ["a", "b", "c"], "output": [f"out.{name}" for name in outputs]})
+    m.add([Block(name, "node") for name in ["a", "b", "c"] + [f"out.{name}" for name in outputs]])
+    m.add([
+        Block("zero", "and"), # Constant, and() is off
+        Block("masked", "and"), Wire("zero", "masked"), Wire("a", "masked"),
+        Block("same", "xnor"), Wire("a", "same"), Wire("b", "same"),
+        Block("differ", "nor"), Wire("same", "differ"),
+        Block("shared", "xor"), Wire("b", "shared"), Wire("c", "shared"),
+        Block("left", "xor"), Wire("shared", "left"), Wire("a", "left"),
+        Block("middle", "xor"), Wire("shared", "middle"), Wire("b", "middle"),
+        Block("right", "xor"), Wire("shared", "right"), Wire("differ", "right")
+    ])
+    m.add([Wire(name, f"out.{name}") for name in outputs])
+    return m
+
+def alu() -> Module:
+    from cm2.circuitry.hdl import json_to_module
+    return json_to_module(os.path.join(os.path.dirname(__file__), "..", "examples", "verilog", "alu", "build", "ALU.json"))["ALU"]
+
+@pytest.mark.parametrize("build", [gates, lambda: KoggeStoneAdder("add", 8), alu])
+def test_collapsed_gates_match(build):
+    reference, collapsed = build(), build()
+    collapsed.collapse_gates()
+    depth = max(reference.get_arrival_times().values())
+    assert len(collapsed.wires) <= len(reference.wires)
+    assert max(collapsed.get_arrival_times().values()) <= depth
+
+    inputs = reference._get_port_blocks("input")
+    outputs = reference._get_port_blocks("output")
+    rng = random.Random(2)
+    for _ in range(16):
+        pattern = {i: rng.random() < 0.5 for i in inputs}
+        results = []
+        for m in (reference, collapsed):
+            simulator = Simulator(m)
+            simulator.driven = pattern
+            for _ in range(depth + 2):
+                simulator.tick()
+            results.append([simulator.value[o] for o in outputs])
+        assert results[0] == results[1]
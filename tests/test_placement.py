@@ -0,0 +1,9 @@
+from cm2.circuitry.builder import *
+
+def test_place_with_only_port_wires():
+    m = Module("gate")
+    m.set_ports({"input": ["a", "b"], "output": ["o"]})
+    m.add([Node("a", "g"), Node("b", "g"), And("g", "o"), Node("o")])
+    m.auto_place()
+    positions = {(b.pos.x, b.pos.y, b.pos.z) for b in m.blocks.values()}
+    assert len(positions) == len(m.blocks)
@@ -0,0 +1,23 @@
+from cm2.circuitry.builder import *
+from cm2.modules.hdlm import HugeMemory
+from cm2.modules.stdm import Mux
+
+def test_incremental_save_follows_wire_changes(tmp_path):
+    m = Mux("mux", 4, 3)
+    m.save(str(tmp_path / "before.txt"))
+    m.get_latency_matrix()
+    wire = next(iter(m.wires.values()))
+    wire.src = next(name for name, c in m.blocks.items() if isinstance(c, Block) and name not in (wire.src, wire.dst))
+    assert m._latency is None
+
+    m.save(str(tmp_path / "incremental.txt"))
+    m._copy(m.name).save(str(tmp_path / "fresh.txt"))
+    assert (tmp_path / "incremental.txt").read_text() == (tmp_path / "fresh.txt").read_text()
+    assert (tmp_path / "incremental.txt").read_text() != (tmp_path / "before.txt").read_text()
+
+def test_save_leaves_the_data_section_empty(tmp_path):
+    image = tmp_path / "image.bin"
+    image.write_bytes(bytes([1, 0, 2, 0]))
+    m = Module("rom")
+    m.add([Node("a"), HugeMemory("mem", ["a"], [], None, [], data=str(image))])
+    assert m.save(str(tmp_path / "rom.txt")).endswith("?")
@@ -0,0 +1,31 @@
+import os
+import shutil
+import socket
+import threading
+
+import pytest
+
+from cm2.circuitry.client import request
+from cm2.circuitry.server import CompileCache, CompileServer
+
+NETLIST = os.path.join(os.path.dirname(__file__), "..", "examples", "verilog", "alu", "build", "ALU.json")
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="The compile server needs Unix sockets")
+def test_server_compiles_like_in_process(tmp_path):
+    netlist = str(tmp_path / "ALU.json")
+    shutil.copyfile(NETLIST, netlist)
+    path = str(tmp_path / "compile.sock")
+    server = CompileServer(path, idle=30)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        served = request(path, {"command": "compile", "json": netlist, "top": "ALU", "output": str(tmp_path / "served.txt")})
+    finally:
+        request(path, {"command": "stop"})
+        thread.join()
+    assert not os.path.exists(path)
+
+    local = CompileCache().compile(netlist, "ALU", str(tmp_path / "local.txt"))
+    assert served["ok"] and not served["cached"]
+    assert (served["blocks"], served["wires"]) == (local["blocks"], local["wires"])
+    assert (tmp_path / "served.txt").read_text() == (tmp_path / "local.txt").read_text()
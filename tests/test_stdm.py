@@ -0,0 +1,45 @@
+import random
+import sys
+
+import numpy as np
+import pytest
+
+from cm2.modules.stdm import DaddaMultiplier, PredecodedDecoder, WallaceMultiplier
+from test_pipeline import Simulator
+
+sys.setrecursionlimit(100000)
+
+def bits(value: int, size: int):
+    return [bool(value >> (size - k - 1) & 1) for k in range(size)]
+
+@pytest.mark.parametrize("build", [DaddaMultiplier, WallaceMultiplier])
+@pytest.mark.parametrize("size", [2, 3, 4, 5])
+def test_tree_multiplier_products_share_one_latency(build, size: int):
+    m = build("mul", size)
+    summary = m.get_latency_matrix()
+    reached = summary.longest >= 0
+    latency = int(summary.longest.max())
+    assert summary.is_balanced()
+    assert np.all(~reached | ((summary.longest == latency) & (summary.shortest == latency)))
+
+    rng = random.Random(size)
+    sim = Simulator(m)
+    for _ in range(8):
+        a, b = rng.randrange(1 << size), rng.randrange(1 << size)
+        sim.driven = {
+            **{f"input.0.{k}": bit for k, bit in enumerate(bits(a, size))},
+            **{f"input.1.{k}": bit for k, bit in enumerate(bits(b, size))}
+        }
+        for _ in range(latency + 2):
+            sim.tick()
+        assert [sim.value[f"output.{k}"] for k in range(2 * size)] == bits(a * b, 2 * size)
+
+@pytest.mark.parametrize("size, groups", [(1, 1), (2, 1), (2, 2), (4, 2), (5, 3)])
+def test_predecoded_decoder_selects_one_output(size: int, groups: int):
+    dc = PredecodedDecoder("dc", size, groups)
+    sim = Simulator(dc)
+    for value in range(1 << size):
+        sim.driven = {f"input.{k}": bit for k, bit in enumerate(bits(value, size))}
+        for _ in range(4):
+            sim.tick()
+        assert [sim.value[f"output.{i}"] for i in range(1 << size)] == [i == value for i in range(1 << size)]
@@ -0,0 +1,27 @@
+import sys
+
+import numpy as np
+
+from cm2.circuitry.builder import *
+from cm2.modules.stdm import Adder, Mux
+
+sys.setrecursionlimit(100000)
+
+def chained(name: str) -> Module:
+    m = Module(name)
+    m.set_ports({"input": ["add.input.0", "add.input.1", "add.input.2", "mux.decoder.input"], "output": ["mux.output"]})
+    m.add([Adder("add", 4), Mux("mux", 4, 2)])
+    m.add(Wire("add.output.0", "mux.input.0"))
+    return m
+
+def test_merge_summarizes_instances_on_first_use():
+    m = chained("top")
+    assert not m._summaries and set(m._pending_summaries) == {"add", "mux"}
+
+    summarized = m.get_latency_matrix()
+    assert not m._pending_summaries and set(m._summaries) == {"add", "mux"}
+    flat = chained("top")
+    flat.mark_dirty()
+    expected = flat.get_latency_matrix()
+    assert np.array_equal(summarized.longest, expected.longest)
+    assert np.array_equal(summarized.shortest, expected.shortest)